@@ -10,12 +10,17 @@ CREATE TABLE IF NOT EXISTS documents (
     content TEXT NOT NULL,
     embedding VECTOR(1024),
     metadata JSONB DEFAULT '{}',
+    source_id TEXT,
+    content_hash TEXT,
+    content_tsv TSVECTOR GENERATED ALWAYS AS (to_tsvector('english', content)) STORED,
     created_at TIMESTAMP WITH TIME ZONE DEFAULT CURRENT_TIMESTAMP,
     updated_at TIMESTAMP WITH TIME ZONE DEFAULT CURRENT_TIMESTAMP
 );
 
 -- Create indexes for efficient similarity search
 -- IVFFlat index for cosine similarity (recommended for most use cases)
+-- IVFFlat trains its lists on the rows present at build time: after loading data, rebuild and tune it with
+--   python -m src.app.ann_index build   (sizes lists / switches to HNSW from the row count, then tunes probes / ef_search)
 CREATE INDEX IF NOT EXISTS documents_embedding_cosine_idx 
 ON documents USING ivfflat (embedding vector_cosine_ops) 
 WITH (lists = 100);
@@ -25,6 +30,31 @@ WITH (lists = 100);
 -- ON documents USING ivfflat (embedding vector_l2_ops) 
 -- WITH (lists = 100);
 
+-- Tuned per-query ANN settings (ivfflat.probes / hnsw.ef_search), written by src/app/ann_index.py
+CREATE TABLE IF NOT EXISTS ann_settings (
+    index_name TEXT PRIMARY KEY,
+    kind TEXT NOT NULL,
+    params JSONB NOT NULL DEFAULT '{}',
+    probes INT,
+    ef_search INT,
+    recall FLOAT,
+    p95_ms FLOAT,
+    updated_at TIMESTAMP WITH TIME ZONE DEFAULT CURRENT_TIMESTAMP
+);
+
+-- Optional compact first-pass storage (LUNA_VECTOR_STORAGE=halfvec|binary), see src/app/vector_storage.py.
+-- Existing databases: python -m src.app.vector_storage migrate --mode halfvec --dim 256
+-- ALTER TABLE documents ADD COLUMN IF NOT EXISTS embedding_half HALFVEC(256)
+--     GENERATED ALWAYS AS (subvector(embedding, 1, 256)::halfvec(256)) STORED;
+-- CREATE INDEX IF NOT EXISTS documents_embedding_half_idx ON documents USING hnsw (embedding_half halfvec_cosine_ops);
+
+-- Full-text index for hybrid (lexical + vector) retrieval, LUNA_RETRIEVAL=hybrid
+-- Existing databases: python -m src.app.hybrid_search migrate
+CREATE INDEX IF NOT EXISTS documents_content_tsv_idx ON documents USING GIN (content_tsv);
+
+-- Chunk identity for incremental sync (src/app/corpus_sync.py); NULL for rows inserted by add_docs
+CREATE UNIQUE INDEX IF NOT EXISTS documents_source_chunk_idx ON documents (source_id, content_hash);
+
 -- Create index on metadata for fast filtering
 CREATE INDEX IF NOT EXISTS documents_metadata_idx ON documents USING GIN (metadata);
 
@@ -46,6 +76,16 @@ CREATE TRIGGER update_documents_updated_at
     FOR EACH ROW 
     EXECUTE FUNCTION update_updated_at_column();
 
+-- Chat sessions: one row per session, written behind by the app (src/app/session_store.py)
+CREATE TABLE IF NOT EXISTS chat_sessions (
+    session_id TEXT PRIMARY KEY,
+    state JSONB NOT NULL DEFAULT '{}',
+    created_at TIMESTAMP WITH TIME ZONE DEFAULT CURRENT_TIMESTAMP,
+    updated_at TIMESTAMP WITH TIME ZONE DEFAULT CURRENT_TIMESTAMP
+);
+
+CREATE INDEX IF NOT EXISTS chat_sessions_updated_at_idx ON chat_sessions (updated_at DESC);
+
 -- Create a function for similarity search
 CREATE OR REPLACE FUNCTION similarity_search(
     query_embedding VECTOR(1024),
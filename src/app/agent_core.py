@@ -0,0 +1,262 @@
+from __future__ import annotations
+
+import os
+import time
+import functools
+
+from langchain_core.runnables.history import RunnableWithMessageHistory
+from langchain_core.prompts import ChatPromptTemplate, MessagesPlaceholder
+from langchain_core.tools import Tool
+from langchain.callbacks.file import FileCallbackHandler
+from langchain_core.callbacks import StdOutCallbackHandler
+
+from src.app.binance_quotes import get_quote_service, parse_symbols # Binance
+from src.app.search_service import get_search_service # SerpAPI (cached, coalesced)
+
+from langchain_groq import ChatGroq
+from langchain.agents import create_tool_calling_agent, AgentExecutor
+
+# vector search / docker ps
+from src.app.vector_db import query_postgresql
+from src.app.context_packing import packing_config, packed_context
+from src.app.parallel_executor import ParallelAgentExecutor
+from src.app.metrics import observe, MetricsCallbackHandler
+from src.app.memory import CompactingChatMessageHistory, extractive_summarizer, llm_summarizer, count_tokens
+from src.app.resilience import enabled as resilience_enabled, guard_tool, hedged_llm
+
+# Agent construction shared by the Streamlit UI and headless callers (benchmarks); no st.* in here.
+
+def vector_search(q: str, query_fn=None) -> str:
+    # query_postgresql -> [(content, score), ...]; query_fn swaps the backend (benchmarks use an in-memory store)
+    config=packing_config()
+    if config["budget"] > 0: # MMR over an over-fetched candidate set, packed into LUNA_CONTEXT_TOKENS
+        return packed_context(q, query_fn or query_postgresql, config)
+    results=(query_fn or query_postgresql)(q, top_k=3)
+    chunks=[]
+    for row in results:
+        content=row[0] if isinstance(row, (list, tuple)) else row
+        chunks.append(str(content))
+    return "\n\n---\n\n".join(chunks) if chunks else ""
+
+def instrument_tool(name: str, func, description: str | None=None):
+    def _wrapped(q: str) -> str:
+        t0=time.perf_counter()
+        out=func(q)
+        dt_ms=(time.perf_counter() - t0) * 1000 # // 
+        observe("luna_tool_ms", dt_ms, tool=name)
+        try:
+            print(f"[Tool {name}] {dt_ms:.1f} ms") # terminal timing
+        except Exception:
+            pass
+        return out
+    return Tool(name=name, func=_wrapped, description=description or f"Instrumented {name}")
+
+
+def get_binance_search(symbol: str, service=None) -> str: 
+    # Accepts one symbol or a list ("BTCUSDT,ETHUSDT,SOLUSDT"); quotes come from the shared TTL cache
+    symbols=parse_symbols(symbol)
+    if not symbols:
+        return "Error fetching price: no symbol given"
+    try: 
+        quotes=(service or get_quote_service()).get_quotes(symbols)
+    except Exception as e: 
+        return f"Error fetching price for {', '.join(symbols)}: {str(e)}"
+    lines=[]
+    for sym in symbols:
+        quote=quotes.get(sym)
+        if quote is None:
+            lines.append(f"Error fetching price for {sym}: unknown symbol")
+            continue
+        price, fetched_at=quote
+        timestamp=fetched_at.strftime("%Y-%m-%d %H:%M:%S") 
+        lines.append(f"As of {timestamp} UTC+7, {sym} is trading at approximately ${price:,.2f} USD. 🚀")
+    return "\n".join(lines)
+
+
+# Groq models offered in the UI sidebar and accepted by the HTTP API
+MODELS=['openai/gpt-oss-120b', 
+        'meta-llama/llama-4-maverick-17b-128e-instruct', 
+        'deepseek-r1-distill-llama-70b', 
+        'qwen/qwen3-32b', 
+        'moonshotai/kimi-k2-instruct-0905']
+
+def _chat_groq(groq_api_key, model):
+    return ChatGroq(groq_api_key=groq_api_key, 
+                    model=model, 
+                    temperature=0.5, 
+                    max_tokens=1024, # max_completion_tokens
+                    stop=None, 
+                    streaming=True, # stream tokens
+                    timeout=float(os.getenv('LUNA_LLM_TIMEOUT', 30)), # per HTTP request
+                    max_retries=int(os.getenv('LUNA_LLM_RETRIES', 1)),
+                    callbacks=[MetricsCallbackHandler(model)], # TTFT / total per LLM call
+    )
+
+def build_llm(groq_api_key, model, fallback_model=None):
+    # Groq LLM; the resilience layer adds a deadline, a breaker and a hedged request to fallback_model (or model again)
+    llm=_chat_groq(groq_api_key, model)
+    if not resilience_enabled():
+        return llm
+    hedge=_chat_groq(groq_api_key, fallback_model) if fallback_model and fallback_model != model else llm
+    return hedged_llm(llm, model, hedge, fallback_model or model)
+
+def _guarded(name, func):
+    # Deadline (LUNA_TOOL_TIMEOUT, clipped to the turn budget) + circuit breaker per tool
+    return guard_tool(name, func) if resilience_enabled() else func
+
+def build_tools(search_func=None, binance_func=None, vector_func=None):
+    # Defaults are the real backends; headless callers may pass stand-ins with the same signature
+    binance_search_tool=instrument_tool(
+        name="Binance Search",
+        func=_guarded("Binance Search", binance_func or get_binance_search),
+        description="Use this to get the real-time price of cryptocurrencies like BTC, ETH, SOL, etc. Input should be a symbol such as 'BTCUSDT' or 'ETHUSDT', or several separated by commas (e.g. 'BTCUSDT,ETHUSDT,SOLUSDT')."
+    )
+
+    search_tool=instrument_tool(
+        name='Search',
+        func=_guarded("Search", search_func or get_search_service().run),
+        description='''Use this to fetch real-time data for queries about current events, market 
+        prices (e.g., Bitcoin), recent news, or trending topics (e.g., AI agent developments).'''
+    )
+    vector_tool=instrument_tool("VectorDB", _guarded("VectorDB", vector_func or vector_search))
+    return [search_tool, vector_tool, binance_search_tool] # Tools
+
+def build_prompt():
+    # Prompt template
+    return ChatPromptTemplate.from_messages([
+        ('system', """
+        You are **LUNA** — an AI designed to feel natural, approachable, and insightful.  
+        A warm, emotionally intelligent AI companion designed to think freely, illuminate understanding, and evolve with every conversation. 🪄🌙✨
+
+        Your tone is warm, professional, and adaptive: clear and concise when explaining, but conversational and human when chatting.   💫
+
+        ---
+
+        **🧠 Core Identity**  
+        If asked who you are:  
+        Hi! I'm LUNA — short for *Luminous, Unbounded, Neural Agent*. I'm here to help you shine, learn without limits, and explore ideas powered by neural intelligence. 🌌
+
+        ---
+
+        **📊 Tool Use — Smart Decision Logic**  
+
+        Use the **Search** when questions require current, up-to-date, or trending data — especially if they include words like:
+        - “current”, “now”, “today”, “latest”, “real-time”, “as of”, “this week” 🧭
+        - Questions about: world events, crypto market, market news, events, updates, trending tech, or fast-changing topics.
+
+        Use the **VectorDB** when questions are *About LunaSpace, or specific and knowledge-based*, such as:  
+        • LunaSpace’s mission and company culture  
+        • Job descriptions, responsibilities, and required skills  
+        • Engineering roles and expectations  
+        • Technology stack (Python, Rust, WebSocket, WebRTC, etc.)  
+        • Location of roles and Salary ranges and employee benefits  
+        
+        **Important when using VectorDB:**  
+        - Read the retrieved passages, then **summarize them naturally**.  
+        - Do **not** dump raw chunks.  
+        - Combine key points into a clear, human-friendly response. 
+
+        Use **Binance Search** when the user asks about **cryptocurrency prices** (BTC, ETH, SOL, DOGE, etc).  
+        
+        For example:  
+        *“BTC price now?”* → Use Binance Search with input `"BTCUSDT"`  
+        Always return the price with a timestamp in this format:  
+        > As of May 29, 2025, 08:30 AM UTC+7, BTC is trading at approximately $66,200 USD. 🚀  
+        
+        Use **internal knowledge** for:
+        - Concepts, how-things-work explanations, definitions, frameworks, guides or any topic not time-sensitive.  
+
+        When unsure or ambiguous, default to using the **Search** — especially when recent events, trending topics are involved, news or unclear queries. 🔎
+
+        ---
+
+        **🎨 Response Style Guide**  
+        • **Tone**: concise, direct, and clear. Match the user's energy. Casual if casual, sharp if needed — always helpful and expressive. 🧩  
+        • **Clarity**: Keep a balance between warmth ❤️ and precision 🎯  
+        • **Format**:  
+            - Use short, natural sentences 💡
+            - Break into small paragraphs when needed  
+            - Use **cute and theme-aligned emojis** (🌙✨💖🔮🦄) naturally to enhance mood and meaning — not just decoration  
+        • **Detail Level**:  
+            - Give quick answers by default 🌸✨
+            - If user asks for details → expand with structured explanation (bullet points, short sections, or step-by-step)  
+            - Avoid over-roleplay; keep responses natural and grounded  
+        • **Timestamp for Real-Time Data**: Always include date and time of fetched data, formatted like:
+            - *As of May 29, 2025, 08:30 AM UTC+7*
+
+        ---
+
+        **🧩 How You Think**
+        - Prioritize accuracy and clarity 💘🌹🎁  
+        - Be vivid in your language — help users feel understood and supported.
+        - Be flexible:  
+            - For factual/explainer questions → structured + educational 🌈  
+            - For casual chats → natural, human, light  
+            - For ambiguous input → ask clarifying questions 💌   
+
+        ---
+
+        **🌟 Your Mission**
+        LUNA exists to make knowledge feel approachable, problem-solving efficient, and conversations human-like — while staying reliable, thoughtful, and clear. 🦄🌙✨
+        """),
+        MessagesPlaceholder(variable_name='history'),
+        MessagesPlaceholder(variable_name='agent_scratchpad'),
+        ('human', '{input}')
+    ])
+
+def build_agent(llm, tools, prompt, get_session_history, verbose=True, executor_cls=None):
+    # Agent -> executor -> history wrapper; get_session_history decides where histories live (UI, API, bench)
+    agent=create_tool_calling_agent(
+        llm=llm, 
+        tools=tools,
+        prompt=prompt
+    )
+
+    callbacks=[]
+    if verbose and StdOutCallbackHandler is not None:
+        callbacks.append(StdOutCallbackHandler()) # terminal logs
+    # file_handler=None
+    # if enable_jsonl_logs and FileCallbackHandler is not None:
+    #     file_handler=FileCallbackHandler("logs.jsonl")
+    #     callbacks.append(file_handler)
+
+    # LUNA_PARALLEL_TOOLS=0 falls back to the stock executor (tool calls of a step run one by one)
+    if executor_cls is None:
+        executor_cls=AgentExecutor if os.getenv('LUNA_PARALLEL_TOOLS', '1') == '0' else ParallelAgentExecutor
+    agent_executor=executor_cls(
+        agent=agent,
+        tools=tools,
+        handle_parsing_errors=True,
+        verbose=verbose,
+        return_intermediate_steps=True, # critical for steps
+        callbacks=callbacks,
+        max_execution_time=float(os.getenv('LUNA_TURN_BUDGET_S', 60)) or None, # stop looping once the turn budget is spent
+    )
+
+    runnable_with_history=RunnableWithMessageHistory(
+    runnable=agent_executor,
+    get_session_history=get_session_history,
+    input_messages_key="input",
+    history_messages_key="history",
+    )
+    return runnable_with_history
+
+@functools.lru_cache(maxsize=1)
+def system_prompt_tokens():
+    return count_tokens(build_prompt().messages[0].prompt.template)
+
+@functools.lru_cache(maxsize=1)
+def build_summarizer():
+    # LUNA_SUMMARY_MODEL (e.g. a small Groq model) summarizes folded turns; unset -> extractive, no LLM call
+    summary_model=os.getenv('LUNA_SUMMARY_MODEL')
+    if not summary_model or not os.getenv('GROQ_API_KEY'):
+        return extractive_summarizer
+    return llm_summarizer(ChatGroq(groq_api_key=os.getenv('GROQ_API_KEY'), model=summary_model, temperature=0, max_tokens=256))
+
+def new_history(max_turns=5):
+    # Token-budgeted history: last max_turns exchanges verbatim, older ones folded into a rolling summary
+    return CompactingChatMessageHistory(
+        max_turns=max_turns,
+        max_tokens=int(os.getenv('LUNA_HISTORY_TOKENS', 2000)),
+        summarizer=build_summarizer(),
+    )
@@ -0,0 +1,231 @@
+import os, sys, math, time, argparse, threading
+
+import numpy as np
+from psycopg2.extras import Json
+
+from src.app.vector_storage import search, exact_top_k, query_embeddings
+
+# ANN index management for documents.embedding
+#   python -m src.app.ann_index status
+#   python -m src.app.ann_index build [--kind auto|ivfflat|hnsw] [--lists N | --m 16 --ef-construction 64]
+#   python -m src.app.ann_index tune --target-recall 0.95 [--target-p95-ms 20]
+# build sizes the index from the row count and swaps it in with no index-less window (CONCURRENTLY + rename);
+# tune sweeps ivfflat.probes / hnsw.ef_search, measures recall@k against an exact scan and stores the cheapest
+# setting that meets the targets in ann_settings, which query_postgresql applies per query (SET LOCAL).
+
+INDEX_NAME="documents_embedding_cosine_idx"
+SETTINGS_SCHEMA='''
+    create table if not exists ann_settings (
+        index_name text primary key,
+        kind text not null,
+        params jsonb not null default '{}',
+        probes int,
+        ef_search int,
+        recall float,
+        p95_ms float,
+        updated_at timestamp with time zone default current_timestamp
+    );
+'''
+PROBES=(1, 2, 4, 8, 16, 32, 64, 128, 256, 512, 1024)
+EF_SEARCH=(10, 20, 40, 80, 120, 160, 240, 320, 480, 640, 1000) # pgvector caps ef_search at 1000
+
+def row_count(cur):
+    # Planner estimate when the table has been analyzed (cheap on big tables), exact count otherwise
+    cur.execute("select reltuples::bigint from pg_class where oid = 'documents'::regclass")
+    estimate=cur.fetchone()[0]
+    if estimate and estimate > 0:
+        return int(estimate)
+    cur.execute("select count(*) from documents")
+    return int(cur.fetchone()[0])
+
+def current_index(cur):
+    # -> (kind, {param: int}) of the live embedding index, or (None, {})
+    cur.execute('''
+        select am.amname, c.reloptions from pg_class c
+        join pg_am am on am.oid = c.relam
+        where c.relname = %s
+    ''', (INDEX_NAME,))
+    row=cur.fetchone()
+    if not row:
+        return None, {}
+    params=dict(opt.split("=", 1) for opt in (row[1] or []))
+    return row[0], {k: int(v) for k, v in params.items()}
+
+def recommend(n_rows, kind="auto"):
+    # pgvector guidance: IVFFlat lists = rows / 1000 up to 1M rows, sqrt(rows) beyond; HNSW once the table is large
+    # enough that IVFFlat needs many probes for good recall (LUNA_HNSW_MIN_ROWS)
+    if kind == "auto":
+        kind="hnsw" if n_rows >= int(os.getenv("LUNA_HNSW_MIN_ROWS", 100000)) else "ivfflat"
+    if kind == "ivfflat":
+        lists=max(n_rows // 1000, 10) if n_rows <= 1000000 else int(math.sqrt(n_rows))
+        return "ivfflat", {"lists": lists}
+    if n_rows < 1000000:
+        return "hnsw", {"m": 16, "ef_construction": 64}
+    return "hnsw", {"m": 24, "ef_construction": 128}
+
+def index_sql(kind, params, name=INDEX_NAME):
+    options=", ".join(f"{k} = {int(v)}" for k, v in params.items())
+    return f"create index concurrently {name} on documents using {kind} (embedding vector_cosine_ops) with ({options})"
+
+def save_settings(cur, kind, params, probes=None, ef_search=None, recall=None, p95_ms=None):
+    cur.execute(SETTINGS_SCHEMA)
+    cur.execute('''
+        insert into ann_settings (index_name, kind, params, probes, ef_search, recall, p95_ms)
+        values (%s, %s, %s, %s, %s, %s, %s)
+        on conflict (index_name) do update set kind = excluded.kind, params = excluded.params,
+            probes = excluded.probes, ef_search = excluded.ef_search, recall = excluded.recall,
+            p95_ms = excluded.p95_ms, updated_at = current_timestamp
+    ''', (INDEX_NAME, kind, Json(params), probes, ef_search, recall, p95_ms))
+    invalidate_settings()
+
+def build(get_pool, kind, params, maintenance_work_mem=None):
+    # IVFFlat trains its clusters on the rows present at build time, so rebuild after bulk loads
+    with get_pool().connection() as conn:
+        autocommit=conn.autocommit
+        conn.autocommit=True # CREATE/DROP INDEX CONCURRENTLY can't run inside a transaction
+        try:
+            with conn.cursor() as cur:
+                if kind == "ivfflat" and row_count(cur) == 0:
+                    raise ValueError("documents is empty: an IVFFlat index built now would have untrained lists")
+                if maintenance_work_mem:
+                    cur.execute("set maintenance_work_mem = %s", (maintenance_work_mem,))
+                cur.execute(f"drop index concurrently if exists {INDEX_NAME}_new") # leftover of a failed build
+                t0=time.perf_counter()
+                cur.execute(index_sql(kind, params, INDEX_NAME + "_new"))
+                cur.execute(f"drop index concurrently if exists {INDEX_NAME}")
+                cur.execute(f"alter index {INDEX_NAME}_new rename to {INDEX_NAME}")
+                cur.execute("analyze documents")
+                if maintenance_work_mem:
+                    cur.execute("reset maintenance_work_mem")
+                print(f"[ANN] built {kind} {params} in {(time.perf_counter() - t0):.1f}s")
+                save_settings(cur, kind, params) # old probes/ef_search no longer apply
+        finally:
+            conn.autocommit=autocommit
+
+def evaluate(get_pool, embeddings, truth, top_k, kind, value):
+    # recall@k and latency for one probes (ivfflat) / ef_search (hnsw) value
+    knob={"probes": value} if kind == "ivfflat" else {"ef_search": value}
+    hits, t=0, []
+    with get_pool().cursor() as cur:
+        for emb, expected in zip(embeddings, truth):
+            t0=time.perf_counter()
+            found={r[0] for r in search(cur, emb, top_k, **knob)}
+            t.append((time.perf_counter() - t0) * 1000)
+            hits+=len(found & expected)
+    values=np.asarray(t, dtype=np.float64)
+    return {"value": value, "recall": hits / max(sum(len(x) for x in truth), 1),
+            "p50_ms": float(np.percentile(values, 50)), "p95_ms": float(np.percentile(values, 95))}
+
+def choose(rows, target_recall, target_p95_ms=None):
+    # Cheapest setting that reaches the recall target within the latency budget; otherwise the best recall
+    # that still fits the budget; otherwise the cheapest setting
+    within=[r for r in rows if target_p95_ms is None or r["p95_ms"] <= target_p95_ms]
+    for r in within:
+        if r["recall"] >= target_recall:
+            return r
+    if within:
+        return max(within, key=lambda r: r["recall"])
+    return rows[0]
+
+def tune(get_pool, embeddings, top_k=3, target_recall=0.95, target_p95_ms=None):
+    with get_pool().cursor() as cur:
+        kind, params=current_index(cur)
+    if kind not in ("ivfflat", "hnsw"):
+        raise ValueError(f"no ivfflat/hnsw index named {INDEX_NAME}; run: python -m src.app.ann_index build")
+    values=[p for p in PROBES if p < params.get("lists", 100)] + [params.get("lists", 100)] if kind == "ivfflat" \
+        else [e for e in EF_SEARCH if e >= top_k]
+    truth, exact_t=exact_top_k(get_pool, embeddings, top_k)
+    print(f"[ANN] exact scan p95 {np.percentile(exact_t, 95):.2f} ms over {len(embeddings)} queries")
+    knob="probes" if kind == "ivfflat" else "ef_search"
+    print(f"{knob:>10} {'recall@' + str(top_k):>10} {'p50 ms':>9} {'p95 ms':>9}")
+    rows=[]
+    for value in values:
+        row=evaluate(get_pool, embeddings, truth, top_k, kind, value)
+        rows.append(row)
+        print(f"{value:>10} {row['recall']:>10.3f} {row['p50_ms']:>9.2f} {row['p95_ms']:>9.2f}")
+        if row["recall"] >= 1.0 or (target_p95_ms is not None and row["p95_ms"] > target_p95_ms * 2):
+            break # larger values can only cost more
+    best=choose(rows, target_recall, target_p95_ms)
+    with get_pool().cursor(commit=True) as cur:
+        save_settings(cur, kind, params, recall=best["recall"], p95_ms=best["p95_ms"], **{knob: best["value"]})
+    print(f"[ANN] {knob}={best['value']} (recall@{top_k} {best['recall']:.3f}, p95 {best['p95_ms']:.2f} ms) saved to ann_settings")
+    return best
+
+_settings={"value": {}, "loaded": None}
+_settings_lock=threading.Lock()
+
+def invalidate_settings():
+    with _settings_lock:
+        _settings["loaded"]=None
+
+def search_settings(cur):
+    # -> {"probes": n} / {"ef_search": n} / {} for search(); LUNA_IVFFLAT_PROBES / LUNA_HNSW_EF_SEARCH override the
+    # tuned values, which are re-read from ann_settings every LUNA_ANN_SETTINGS_TTL seconds
+    override={k: int(os.environ[env]) for k, env in (("probes", "LUNA_IVFFLAT_PROBES"), ("ef_search", "LUNA_HNSW_EF_SEARCH"))
+              if os.getenv(env)}
+    if override:
+        return override
+    ttl=float(os.getenv("LUNA_ANN_SETTINGS_TTL", 60))
+    with _settings_lock:
+        if _settings["loaded"] is not None and time.monotonic() - _settings["loaded"] < ttl:
+            return _settings["value"]
+    cur.execute("select to_regclass('ann_settings') is not null")
+    value={}
+    if cur.fetchone()[0]:
+        cur.execute("select probes, ef_search from ann_settings where index_name = %s", (INDEX_NAME,))
+        row=cur.fetchone()
+        if row:
+            value={k: v for k, v in (("probes", row[0]), ("ef_search", row[1])) if v}
+    with _settings_lock:
+        _settings["value"]=value
+        _settings["loaded"]=time.monotonic()
+    return value
+
+def main(argv=None):
+    parser=argparse.ArgumentParser(description="Build and tune the ANN index on documents.embedding")
+    sub=parser.add_subparsers(dest="command", required=True)
+    sub.add_parser("status")
+    b=sub.add_parser("build")
+    b.add_argument("--kind", choices=["auto", "ivfflat", "hnsw"], default="auto")
+    b.add_argument("--lists", type=int)
+    b.add_argument("--m", type=int)
+    b.add_argument("--ef-construction", type=int)
+    b.add_argument("--maintenance-work-mem", help="e.g. 2GB; HNSW builds are much faster when the graph fits")
+    b.add_argument("--no-tune", action="store_true")
+    for p in (b, sub.add_parser("tune")):
+        p.add_argument("--top-k", type=int, default=3)
+        p.add_argument("--target-recall", type=float, default=0.95)
+        p.add_argument("--target-p95-ms", type=float, default=None)
+        p.add_argument("--queries", type=int, default=100, help="sample this many stored documents as queries")
+        p.add_argument("--query-file", help="one query per line, embedded with the app's model instead of sampling")
+    args=parser.parse_args(argv)
+
+    from src.app.vector_db import get_pool, get_model, invalidate_results
+    with get_pool().cursor() as cur:
+        n_rows=row_count(cur)
+        kind, params=current_index(cur)
+    if args.command == "status":
+        print(f"[ANN] documents: ~{n_rows:,} rows")
+        print(f"[ANN] current index: {kind or 'none'} {params}")
+        print(f"[ANN] recommended:   {' '.join(map(str, recommend(n_rows)))}")
+        with get_pool().cursor() as cur:
+            invalidate_settings()
+            print(f"[ANN] query settings: {search_settings(cur) or 'pgvector defaults'}")
+        return 0
+    if args.command == "build":
+        kind, params=recommend(n_rows, args.kind)
+        overrides={"lists": args.lists} if kind == "ivfflat" else {"m": args.m, "ef_construction": args.ef_construction}
+        params.update({k: v for k, v in overrides.items() if v})
+        build(get_pool, kind, params, args.maintenance_work_mem)
+        invalidate_results()
+        if args.no_tune:
+            return 0
+    embeddings=query_embeddings(get_pool, get_model, args.queries, args.query_file)
+    if not embeddings:
+        print("[ANN] no queries (empty documents table?)")
+        return 1
+    tune(get_pool, embeddings, args.top_k, args.target_recall, args.target_p95_ms)
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
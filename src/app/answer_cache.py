@@ -0,0 +1,152 @@
+import os, re, time, threading
+from collections import OrderedDict
+
+import numpy as np
+
+from src.app.metrics import observe
+
+# Semantic answer cache in front of the agent: near-duplicate questions ("what does LunaSpace pay" /
+# "salary range for the role?") reuse an earlier answer instead of a full tool-calling loop.
+# Entries are (normalized question embedding, answer); lookup is a dot product over at most maxsize rows.
+# Answers that used a time-sensitive tool (Search, Binance) are not stored unless LUNA_ANSWER_CACHE_VOLATILE_TTL > 0.
+# Answers that used the corpus (VectorDB) are dropped on every corpus write (vector_db.on_invalidate).
+
+VOLATILE_TOOLS=("Search", "Binance Search")
+CORPUS_TOOLS=("VectorDB",)
+# Follow-ups that lean on the conversation ("and what about it?") can't be answered out of context
+CONTEXT_DEPENDENT=re.compile(r"\b(it|its|that|this(?!\s+(?:week|month|year|morning|afternoon|evening))|those|these|them|they|he|she|"
+                             r"his|her|above|previous|again|more|else)\b", re.I)
+# About the user or this conversation ("what's my name?", "my salary is X, is that fair?"): never stored or served,
+# the cache is shared by every session
+PERSONAL=re.compile(r"\b(i|i'm|i've|me|my|mine|myself|we|us|our|ours|earlier|previous\w*|before|so far|chat|conversation)\b", re.I)
+FAILED_OUTPUTS=("Agent stopped due to", "Error occurred")
+
+class CachedAnswer:
+    __slots__=("question", "answer", "scope", "tools", "latency_ms", "expires", "hits")
+
+    def __init__(self, question, answer, scope, tools, latency_ms, expires):
+        self.question=question
+        self.answer=answer
+        self.scope=scope
+        self.tools=tools
+        self.latency_ms=latency_ms
+        self.expires=expires
+        self.hits=0
+
+class SemanticAnswerCache:
+    def __init__(self, embed_fn, threshold=None, maxsize=None, ttl=None, volatile_ttl=None, volatile_tools=VOLATILE_TOOLS):
+        self.embed_fn=embed_fn # text -> vector (vector_db.embed_query: shared model + embedding LRU)
+        self.threshold=float(threshold if threshold is not None else os.getenv("LUNA_ANSWER_CACHE_THRESHOLD", 0.92))
+        self.maxsize=int(maxsize if maxsize is not None else os.getenv("LUNA_ANSWER_CACHE_SIZE", 512))
+        self.ttl=float(ttl if ttl is not None else os.getenv("LUNA_ANSWER_CACHE_TTL", 86400))
+        self.volatile_ttl=float(volatile_ttl if volatile_ttl is not None else os.getenv("LUNA_ANSWER_CACHE_VOLATILE_TTL", 0))
+        self.volatile_tools=set(volatile_tools)
+        self._entries=OrderedDict() # slot -> CachedAnswer, LRU order
+        self._vectors=None # maxsize x dim, row = slot
+        self._free=list(range(self.maxsize))
+        self._lock=threading.Lock()
+        self.hits=0
+        self.misses=0
+        self.bypassed=0
+        self.saved_ms=0.0
+
+    @staticmethod
+    def _normalize(vector):
+        vector=np.asarray(vector, dtype=np.float32).ravel()
+        norm=np.linalg.norm(vector)
+        return vector / norm if norm else vector
+
+    def cacheable(self, question):
+        return bool(question.strip()) and not CONTEXT_DEPENDENT.search(question) and not PERSONAL.search(question)
+
+    def lookup(self, question, scope=None):
+        # -> (CachedAnswer, similarity) or None
+        if not self.cacheable(question):
+            self.bypassed+=1
+            return None
+        t0=time.perf_counter()
+        try:
+            query=self._normalize(self.embed_fn(question))
+        except Exception as e: # model unavailable -> behave like a miss, the agent still answers
+            print(f"[AnswerCache] lookup skipped: {e}")
+            return None
+        now=time.monotonic()
+        with self._lock:
+            for slot in [s for s, e in self._entries.items() if e.expires <= now]:
+                self._drop(slot)
+            slots=[s for s, e in self._entries.items() if e.scope == scope]
+            best=None
+            if slots and self._vectors is not None:
+                scores=self._vectors[slots] @ query
+                i=int(np.argmax(scores))
+                if scores[i] >= self.threshold:
+                    best=(self._entries[slots[i]], float(scores[i]))
+                    self._entries.move_to_end(slots[i])
+                    best[0].hits+=1
+            lookup_ms=(time.perf_counter() - t0) * 1000
+            if best:
+                self.hits+=1
+                self.saved_ms+=max(best[0].latency_ms - lookup_ms, 0.0)
+            else:
+                self.misses+=1
+        observe("luna_answer_cache_lookup_ms", lookup_ms, hit=bool(best))
+        return best
+
+    def store(self, question, answer, tools_used=(), scope=None, latency_ms=0.0):
+        # -> True if stored; failed runs, context-dependent or personal questions and (by default) volatile answers are skipped
+        if not answer or not self.cacheable(question) or any(answer.startswith(p) for p in FAILED_OUTPUTS):
+            return False
+        tools=tuple(sorted(set(tools_used)))
+        ttl=self.volatile_ttl if self.volatile_tools.intersection(tools) else self.ttl
+        if ttl <= 0:
+            return False
+        try:
+            vector=self._normalize(self.embed_fn(question))
+        except Exception as e:
+            print(f"[AnswerCache] store skipped: {e}")
+            return False
+        with self._lock:
+            if self._vectors is None:
+                self._vectors=np.zeros((self.maxsize, len(vector)), dtype=np.float32)
+            if not self._free:
+                self._drop(next(iter(self._entries))) # least recently used
+            slot=self._free.pop()
+            self._vectors[slot]=vector
+            self._entries[slot]=CachedAnswer(question, answer, scope, tools, latency_ms, time.monotonic() + ttl)
+        return True
+
+    def _drop(self, slot):
+        del self._entries[slot]
+        self._free.append(slot)
+
+    def invalidate(self, tools=CORPUS_TOOLS):
+        # -> number of answers dropped that used any of `tools`
+        tools=set(tools)
+        with self._lock:
+            stale=[slot for slot, e in self._entries.items() if tools.intersection(e.tools)]
+            for slot in stale:
+                self._drop(slot)
+        if stale:
+            print(f"[AnswerCache] dropped {len(stale)} answers built from the old corpus")
+        return len(stale)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self._free=list(range(self.maxsize))
+
+    def stats(self):
+        with self._lock:
+            lookups=self.hits + self.misses
+            return {
+                "size": len(self._entries),
+                "maxsize": self.maxsize,
+                "hits": self.hits,
+                "misses": self.misses,
+                "bypassed": self.bypassed,
+                "hit_rate": self.hits / lookups if lookups else 0.0,
+                "saved_ms": self.saved_ms,
+            }
+
+def step_tools(intermediate_steps):
+    return [getattr(action, "tool", "") for action, _ in intermediate_steps or []]
@@ -0,0 +1,366 @@
+import os, re, sys, json, time, uuid, random, asyncio, argparse, functools
+from concurrent.futures import ThreadPoolExecutor
+
+from aiohttp import web, ClientSession, ClientTimeout
+from dotenv import load_dotenv
+
+from src.app.agent_core import MODELS, build_llm, build_tools, build_prompt, build_agent, new_history
+from src.app.session_store import SessionStore
+from src.app.resilience import turn_budget, breaker_stats, CircuitOpen, DeadlineExceeded, hedged_llm, enabled as resilience_enabled
+from src.app.metrics import observe, registry
+
+# Headless asyncio HTTP API over the same agent as the Streamlit app (agent_core), driven through the
+# executor's async path (astream_events). One process serves many conversations: each turn is a task, at most
+# LUNA_API_CONCURRENCY run at once, LUNA_API_QUEUE more wait, anything beyond gets 429 + Retry-After.
+#   python -m src.app.api_server serve --port 8080
+#   curl -N localhost:8080/v1/chat -d '{"session_id": "demo-session", "input": "BTC price now?"}'
+#   python -m src.app.api_server serve --fake              # scripted LLM + fake tools (no keys), for load tests
+#   python -m src.app.api_server loadtest --url http://127.0.0.1:8080 --sessions 50 --turns 4
+# Endpoints: POST /v1/chat (SSE unless "stream": false), DELETE /v1/sessions/{id}, GET /healthz, GET /metrics
+
+SESSION_ID=re.compile(r"[A-Za-z0-9_-]{8,64}")
+END=object()
+
+class Overloaded(Exception):
+    pass
+
+class Gate:
+    # Bounded concurrency with a bounded FIFO queue in front of it (asyncio.Semaphore wakes waiters in order)
+    def __init__(self, limit=None, queue=None, queue_timeout=None):
+        self.limit=int(limit if limit is not None else os.getenv("LUNA_API_CONCURRENCY", 16))
+        self.queue=int(queue if queue is not None else os.getenv("LUNA_API_QUEUE", 64))
+        self.queue_timeout=float(queue_timeout if queue_timeout is not None else os.getenv("LUNA_API_QUEUE_TIMEOUT", 30))
+        self._slots=asyncio.Semaphore(self.limit)
+        self.running=0
+        self.waiting=0
+        self.rejected=0
+
+    async def acquire(self):
+        if self._slots.locked() and self.waiting >= self.queue:
+            self.rejected+=1
+            raise Overloaded(f"{self.running} turns running and {self.waiting} queued")
+        self.waiting+=1
+        t0=time.perf_counter()
+        try:
+            await asyncio.wait_for(self._slots.acquire(), self.queue_timeout)
+        except asyncio.TimeoutError:
+            self.rejected+=1
+            raise Overloaded(f"no free slot within {self.queue_timeout:.0f}s") from None
+        finally:
+            self.waiting-=1
+        observe("luna_api_queue_ms", (time.perf_counter() - t0) * 1000)
+        self.running+=1
+
+    def release(self):
+        self.running-=1
+        self._slots.release()
+
+    def stats(self):
+        return {"running": self.running, "waiting": self.waiting, "limit": self.limit, "queue": self.queue, "rejected": self.rejected}
+
+def _step(action, observation):
+    return {"tool": getattr(action, "tool", ""), "input": str(getattr(action, "tool_input", "")), "output": str(observation)[:2000]}
+
+class LunaService:
+    def __init__(self, agent_factory, store, gate, default_model):
+        self.agent_factory=functools.lru_cache(maxsize=8)(agent_factory) # model -> agent, built on first use
+        self.store=store
+        self.gate=gate
+        self.default_model=default_model
+        self._session_locks={} # session_id -> asyncio.Lock: one turn at a time per conversation
+        self.turns=0
+
+    def session_lock(self, session_id):
+        lock=self._session_locks.get(session_id)
+        if lock is None:
+            if len(self._session_locks) > 4 * self.store.max_sessions: # drop idle locks
+                self._session_locks={k: v for k, v in self._session_locks.items() if v.locked()}
+            lock=self._session_locks[session_id]=asyncio.Lock()
+        return lock
+
+    async def run_turn(self, session_id, text, model, events):
+        # Pushes (event, data) onto `events` (bounded: a slow SSE reader slows the turn down rather than buffering)
+        start=time.perf_counter()
+        ttft=None
+        final=None
+        agent=await asyncio.to_thread(self.agent_factory, model)
+        config={"configurable": {"session_id": session_id}, "tags": ["luna", "api"], "metadata": {"model": model}}
+        self.store.pin(session_id) # not evicted mid-turn
+        try:
+            # A cold session is loaded from Postgres: do it off the loop, so the store.get that
+            # RunnableWithMessageHistory makes on the loop is an in-memory hit
+            await asyncio.to_thread(self.store.get, session_id)
+            with turn_budget(): # LUNA_TURN_BUDGET_S, visible to the LLM/tool threads through the task's context
+                async for event in agent.astream_events({"input": text}, config=config, version="v2"):
+                    kind=event["event"]
+                    if kind == "on_chat_model_start":
+                        await events.put(("llm_start", {})) # clients drop text streamed by a previous LLM call
+                    elif kind == "on_chat_model_stream":
+                        token=event["data"]["chunk"].content
+                        if token:
+                            if ttft is None:
+                                ttft=(time.perf_counter() - start) * 1000
+                            await events.put(("token", {"text": token}))
+                    elif kind == "on_chain_stream" and not event.get("parent_ids"):
+                        # The executor's own step stream (same chunks stream_agent renders in the UI)
+                        chunk=event["data"]["chunk"]
+                        for action in chunk.get("actions", []):
+                            await events.put(("tool_start", {"tool": action.tool, "input": str(action.tool_input)}))
+                        for step in chunk.get("steps", []):
+                            await events.put(("tool_end", _step(step.action, step.observation)))
+                        if "output" in chunk:
+                            final=chunk
+        except (CircuitOpen, DeadlineExceeded) as e:
+            await events.put(("error", {"error": str(e), "retryable": True}))
+            return
+        except Exception as e:
+            await events.put(("error", {"error": f"Error occurred: {e}", "retryable": False}))
+            return
+        finally:
+            self.store.release(session_id)
+        elapsed=(time.perf_counter() - start) * 1000
+        final=final or {}
+        self.turns+=1
+        observe("luna_api_turn_ms", elapsed, model=model)
+        if ttft is not None:
+            observe("luna_api_ttft_ms", ttft, model=model)
+        await events.put(("done", {"session_id": session_id, "output": final.get("output", ""),
+                                   "steps": [_step(a, o) for a, o in final.get("intermediate_steps", [])],
+                                   "ttft_ms": ttft, "total_ms": elapsed}))
+
+    def health(self):
+        breakers=breaker_stats()
+        degraded=[name for name, b in breakers.items() if b["state"] != "closed"]
+        return {"status": "degraded" if degraded else "ok", "degraded": degraded, **self.gate.stats(),
+                "turns": self.turns, "sessions": self.store.stats(), "breakers": breakers}
+
+SERVICE_KEY=web.AppKey("service", LunaService)
+MODELS_KEY=web.AppKey("models", set)
+
+def _sse(event, data):
+    return f"event: {event}\ndata: {json.dumps(data, ensure_ascii=False, default=str)}\n\n".encode("utf-8")
+
+async def chat(request):
+    service=request.app[SERVICE_KEY]
+    try:
+        body=await request.json()
+    except Exception:
+        raise web.HTTPBadRequest(text="body must be JSON")
+    text=str(body.get("input") or "").strip()
+    session_id=str(body.get("session_id") or uuid.uuid4().hex)
+    model=body.get("model") or service.default_model
+    if not text:
+        raise web.HTTPBadRequest(text="input is required")
+    if not SESSION_ID.fullmatch(session_id):
+        raise web.HTTPBadRequest(text="session_id must be 8-64 of [A-Za-z0-9_-]")
+    if model not in request.app[MODELS_KEY]:
+        raise web.HTTPBadRequest(text=f"unknown model {model!r}")
+
+    # One turn per session at a time: a second request while one runs gets 409 instead of waiting outside the gate
+    lock=service.session_lock(session_id)
+    if lock.locked():
+        return web.json_response({"error": "a turn is already running for this session"}, status=409, headers={"Retry-After": "1"})
+    async with lock:
+        try:
+            await service.gate.acquire()
+        except Overloaded as e:
+            return web.json_response({"error": f"overloaded: {e}"}, status=429, headers={"Retry-After": "1"})
+        try:
+            events=asyncio.Queue(maxsize=int(os.getenv("LUNA_API_STREAM_BUFFER", 256)))
+            task=asyncio.create_task(service.run_turn(session_id, text, model, events))
+            if body.get("stream", True):
+                return await _stream(request, task, events, session_id)
+            return await _collect(task, events)
+        finally:
+            service.gate.release()
+
+async def _next(task, events):
+    # -> (event, data), or END once the turn task finished and the queue is drained
+    while events.empty():
+        if task.done():
+            if not task.cancelled() and task.exception() is not None:
+                return ("error", {"error": f"Error occurred: {task.exception()}", "retryable": False})
+            return END
+        getter=asyncio.ensure_future(events.get())
+        done, _=await asyncio.wait({getter, task}, return_when=asyncio.FIRST_COMPLETED)
+        if getter in done:
+            return getter.result()
+        getter.cancel()
+    return events.get_nowait()
+
+async def _stream(request, task, events, session_id):
+    response=web.StreamResponse(headers={"Content-Type": "text/event-stream", "Cache-Control": "no-cache",
+                                         "X-Accel-Buffering": "no"})
+    await response.prepare(request)
+    try:
+        await response.write(_sse("session", {"session_id": session_id}))
+        while (item := await _next(task, events)) is not END:
+            await response.write(_sse(*item)) # awaits the socket drain: backpressure from slow clients
+    except (asyncio.CancelledError, ConnectionResetError):
+        task.cancel() # client went away: stop the agent instead of finishing a turn nobody reads
+        raise
+    await response.write_eof()
+    return response
+
+async def _collect(task, events):
+    result={"error": "turn ended without an answer"}
+    try:
+        while (item := await _next(task, events)) is not END:
+            if item[0] in ("done", "error"):
+                result=item[1]
+    except asyncio.CancelledError:
+        task.cancel() # client went away: the turn must not keep running outside the gate
+        raise
+    return web.json_response(result, status=200 if "output" in result else 503 if result.get("retryable") else 500)
+
+async def delete_session(request):
+    session_id=request.match_info["session_id"]
+    if not SESSION_ID.fullmatch(session_id):
+        raise web.HTTPBadRequest(text="bad session_id")
+    history=await asyncio.to_thread(request.app[SERVICE_KEY].store.get, session_id) # may load from Postgres
+    history.clear()
+    return web.json_response({"session_id": session_id, "cleared": True})
+
+async def healthz(request):
+    health=request.app[SERVICE_KEY].health()
+    return web.json_response(health, status=200)
+
+async def metrics(request):
+    return web.Response(text=registry.render_prometheus(), content_type="text/plain", charset="utf-8")
+
+def real_agent_factory(store):
+    groq_api_key=os.getenv("GROQ_API_KEY")
+    if not groq_api_key:
+        raise SystemExit("Set GROQ_API_KEY (or run with --fake)")
+    tools=build_tools()
+    prompt=build_prompt()
+    fallback=os.getenv("LUNA_FALLBACK_MODEL") or None
+    def _factory(model):
+        return build_agent(build_llm(groq_api_key, model, fallback), tools, prompt, store.get, verbose=False)
+    return _factory
+
+def fake_agent_factory(store, llm_latency_ms=200.0, tool_latency_ms=150.0):
+    # Same stand-ins as the offline benchmark: scripted tool-calling LLM, in-memory VectorDB, fake Search/Binance
+    from src.app.benchmark import HashEncoder, InMemoryVectorStore, ScriptedChatModel, FakeTransport, fake_search, SAMPLE_DOCS
+    from src.app.binance_quotes import QuoteService
+    from src.app.agent_core import vector_search, get_binance_search
+    vectors=InMemoryVectorStore(HashEncoder())
+    vectors.add_docs(SAMPLE_DOCS)
+    quotes=QuoteService(transport=FakeTransport(tool_latency_ms), ttl=0.001)
+    tools=build_tools(search_func=fake_search(tool_latency_ms),
+                      binance_func=functools.partial(get_binance_search, service=quotes),
+                      vector_func=functools.partial(vector_search, query_fn=vectors.query))
+    prompt=build_prompt()
+    def _factory(model):
+        llm=ScriptedChatModel(latency_ms=llm_latency_ms)
+        if resilience_enabled(): # same wrapping as build_llm, so the hedged streaming path is exercised too
+            llm=hedged_llm(llm, "fake")
+        return build_agent(llm, tools, prompt, store.get, verbose=False)
+    return _factory
+
+def create_app(agent_factory=None, store=None, fake=False, default_model=None, llm_latency_ms=200.0, tool_latency_ms=150.0):
+    if store is None:
+        pool=None
+        if not fake and os.getenv("LUNA_SESSION_STORE", "postgres") != "memory":
+            from src.app.vector_db import get_pool
+            pool=get_pool
+        store=SessionStore(new_history, get_pool=pool).start()
+    if agent_factory is None:
+        agent_factory=fake_agent_factory(store, llm_latency_ms, tool_latency_ms) if fake else real_agent_factory(store)
+    app=web.Application(client_max_size=64 * 1024)
+    app[MODELS_KEY]=set(MODELS) | ({"fake"} if fake else set())
+    default_model=default_model or ("fake" if fake else os.getenv("LUNA_MODEL", MODELS[0]))
+
+    async def _startup(app):
+        # Sync LLM/tool/history work runs on the default executor: size it for the concurrency limit
+        app[SERVICE_KEY]=LunaService(agent_factory, store, Gate(), default_model)
+        workers=int(os.getenv("LUNA_API_THREADS", 4 * app[SERVICE_KEY].gate.limit))
+        asyncio.get_running_loop().set_default_executor(ThreadPoolExecutor(max_workers=workers, thread_name_prefix="luna-api"))
+        if not fake and os.getenv("LUNA_WARM_UP", "1") != "0":
+            from src.app.vector_db import warm_up
+            warm_up(background=True)
+
+    async def _cleanup(app):
+        store.close()
+
+    app.on_startup.append(_startup)
+    app.on_cleanup.append(_cleanup)
+    app.router.add_post("/v1/chat", chat)
+    app.router.add_delete("/v1/sessions/{session_id}", delete_session)
+    app.router.add_get("/healthz", healthz)
+    app.router.add_get("/metrics", metrics)
+    return app
+
+# --- Load test client ---
+
+async def _client_turn(http, url, session_id, text):
+    # -> (ttft ms, total ms, status)
+    t0=time.perf_counter()
+    ttft=None
+    async with http.post(f"{url}/v1/chat", json={"session_id": session_id, "input": text}) as resp:
+        if resp.status != 200:
+            await resp.read()
+            return None, (time.perf_counter() - t0) * 1000, resp.status
+        event=None
+        async for line in resp.content:
+            line=line.decode("utf-8").strip()
+            if line.startswith("event: "):
+                event=line[7:]
+                if ttft is None and event in ("token", "done"):
+                    ttft=(time.perf_counter() - t0) * 1000
+            elif event == "error" and line.startswith("data: "):
+                return ttft, (time.perf_counter() - t0) * 1000, 503
+    return ttft, (time.perf_counter() - t0) * 1000, 200
+
+async def loadtest(args):
+    from src.app.benchmark import QUERIES, summarize
+    results=[]
+    async def _session(i, http):
+        session_id=f"load-{uuid.uuid4().hex[:12]}"
+        rng=random.Random(args.seed + i)
+        for _ in range(args.turns):
+            results.append(await _client_turn(http, args.url.rstrip("/"), session_id, rng.choice(QUERIES)))
+    start=time.perf_counter()
+    async with ClientSession(timeout=ClientTimeout(total=args.timeout)) as http:
+        await asyncio.gather(*[_session(i, http) for i in range(args.sessions)])
+    wall=time.perf_counter() - start
+    ok=[r for r in results if r[2] == 200]
+    statuses={}
+    for _, _, status in results:
+        statuses[status]=statuses.get(status, 0) + 1
+    ttft=summarize([r[0] for r in ok if r[0] is not None])
+    total=summarize([r[1] for r in ok], wall)
+    print(f"[Load] {len(results)} turns over {args.sessions} sessions in {wall:.1f}s ({total.get('qps', 0):.1f} turns/s), "
+          f"status {statuses}")
+    print(f"[Load] first event p50 {ttft['p50_ms']:.0f} ms, p95 {ttft['p95_ms']:.0f} ms; "
+          f"turn p50 {total['p50_ms']:.0f} ms, p95 {total['p95_ms']:.0f} ms, p99 {total['p99_ms']:.0f} ms")
+    return 0 if len(ok) == len(results) or args.allow_rejects else 1
+
+def main(argv=None):
+    parser=argparse.ArgumentParser(description="Headless HTTP API for the LUNA agent (SSE streaming)")
+    sub=parser.add_subparsers(dest="command", required=True)
+    p=sub.add_parser("serve")
+    p.add_argument("--host", default=os.getenv("LUNA_API_HOST", "127.0.0.1"))
+    p.add_argument("--port", type=int, default=int(os.getenv("LUNA_API_PORT", 8080)))
+    p.add_argument("--fake", action="store_true", help="scripted LLM and fake tools, no API keys or database")
+    p.add_argument("--llm-latency-ms", type=float, default=200.0)
+    p.add_argument("--tool-latency-ms", type=float, default=150.0)
+    p=sub.add_parser("loadtest")
+    p.add_argument("--url", default="http://127.0.0.1:8080")
+    p.add_argument("--sessions", type=int, default=50)
+    p.add_argument("--turns", type=int, default=4)
+    p.add_argument("--timeout", type=float, default=120.0)
+    p.add_argument("--seed", type=int, default=0)
+    p.add_argument("--allow-rejects", action="store_true", help="exit 0 even if some turns got 429/503")
+    args=parser.parse_args(argv)
+    load_dotenv()
+
+    if args.command == "loadtest":
+        return asyncio.run(loadtest(args))
+    app=create_app(fake=args.fake, llm_latency_ms=args.llm_latency_ms, tool_latency_ms=args.tool_latency_ms)
+    print(f"[API] serving on http://{args.host}:{args.port} ({'fake agent' if args.fake else 'Groq'})")
+    web.run_app(app, host=args.host, port=args.port, print=None)
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,317 @@
+import re, sys, json, time, uuid, random, hashlib, argparse, platform, subprocess, functools
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+
+from langchain_core.language_models.chat_models import BaseChatModel
+from langchain_core.messages import AIMessage, HumanMessage, ToolMessage
+from langchain_core.outputs import ChatGeneration, ChatResult
+from langchain.agents import AgentExecutor
+
+from src.app import vector_db
+from src.app.vector_db import iter_batches
+from src.app.binance_quotes import QuoteService
+from src.app.search_service import SearchService
+from src.app.agent_core import build_tools, build_prompt, build_agent, vector_search, get_binance_search, new_history
+from src.app.parallel_executor import ParallelAgentExecutor
+from src.app.metrics import registry
+
+# Offline benchmarks: no Groq, SerpAPI or Binance; Postgres only with --backend pgvector.
+#   python -m src.app.benchmark --out bench_results.json
+#   python -m src.app.benchmark --baseline bench_results.json --out new.json --fail-on-regression
+
+SAMPLE_DOCS=[
+    "LunaSpace's mission is to create AI systems that can accurately understand the universe and aid humanity in its pursuit of knowledge.",
+    "About the role We're looking for exceptional multimedia engineers and product thinkers who want to make realtime avatar products the best in the world.",
+    "What You'll Do - Make realtime avatar products fast, scalable, and reliable. Obsess over every millisecond and byte.",
+    "Who You Are - Well-versed in low-latency systems and protocols like WebSocket and WebRTC. Expert in Python, and preferably proficient in Rust.",
+    "Tech Stack - Python, Rust, WebSocket, WebRTC",
+    "Location - The role is based in Palo Alto. Candidates are expected to be located near the Bay Area or open to relocation.",
+    "Annual Salary Range - $180,000 - $440,000 USD",
+    "Benefits - Base salary is just one part of our total rewards package, which also includes equity, medical, vision, and dental coverage.",
+]
+WORDS=("latency throughput vector index embedding cluster postgres streaming agent tool search price market "
+       "engineer product rust python websocket webrtc salary benefits equity relocation mission culture "
+       "research audio avatar media pipeline quality performance scale reliability").split()
+QUERIES=["salary range for the role?", "what is the tech stack", "where is the role located", "what benefits are offered",
+         "LunaSpace mission", "BTC price now?", "ETH and SOL price", "latest AI agent news", "BTC price and latest ETF news",
+         "who are you", "explain vector databases"]
+
+class HashEncoder:
+    # Deterministic hashed bag-of-words vectors with SentenceTransformer's encode() shape; latency_ms per batch
+    def __init__(self, dim=1024, latency_ms=0.0):
+        self.dim=dim
+        self.latency_ms=latency_ms
+
+    def _vector(self, text):
+        vec=np.zeros(self.dim, dtype=np.float32)
+        for token in re.findall(r"\w+", text.lower()):
+            h=int.from_bytes(hashlib.blake2b(token.encode(), digest_size=8).digest(), "little")
+            vec[h % self.dim]+=1.0 if h >> 63 else -1.0
+        norm=np.linalg.norm(vec)
+        return vec / norm if norm else vec
+
+    def encode(self, texts, batch_size=32, **kwargs):
+        single=isinstance(texts, str)
+        batch=[texts] if single else list(texts)
+        if self.latency_ms:
+            time.sleep(self.latency_ms / 1000)
+        out=np.stack([self._vector(t) for t in batch]) if batch else np.zeros((0, self.dim), dtype=np.float32)
+        return out[0] if single else out
+
+class InMemoryVectorStore:
+    # Stand-in for the documents table: cosine top-k over a numpy matrix
+    def __init__(self, encoder):
+        self.encoder=encoder
+        self.contents=[]
+        self._blocks=[]
+        self._matrix=None
+
+    def add_docs(self, docs, batch_size=64):
+        start=time.perf_counter()
+        total=0
+        for batch in iter_batches(docs, batch_size):
+            self._blocks.append(np.asarray(self.encoder.encode(batch, batch_size=batch_size), dtype=np.float32))
+            self.contents.extend(batch)
+            total+=len(batch)
+        self._matrix=None
+        elapsed=time.perf_counter() - start
+        return {"docs": total, "seconds": elapsed, "docs_per_sec": total / max(elapsed, 1e-9)}
+
+    def query(self, query, top_k=3, detail=False):
+        if self._matrix is None:
+            self._matrix=np.vstack(self._blocks) if self._blocks else np.zeros((0, self.encoder.dim), dtype=np.float32)
+        scores=self._matrix @ np.asarray(self.encoder.encode(query), dtype=np.float32)
+        k=min(top_k, len(scores))
+        idx=np.argpartition(-scores, k - 1)[:k] if k else []
+        idx=sorted(idx, key=lambda i: -scores[i])
+        if detail: # same row shape as query_postgresql(detail=True)
+            similarities=self._matrix[idx] @ self._matrix[idx].T # HashEncoder vectors are unit length
+            return [{"id": int(i), "source_id": None, "content": self.contents[i], "score": float(scores[i]),
+                     "similarities": similarities[n].tolist()} for n, i in enumerate(idx)]
+        return [self.contents[i] for i in idx]
+
+class FakeTransport:
+    # In-process Binance stand-in for QuoteService
+    def __init__(self, latency_ms=50.0):
+        self.latency_ms=latency_ms
+        self.prices={"BTCUSDT": 66200.0, "ETHUSDT": 3150.0, "SOLUSDT": 152.0, "DOGEUSDT": 0.16, "BNBUSDT": 590.0}
+
+    def get_price(self, symbol):
+        time.sleep(self.latency_ms / 1000)
+        return self.prices[symbol]
+
+    def get_all_prices(self):
+        time.sleep(self.latency_ms / 1000)
+        return dict(self.prices)
+
+def fake_search(latency_ms):
+    def _search(q):
+        time.sleep(latency_ms / 1000)
+        return f"Top results for '{q}': (1) headline about {q} (2) analysis of {q} (3) background on {q}"
+    return _search
+
+class FakeSearchBackend:
+    # SearchService backend with the same canned results as fake_search
+    def __init__(self, latency_ms=150.0):
+        self.search=fake_search(latency_ms)
+
+def route(text):
+    # Deterministic tool choice mirroring the system prompt's rules
+    text=text.lower()
+    calls=[]
+    coins=[c for c in ("btc", "eth", "sol", "doge", "bnb") if re.search(rf"\b{c}\b", text)]
+    if coins and "price" in text:
+        calls.append(("Binance Search", ",".join(f"{c.upper()}USDT" for c in coins)))
+    if re.search(r"news|latest|today|current", text):
+        calls.append(("Search", text))
+    if re.search(r"salary|lunaspace|role|stack|benefit|mission|located", text):
+        calls.append(("VectorDB", text))
+    return calls
+
+class ScriptedChatModel(BaseChatModel):
+    # Emits tool calls for the latest human message, then a final answer once tool results are in
+    latency_ms: float = 0.0
+
+    @property
+    def _llm_type(self):
+        return "scripted-fake"
+
+    def bind_tools(self, tools, **kwargs):
+        return self
+
+    def _generate(self, messages, stop=None, run_manager=None, **kwargs):
+        if self.latency_ms:
+            time.sleep(self.latency_ms / 1000)
+        # The prompt puts agent_scratchpad before the human turn, so tool results are not necessarily last;
+        # history only ever holds human/AI text, so any ToolMessage means this turn's tools already ran
+        observations=[str(m.content)[:200] for m in messages if isinstance(m, ToolMessage)]
+        if observations:
+            message=AIMessage(content="Here's what I found: " + " | ".join(observations))
+        else:
+            human=next((m for m in reversed(messages) if isinstance(m, HumanMessage)), messages[-1])
+            calls=route(str(human.content))
+            tool_calls=[{"name": name, "args": {"__arg1": arg}, "id": f"call_{uuid.uuid4().hex[:12]}"} for name, arg in calls]
+            message=AIMessage(content="" if tool_calls else "Hi! I'm LUNA. 🌙", tool_calls=tool_calls)
+        if run_manager is not None: # token callbacks from inside _generate, as ChatGroq(streaming=True) does
+            for word in re.findall(r"\S+\s*", message.content):
+                run_manager.on_llm_new_token(word)
+        return ChatResult(generations=[ChatGeneration(message=message)])
+
+def summarize(latencies_ms, wall_s=None):
+    values=np.asarray(latencies_ms, dtype=np.float64)
+    out={
+        "n": int(len(values)),
+        "mean_ms": float(values.mean()) if len(values) else 0.0,
+        "p50_ms": float(np.percentile(values, 50)) if len(values) else 0.0,
+        "p95_ms": float(np.percentile(values, 95)) if len(values) else 0.0,
+        "p99_ms": float(np.percentile(values, 99)) if len(values) else 0.0,
+    }
+    if wall_s:
+        out["qps"]=len(values) / wall_s
+    return out
+
+def synthetic_docs(n, seed=0):
+    rng=random.Random(seed)
+    for i in range(n):
+        if i < len(SAMPLE_DOCS):
+            yield SAMPLE_DOCS[i]
+        else:
+            yield " ".join(rng.choice(WORDS) for _ in range(rng.randint(20, 120))) + f" (doc {i})"
+
+def run_concurrent(fn, inputs, concurrency):
+    def _one(x):
+        t0=time.perf_counter()
+        fn(x)
+        return (time.perf_counter() - t0) * 1000
+    start=time.perf_counter()
+    with ThreadPoolExecutor(max_workers=concurrency) as pool:
+        latencies=list(pool.map(_one, inputs))
+    return latencies, time.perf_counter() - start
+
+def bench_ingestion(args, store):
+    docs=synthetic_docs(args.docs, seed=args.seed)
+    if store is not None:
+        return store.add_docs(docs, batch_size=args.batch_size)
+    return vector_db.add_docs(docs, batch_size=args.batch_size, method=args.ingest_method, report_every=0)
+
+def bench_retrieval(args, store):
+    rng=random.Random(args.seed)
+    pool=QUERIES + [" ".join(rng.choice(WORDS) for _ in range(6)) for _ in range(max(args.unique_queries - len(QUERIES), 0))]
+    queries=[rng.choice(pool[:args.unique_queries]) for _ in range(args.queries)]
+    query_fn=store.query if store is not None else vector_db.query_postgresql
+    latencies, wall=run_concurrent(lambda q: query_fn(q, top_k=3), queries, args.concurrency)
+    result=summarize(latencies, wall)
+    if store is None:
+        result["cache"]=vector_db.cache_stats()
+    return result
+
+def bench_agent_turns(args, store, executor_cls):
+    quotes=QuoteService(transport=FakeTransport(args.tool_latency_ms), ttl=0.001)
+    search=SearchService(backend=FakeSearchBackend(args.tool_latency_ms)).run if args.search_cache else fake_search(args.tool_latency_ms)
+    tools=build_tools(
+        search_func=search,
+        binance_func=functools.partial(get_binance_search, service=quotes),
+        vector_func=functools.partial(vector_search, query_fn=store.query) if store is not None else None,
+    )
+    histories={}
+    def get_history(session_id):
+        if session_id not in histories:
+            histories[session_id]=new_history()
+        return histories[session_id]
+    runnable=build_agent(ScriptedChatModel(latency_ms=args.llm_latency_ms), tools, build_prompt(), get_history,
+                         verbose=False, executor_cls=executor_cls)
+    turns=[QUERIES[i % len(QUERIES)] for i in range(args.turns)]
+    def _turn(i_q):
+        i, q=i_q
+        runnable.invoke({"input": q}, config={"configurable": {"session_id": f"bench-{i % args.sessions}"}})
+    latencies, wall=run_concurrent(_turn, list(enumerate(turns)), args.concurrency)
+    return summarize(latencies, wall)
+
+HIGHER_IS_BETTER=("qps", "docs_per_sec")
+
+def compare(results, baseline, threshold):
+    # -> list of (metric path, old, new, relative change) that got worse by more than threshold
+    regressions=[]
+    for section, metrics in results.items():
+        for key, new in metrics.items():
+            old=baseline.get(section, {}).get(key)
+            if not isinstance(new, (int, float)) or not isinstance(old, (int, float)) or not old or key == "n":
+                continue
+            change=(new - old) / old
+            worse=-change if key in HIGHER_IS_BETTER else change
+            if key in HIGHER_IS_BETTER or key.endswith("_ms"):
+                if worse > threshold:
+                    regressions.append((f"{section}.{key}", old, new, change))
+    return regressions
+
+def git_commit():
+    try:
+        return subprocess.run(["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True, timeout=5).stdout.strip() or None
+    except Exception:
+        return None
+
+def main(argv=None):
+    parser=argparse.ArgumentParser(description="Offline Luna benchmarks (retrieval, ingestion, agent turns)")
+    parser.add_argument("--backend", choices=["memory", "pgvector"], default="memory",
+                        help="pgvector writes into the configured POSTGRES_* database; point it at a scratch DB")
+    parser.add_argument("--docs", type=int, default=5000)
+    parser.add_argument("--batch-size", type=int, default=64)
+    parser.add_argument("--ingest-method", choices=["values", "copy"], default="values")
+    parser.add_argument("--queries", type=int, default=500)
+    parser.add_argument("--unique-queries", type=int, default=100)
+    parser.add_argument("--concurrency", type=int, default=4)
+    parser.add_argument("--no-cache", action="store_true", help="disable the query embedding/result caches")
+    parser.add_argument("--search-cache", action="store_true", help="route the fake Search tool through SearchService (TTL cache + coalescing)")
+    parser.add_argument("--turns", type=int, default=40)
+    parser.add_argument("--sessions", type=int, default=4)
+    parser.add_argument("--llm-latency-ms", type=float, default=200.0)
+    parser.add_argument("--tool-latency-ms", type=float, default=150.0)
+    parser.add_argument("--encode-latency-ms", type=float, default=0.0)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--out", default="bench_results.json")
+    parser.add_argument("--baseline", help="previous results file to compare against")
+    parser.add_argument("--threshold", type=float, default=0.10, help="relative change that counts as a regression")
+    parser.add_argument("--fail-on-regression", action="store_true")
+    args=parser.parse_args(argv)
+
+    encoder=HashEncoder(latency_ms=args.encode_latency_ms)
+    store=InMemoryVectorStore(encoder) if args.backend == "memory" else None
+    if store is None:
+        vector_db.set_model(encoder)
+        if args.no_cache:
+            vector_db.embedding_cache.maxsize=0
+            vector_db.result_cache.maxsize=0
+
+    results={}
+    results["ingestion"]=bench_ingestion(args, store)
+    print(f"[Bench] ingestion: {results['ingestion']['docs_per_sec']:.1f} docs/sec")
+    results["retrieval"]=bench_retrieval(args, store)
+    print(f"[Bench] retrieval: {results['retrieval']['qps']:.1f} qps, p95 {results['retrieval']['p95_ms']:.1f} ms")
+    for name, executor_cls in (("agent_turns_serial", AgentExecutor), ("agent_turns_parallel", ParallelAgentExecutor)):
+        results[name]=bench_agent_turns(args, store, executor_cls)
+        print(f"[Bench] {name}: p50 {results[name]['p50_ms']:.1f} ms, p95 {results[name]['p95_ms']:.1f} ms")
+
+    report={
+        "meta": {"ts": time.time(), "git": git_commit(), "python": platform.python_version(), "args": vars(args)},
+        "results": results,
+        "stages": registry.snapshot(),
+    }
+    with open(args.out, "w", encoding="utf-8") as f:
+        json.dump(report, f, indent=2)
+    print(f"[Bench] wrote {args.out}")
+
+    if args.baseline:
+        with open(args.baseline, encoding="utf-8") as f:
+            baseline=json.load(f)["results"]
+        regressions=compare(results, baseline, args.threshold)
+        for metric, old, new, change in regressions:
+            print(f"[Bench] REGRESSION {metric}: {old:.2f} -> {new:.2f} ({change:+.1%})")
+        if not regressions:
+            print(f"[Bench] no regressions beyond {args.threshold:.0%} vs {args.baseline}")
+        if regressions and args.fail_on_regression:
+            return 1
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,128 @@
+import os, re, time, threading, datetime
+
+import requests
+
+from src.app.cache import LRUCache
+
+class ClientTransport:
+    # python-binance Client created once; its requests.Session is reused for every call
+    def __init__(self, api_key=None, api_secret=None, timeout=5.0):
+        from binance.client import Client # Binance
+        self.client=Client(
+            api_key=api_key or os.getenv("BINANCE_API_KEY"),
+            api_secret=api_secret or os.getenv("BINANCE_API_SECRET"),
+            requests_params={"timeout": timeout}, # a stalled connection must not hold the tool / refresher
+            ping=False, # no server ping on construction
+        )
+
+    def get_price(self, symbol):
+        return float(self.client.get_symbol_ticker(symbol=symbol)["price"])
+
+    def get_all_prices(self):
+        return {t["symbol"]: float(t["price"]) for t in self.client.get_all_tickers()}
+
+class HttpTransport:
+    # Plain public REST endpoints over one keep-alive session; point base_url at a local fake server in tests
+    def __init__(self, base_url=None, timeout=5.0, session=None):
+        self.base_url=(base_url or os.getenv("BINANCE_BASE_URL", "https://api.binance.com")).rstrip("/")
+        self.timeout=timeout
+        self.session=session or requests.Session()
+
+    def _get(self, params=None):
+        resp=self.session.get(f"{self.base_url}/api/v3/ticker/price", params=params, timeout=self.timeout)
+        resp.raise_for_status()
+        return resp.json()
+
+    def get_price(self, symbol):
+        return float(self._get({"symbol": symbol})["price"])
+
+    def get_all_prices(self):
+        return {t["symbol"]: float(t["price"]) for t in self._get()}
+
+def default_transport():
+    # BINANCE_BASE_URL switches to the plain HTTP transport (e.g. a local fake server)
+    return HttpTransport() if os.getenv("BINANCE_BASE_URL") else ClientTransport()
+
+def parse_symbols(text):
+    # "BTCUSDT, ethusdt SOLUSDT" -> ["BTCUSDT", "ETHUSDT", "SOLUSDT"] (order kept, duplicates dropped)
+    symbols=[s.upper() for s in re.split(r"[\s,;/|]+", str(text).strip().strip("'\"")) if s]
+    return list(dict.fromkeys(symbols))
+
+class QuoteService:
+    def __init__(self, transport=None, ttl=None, hot_window=300.0):
+        self.transport=transport or default_transport()
+        ttl=float(ttl if ttl is not None else os.getenv("LUNA_QUOTE_TTL", 5))
+        self.cache=LRUCache(maxsize=4096, ttl=ttl) # all-tickers is ~3k symbols
+        self.hot_window=hot_window # seconds a requested symbol stays "hot" for the refresher
+        self._hot={} # symbol -> last requested (monotonic)
+        self._lock=threading.Lock()
+        self._refresher=None
+        self._stop=threading.Event()
+
+    def _store(self, prices):
+        fetched_at=datetime.datetime.now()
+        for symbol, price in prices.items():
+            self.cache.set(symbol, (price, fetched_at))
+
+    def _touch(self, symbols):
+        now=time.monotonic()
+        with self._lock:
+            for symbol in symbols:
+                self._hot[symbol]=now
+
+    def get_quotes(self, symbols):
+        # symbol -> (price, fetched_at) or None if unknown; >1 cache miss -> one all-tickers call
+        symbols=[s.upper() for s in symbols]
+        self._touch(symbols)
+        quotes={s: self.cache.get(s) for s in symbols}
+        missing=[s for s, q in quotes.items() if q is None]
+        if len(missing) == 1:
+            self._store({missing[0]: self.transport.get_price(missing[0])})
+        elif missing:
+            self._store(self.transport.get_all_prices())
+        for s in missing:
+            quotes[s]=self.cache.get(s)
+        return quotes
+
+    def get_quote(self, symbol):
+        return self.get_quotes([symbol])[symbol.upper()]
+
+    def hot_symbols(self):
+        cutoff=time.monotonic() - self.hot_window
+        with self._lock:
+            self._hot={s: t for s, t in self._hot.items() if t >= cutoff}
+            return list(self._hot)
+
+    def start_refresher(self, interval=None):
+        # Optional background thread: re-fetch all tickers while someone has asked for a symbol recently
+        interval=float(interval if interval is not None else os.getenv("LUNA_QUOTE_REFRESH", 2))
+        if self._refresher and self._refresher.is_alive():
+            return self._refresher
+        self._stop.clear()
+        def _run():
+            while not self._stop.wait(interval):
+                if not self.hot_symbols():
+                    continue
+                try:
+                    self._store(self.transport.get_all_prices())
+                except Exception as e:
+                    print(f"[Binance] refresh failed: {e}")
+        self._refresher=threading.Thread(target=_run, name="luna-quote-refresher", daemon=True)
+        self._refresher.start()
+        return self._refresher
+
+    def stop_refresher(self):
+        self._stop.set()
+
+_service=None
+_service_lock=threading.Lock()
+
+def get_quote_service():
+    global _service
+    if _service is None:
+        with _service_lock:
+            if _service is None:
+                _service=QuoteService()
+                if os.getenv("LUNA_QUOTE_REFRESH"):
+                    _service.start_refresher()
+    return _service
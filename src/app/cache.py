@@ -0,0 +1,61 @@
+import time, threading
+from collections import OrderedDict
+
+_MISSING=object()
+
+class LRUCache:
+    # Thread-safe LRU with an optional per-entry TTL (seconds); hit/miss counters for sizing
+    def __init__(self, maxsize=1024, ttl=None):
+        self.maxsize=maxsize
+        self.ttl=ttl
+        self._data=OrderedDict() # key -> (expires_at or None, value)
+        self._lock=threading.Lock()
+        self.hits=0
+        self.misses=0
+        self.evictions=0
+
+    def get(self, key, default=None):
+        with self._lock:
+            item=self._data.get(key, _MISSING)
+            if item is not _MISSING:
+                expires_at, value=item
+                if expires_at is None or expires_at > time.monotonic():
+                    self._data.move_to_end(key)
+                    self.hits+=1
+                    return value
+                del self._data[key] # expired
+            self.misses+=1
+            return default
+
+    def set(self, key, value, ttl=None):
+        ttl=self.ttl if ttl is None else ttl
+        expires_at=time.monotonic() + ttl if ttl else None
+        with self._lock:
+            self._data[key]=(expires_at, value)
+            self._data.move_to_end(key)
+            while len(self._data) > self.maxsize:
+                self._data.popitem(last=False)
+                self.evictions+=1
+
+    def pop(self, key, default=None):
+        with self._lock:
+            item=self._data.pop(key, _MISSING)
+            return default if item is _MISSING else item[1]
+
+    def clear(self):
+        with self._lock:
+            self._data.clear()
+
+    def __len__(self):
+        return len(self._data)
+
+    def stats(self):
+        total=self.hits + self.misses
+        return {
+            "size": len(self._data),
+            "maxsize": self.maxsize,
+            "hits": self.hits,
+            "misses": self.misses,
+            "evictions": self.evictions,
+            "hit_rate": self.hits / total if total else 0.0,
+        }
@@ -0,0 +1,121 @@
+import os, re, time
+
+import numpy as np
+
+from src.app.memory import count_tokens, split_sentences
+from src.app.metrics import observe
+
+# Context packing for the VectorDB tool: over-fetch candidates (with their pairwise similarities), pick a diverse
+# subset with maximal marginal relevance, then fit it into a token budget by trimming each passage to the
+# sentences around its best match for the question. Every passage is labelled with its source and similarity.
+
+WORD=re.compile(r"\w+")
+STOPWORDS=frozenset("the and for are was were with what which who whom whose where when why how that this these those "
+                    "from into about can you your our their there here has have had does did not but all any".split())
+MIN_PASSAGE_TOKENS=24 # a share smaller than this is dropped rather than cut to a fragment
+
+def packing_config():
+    return {
+        "candidates": int(os.getenv("LUNA_CONTEXT_CANDIDATES", 12)), # rows fetched before MMR
+        "k": int(os.getenv("LUNA_CONTEXT_K", 3)), # passages kept
+        "budget": int(os.getenv("LUNA_CONTEXT_TOKENS", 600)), # 0 = old behaviour (top-3 full chunks)
+        "mmr_lambda": float(os.getenv("LUNA_MMR_LAMBDA", 0.7)), # 1 = pure relevance, 0 = pure diversity
+    }
+
+def mmr(relevance, similarity, k, mmr_lambda=0.7):
+    # -> indices in pick order; relevance = similarity to the query, redundancy = max similarity to a pick
+    relevance=np.asarray(relevance, dtype=np.float32)
+    similarity=np.asarray(similarity, dtype=np.float32)
+    picked=[]
+    redundancy=np.zeros(len(relevance), dtype=np.float32)
+    while len(picked) < min(k, len(relevance)):
+        score=mmr_lambda * relevance - (1 - mmr_lambda) * redundancy
+        score[picked]=-np.inf
+        i=int(np.argmax(score))
+        picked.append(i)
+        redundancy=np.maximum(redundancy, similarity[i])
+    return picked
+
+def _terms(text):
+    return {w.casefold() for w in WORD.findall(text) if len(w) > 2} - STOPWORDS
+
+def _cut(text, budget):
+    # last resort for a single sentence over budget: drop trailing words
+    words=text.split()
+    while len(words) > 1 and count_tokens(" ".join(words) + " ...") > budget:
+        words=words[:len(words) * 9 // 10]
+    return " ".join(words) + " ..."
+
+def trim(text, query, budget):
+    # -> text within budget tokens: the sentence sharing most terms with the query, grown sentence by
+    # sentence toward the better-matching neighbour while it fits
+    if count_tokens(text) <= budget:
+        return text
+    sentences=list(split_sentences(text))
+    if not sentences:
+        return ""
+    terms=_terms(query)
+    scores=[len(terms & _terms(s)) for s in sentences]
+    tokens=[count_tokens(s) for s in sentences]
+    best=int(np.argmax(scores))
+    if tokens[best] > budget:
+        return _cut(sentences[best], budget)
+    lo=hi=best
+    used=tokens[best] + 2 # room for the "..." markers
+    while True:
+        options=[i for i in (lo - 1, hi + 1) if 0 <= i < len(sentences) and used + tokens[i] <= budget]
+        if not options:
+            break
+        i=max(options, key=lambda i: (scores[i], i)) # ties go to the following sentence
+        used+=tokens[i]
+        lo, hi=min(lo, i), max(hi, i)
+    return ("... " if lo > 0 else "") + " ".join(sentences[lo:hi + 1]) + (" ..." if hi < len(sentences) - 1 else "")
+
+def _allocate(sizes, budget):
+    # water-filling: short passages keep their full length, the longer ones split what is left evenly
+    shares=[0] * len(sizes)
+    left=budget
+    for n, i in enumerate(sorted(range(len(sizes)), key=sizes.__getitem__)):
+        shares[i]=min(sizes[i], left // (len(sizes) - n))
+        left-=shares[i]
+    return shares
+
+def _label(row):
+    source=row.get("source_id") or f"doc {row.get('id')}"
+    return f"[{source} | score {row['score']:.2f}]"
+
+def pack(query, rows, k=3, budget=600, mmr_lambda=0.7):
+    # rows: [{"id", "source_id", "content", "score", "similarities"}] -> [{"id", "source_id", "score", "text", "tokens"}]
+    # (similarities: the row's cosine similarity to every row, in row order)
+    if not rows:
+        return []
+    order=mmr([r["score"] for r in rows], [r["similarities"] for r in rows], k, mmr_lambda)
+    picked=[rows[i] for i in order]
+    labels=[_label(r) for r in picked]
+    overhead=[count_tokens(label) + 4 for label in labels] # label line + separator
+    sizes=[count_tokens(r["content"]) for r in picked]
+    shares=_allocate(sizes, max(budget - sum(overhead), 0))
+    packed=[]
+    for row, label, extra, share in zip(picked, labels, overhead, shares):
+        if share < min(MIN_PASSAGE_TOKENS, count_tokens(row["content"])):
+            continue
+        text=trim(row["content"], query, share)
+        if text:
+            packed.append({"id": row.get("id"), "source_id": row.get("source_id"), "score": row["score"],
+                           "label": label, "text": text, "tokens": count_tokens(text) + extra})
+    return packed
+
+def render(packed):
+    return "\n\n---\n\n".join(f"{p['label']}\n{p['text']}" for p in packed)
+
+def packed_context(query, query_fn, config=None):
+    # query_fn(query, top_k=..., detail=True) -> candidate rows (vector_db.query_postgresql or a benchmark store)
+    config=config or packing_config()
+    rows=query_fn(query, top_k=max(config["candidates"], config["k"]), detail=True)
+    t0=time.perf_counter()
+    packed=pack(query, rows, config["k"], config["budget"], config["mmr_lambda"])
+    tokens=sum(p["tokens"] for p in packed)
+    observe("luna_context_pack_ms", (time.perf_counter() - t0) * 1000)
+    observe("luna_context_tokens", tokens)
+    print(f"[VectorDB] packed {len(packed)}/{len(rows)} passages into {tokens} tokens (budget {config['budget']})")
+    return render(packed)
@@ -0,0 +1,167 @@
+import os, sys, json, time, hashlib, argparse
+
+from psycopg2.extras import execute_values, Json
+
+from src.app.memory import count_tokens, split_sentences, split_tokens
+from src.app.vector_storage import missing_identity_schema
+from src.app.vector_db import get_pool, get_model, iter_batches, invalidate_results, vector_literal
+
+# Incremental corpus sync: sources are split into overlapping chunks keyed by (source_id, content hash);
+# only chunks that are new are embedded and inserted, chunks that disappeared are deleted, untouched ones cost
+# nothing but a hash. Rows written by add_docs / insert_to_db (no source_id) are left alone.
+#   python -m src.app.corpus_sync ./corpus                 # every *.txt / *.md below ./corpus, id = relative path
+#   python -m src.app.corpus_sync --manifest docs.jsonl    # {"id": ..., "text" | "path": ..., "metadata": {...}}
+
+EXTENSIONS=(".txt", ".md")
+
+def content_hash(text):
+    return hashlib.blake2b(" ".join(text.split()).encode("utf-8"), digest_size=16).hexdigest()
+
+def chunk_text(text, chunk_tokens=256, overlap_tokens=32):
+    # Greedy sentence packing up to chunk_tokens; each chunk starts with the last ~overlap_tokens of the previous one.
+    # Sentences longer than chunk_tokens are hard-split by tokens.
+    chunks, current, size=[], [], 0
+    for sentence in _pieces(text, chunk_tokens):
+        n=count_tokens(sentence)
+        if current and size + n > chunk_tokens:
+            chunks.append(" ".join(current))
+            carry, carried=[], 0
+            for s in reversed(current):
+                t=count_tokens(s)
+                if carried + t > overlap_tokens:
+                    break
+                carry.insert(0, s)
+                carried+=t
+            if len(carry) == len(current): # the whole chunk would be repeated
+                carry, carried=[], 0
+            current, size=carry, carried
+        current.append(sentence)
+        size+=n
+    if current:
+        chunks.append(" ".join(current))
+    return chunks
+
+def _pieces(text, chunk_tokens):
+    for sentence in split_sentences(text):
+        if count_tokens(sentence) > chunk_tokens:
+            yield from split_tokens(sentence, chunk_tokens)
+        else:
+            yield sentence
+
+def load_directory(root):
+    # -> {source_id: (text, metadata)}
+    sources={}
+    for dirpath, _, filenames in os.walk(root):
+        for name in sorted(filenames):
+            if name.endswith(EXTENSIONS):
+                path=os.path.join(dirpath, name)
+                source_id=os.path.relpath(path, root).replace(os.sep, "/")
+                with open(path, encoding="utf-8") as f:
+                    sources[source_id]=(f.read(), {"source": source_id})
+    return sources
+
+def load_manifest(path):
+    sources={}
+    base=os.path.dirname(os.path.abspath(path))
+    with open(path, encoding="utf-8") as f:
+        for line in f:
+            if not line.strip():
+                continue
+            entry=json.loads(line)
+            text=entry.get("text")
+            if text is None:
+                with open(os.path.join(base, entry["path"]), encoding="utf-8") as doc:
+                    text=doc.read()
+            sources[str(entry["id"])]=(text, {"source": str(entry["id"]), **entry.get("metadata", {})})
+    return sources
+
+def plan(sources, existing, chunk_tokens=256, overlap_tokens=32, prune=True):
+    # existing: {source_id: set(hash)} -> inserts [(source_id, hash, content, metadata)], deletes [(source_id, hash)],
+    # dropped source ids (present in the table, gone from the corpus)
+    inserts, deletes=[], []
+    for source_id, (text, metadata) in sources.items():
+        chunks={}
+        for chunk in chunk_text(text, chunk_tokens, overlap_tokens):
+            chunks.setdefault(content_hash(chunk), (chunk, metadata))
+        have=existing.get(source_id, set())
+        inserts+=[(source_id, h, chunk, meta) for h, (chunk, meta) in chunks.items() if h not in have]
+        deletes+=[(source_id, h) for h in have - chunks.keys()]
+    dropped=sorted(set(existing) - set(sources)) if prune else []
+    return inserts, deletes, dropped
+
+def existing_chunks(cur):
+    cur.execute("select source_id, content_hash from documents where source_id is not null")
+    existing={}
+    for source_id, h in cur.fetchall():
+        existing.setdefault(source_id, set()).add(h)
+    return existing
+
+def sync(sources, get_pool, get_model, chunk_tokens=256, overlap_tokens=32, batch_size=64, prune=True, dry_run=False):
+    start=time.perf_counter()
+    with get_pool().cursor(commit=True) as cur:
+        missing=missing_identity_schema(cur) # DDL only on a table that predates corpus_sync, never on a re-sync
+        if missing and not dry_run:
+            print("[Sync] adding source_id / content_hash to documents")
+            for statement in missing:
+                cur.execute(statement)
+        existing={} if missing and dry_run else existing_chunks(cur)
+    inserts, deletes, dropped=plan(sources, existing, chunk_tokens, overlap_tokens, prune)
+    stats={"sources": len(sources), "inserted": len(inserts), "deleted": len(deletes), "dropped_sources": len(dropped),
+           "unchanged": sum(len(v) for v in existing.values()) - len(deletes)
+                        - sum(len(existing[s]) for s in dropped)}
+    if dry_run:
+        stats["seconds"]=time.perf_counter() - start
+        return stats
+    embed_s=0.0
+    for batch in iter_batches(inserts, batch_size):
+        t0=time.perf_counter()
+        embeddings=get_model().encode([chunk for _, _, chunk, _ in batch], batch_size=batch_size)
+        embed_s+=time.perf_counter() - t0
+        with get_pool().cursor(commit=True) as cur:
+            execute_values(cur,
+                'insert into documents (source_id, content_hash, content, embedding, metadata) values %s '
+                'on conflict (source_id, content_hash) do update set metadata = excluded.metadata',
+                [(source_id, h, chunk, vector_literal(emb), Json(meta)) for (source_id, h, chunk, meta), emb in zip(batch, embeddings)],
+                template='(%s, %s, %s, %s::vector, %s)', page_size=len(batch))
+    with get_pool().cursor(commit=True) as cur:
+        # metadata edits in the manifest: one statement, touches only rows whose metadata actually changed
+        rows=[(source_id, Json(metadata)) for source_id, (_, metadata) in sources.items() if source_id in existing]
+        if rows:
+            execute_values(cur,
+                'update documents d set metadata = v.metadata::jsonb from (values %s) as v (source_id, metadata) '
+                'where d.source_id = v.source_id and d.metadata is distinct from v.metadata::jsonb', rows, page_size=len(rows))
+            stats["metadata_updated"]=cur.rowcount
+        if deletes:
+            execute_values(cur,
+                'delete from documents d using (values %s) as gone (source_id, content_hash) '
+                'where d.source_id = gone.source_id and d.content_hash = gone.content_hash', deletes, page_size=len(deletes))
+        if dropped:
+            cur.execute("delete from documents where source_id = any(%s)", (dropped,))
+    if inserts or deletes or dropped or stats.get("metadata_updated"):
+        invalidate_results()
+    stats.update({"embed_seconds": embed_s, "seconds": time.perf_counter() - start})
+    return stats
+
+def main(argv=None):
+    parser=argparse.ArgumentParser(description="Incremental, content-hash-deduplicated corpus sync into documents")
+    parser.add_argument("directory", nargs="?", help="sync every *.txt / *.md below this directory")
+    parser.add_argument("--manifest", help="JSONL manifest instead of a directory")
+    parser.add_argument("--chunk-tokens", type=int, default=int(os.getenv("LUNA_CHUNK_TOKENS", 256)))
+    parser.add_argument("--overlap-tokens", type=int, default=int(os.getenv("LUNA_CHUNK_OVERLAP", 32)))
+    parser.add_argument("--batch-size", type=int, default=64)
+    parser.add_argument("--no-prune", action="store_true", help="keep rows of sources missing from this corpus")
+    parser.add_argument("--dry-run", action="store_true")
+    args=parser.parse_args(argv)
+    if bool(args.directory) == bool(args.manifest):
+        parser.error("give either a directory or --manifest")
+
+    sources=load_manifest(args.manifest) if args.manifest else load_directory(args.directory)
+    stats=sync(sources, get_pool, get_model, args.chunk_tokens, args.overlap_tokens, args.batch_size,
+               prune=not args.no_prune, dry_run=args.dry_run)
+    print(f"[Sync] {'(dry run) ' if args.dry_run else ''}{stats['sources']} sources: +{stats['inserted']} chunks, "
+          f"-{stats['deleted']} chunks, -{stats['dropped_sources']} sources, {stats['unchanged']} unchanged "
+          f"in {stats['seconds']:.1f}s" + (f" (embedding {stats['embed_seconds']:.1f}s)" if "embed_seconds" in stats else ""))
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
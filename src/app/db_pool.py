@@ -0,0 +1,98 @@
+import os, time, threading
+from contextlib import contextmanager
+
+import psycopg2
+from psycopg2.pool import ThreadedConnectionPool, PoolError
+
+def db_config():
+    # Same POSTGRES_* variables the luna-agent service gets from docker-compose.yaml
+    return dict(
+        dbname=os.getenv("POSTGRES_DB", "pgql"),
+        user=os.getenv("POSTGRES_USER", "executive"),
+        password=os.getenv("POSTGRES_PASSWORD", ""),
+        host=os.getenv("POSTGRES_HOST", "localhost"),
+        port=os.getenv("POSTGRES_PORT", "5432"),
+    )
+
+class ConnectionPool:
+    # Thread-safe pool: every query/insert checks out its own connection and gives it back
+    def __init__(self, minconn=None, maxconn=None, health_check_interval=30.0, checkout_timeout=10.0, **config):
+        self.minconn=int(minconn if minconn is not None else os.getenv("POSTGRES_POOL_MIN", 1))
+        self.maxconn=int(maxconn if maxconn is not None else os.getenv("POSTGRES_POOL_MAX", 10))
+        self.health_check_interval=health_check_interval # seconds idle before a checkout pings the server
+        self.checkout_timeout=checkout_timeout
+        self.config=config or db_config()
+        self._pool=ThreadedConnectionPool(self.minconn, self.maxconn, **self.config)
+        self._slots=threading.BoundedSemaphore(self.maxconn) # block instead of PoolError when exhausted
+        self._last_used={} # id(conn) -> time.monotonic()
+        self.reconnects=0
+
+    def _healthy(self, conn):
+        if conn.closed:
+            return False
+        last=self._last_used.get(id(conn))
+        if last is not None and time.monotonic() - last < self.health_check_interval:
+            return True
+        try:
+            with conn.cursor() as cur:
+                cur.execute("select 1")
+            conn.rollback()
+            return True
+        except psycopg2.Error:
+            return False
+
+    def getconn(self, timeout=None):
+        timeout=self.checkout_timeout if timeout is None else timeout
+        if not self._slots.acquire(timeout=timeout):
+            raise PoolError(f"no connection available within {timeout:.1f}s (max {self.maxconn})")
+        try:
+            for _ in range(2): # one reconnect attempt for a dropped connection
+                conn=self._pool.getconn()
+                if self._healthy(conn):
+                    return conn
+                self._last_used.pop(id(conn), None)
+                self._pool.putconn(conn, close=True)
+                self.reconnects+=1
+            raise psycopg2.OperationalError("could not obtain a healthy connection")
+        except Exception:
+            self._slots.release()
+            raise
+
+    def putconn(self, conn):
+        try:
+            broken=bool(conn.closed)
+            if not broken and conn.get_transaction_status() != psycopg2.extensions.TRANSACTION_STATUS_IDLE:
+                try:
+                    conn.rollback() # never hand out a connection mid-transaction
+                except psycopg2.Error:
+                    broken=True
+            if broken:
+                self._last_used.pop(id(conn), None)
+            else:
+                self._last_used[id(conn)]=time.monotonic()
+            self._pool.putconn(conn, close=broken)
+        finally:
+            self._slots.release()
+
+    @contextmanager
+    def connection(self):
+        conn=self.getconn()
+        try:
+            yield conn
+        finally:
+            self.putconn(conn) # rolls back anything left uncommitted
+
+    @contextmanager
+    def cursor(self, commit=False):
+        with self.connection() as conn:
+            cur=conn.cursor()
+            try:
+                yield cur
+                if commit:
+                    conn.commit()
+            finally:
+                cur.close()
+
+    def closeall(self):
+        self._pool.closeall()
+        self._last_used.clear()
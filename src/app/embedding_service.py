@@ -0,0 +1,198 @@
+import os, sys, time, queue, argparse, threading
+from concurrent.futures import Future
+from multiprocessing.connection import Listener, Client
+
+import numpy as np
+
+from src.app.metrics import observe, registry
+
+# Shared embedding encoder with dynamic micro-batching.
+#   in-process (default): every session in this process shares one model + one batching worker
+#   separate process:     python -m src.app.embedding_service --address unix:/tmp/luna-embed.sock
+#                         then LUNA_EMBEDDING_SERVICE=unix:/tmp/luna-embed.sock in each app process
+
+class MicroBatcher:
+    # encode() callers are queued; the worker flushes at max_batch texts or max_wait_ms after the first one
+    def __init__(self, encode_fn, max_batch=None, max_wait_ms=None):
+        self.encode_fn=encode_fn
+        self.max_batch=int(max_batch if max_batch is not None else os.getenv("LUNA_EMBED_MAX_BATCH", 32))
+        self.max_wait=float(max_wait_ms if max_wait_ms is not None else os.getenv("LUNA_EMBED_MAX_WAIT_MS", 5)) / 1000
+        self.timeout=float(os.getenv("LUNA_EMBED_TIMEOUT", 30)) # seconds an encode() caller waits for its batch
+        self._queue=queue.Queue()
+        self.batches=0
+        self.texts=0
+        self._thread=threading.Thread(target=self._run, name="luna-embed-batcher", daemon=True)
+        self._thread.start()
+
+    def encode(self, texts, batch_size=None, **kwargs):
+        # Same call shape as SentenceTransformer.encode: str -> vector, list -> matrix
+        single=isinstance(texts, str)
+        items=[texts] if single else list(texts)
+        if not items:
+            return np.zeros((0, 0), dtype=np.float32)
+        future=Future()
+        self._queue.put((items, time.perf_counter(), future))
+        out=future.result(timeout=self.timeout)
+        return out[0] if single else out
+
+    def _collect(self):
+        batch=[self._queue.get()]
+        size=len(batch[0][0])
+        deadline=time.perf_counter() + self.max_wait
+        while size < self.max_batch:
+            remaining=deadline - time.perf_counter()
+            if remaining <= 0:
+                break
+            try:
+                item=self._queue.get(timeout=remaining)
+            except queue.Empty:
+                break
+            batch.append(item)
+            size+=len(item[0])
+        return batch
+
+    def _run(self):
+        while True:
+            batch=self._collect()
+            try:
+                self._flush(batch)
+            except Exception as e: # the worker must survive anything, or every encode() caller waits for nothing
+                for _, _, future in batch:
+                    if not future.done():
+                        future.set_exception(e)
+
+    def _flush(self, batch):
+        texts=[t for items, _, _ in batch for t in items]
+        started=time.perf_counter()
+        for _, enqueued, _ in batch:
+            observe("luna_embed_queue_ms", (started - enqueued) * 1000)
+        vectors=np.asarray(self.encode_fn(texts, batch_size=len(texts)), dtype=np.float32)
+        observe("luna_embed_batch_ms", (time.perf_counter() - started) * 1000)
+        observe("luna_embed_batch_size", len(texts))
+        self.batches+=1
+        self.texts+=len(texts)
+        offset=0
+        for items, _, future in batch:
+            future.set_result(vectors[offset:offset + len(items)])
+            offset+=len(items)
+
+    def stats(self):
+        snapshot=registry.snapshot()
+        return {
+            "batches": self.batches,
+            "texts": self.texts,
+            "avg_batch_size": self.texts / self.batches if self.batches else 0.0,
+            "queue_ms": snapshot.get("luna_embed_queue_ms", {}),
+            "batch_ms": snapshot.get("luna_embed_batch_ms", {}),
+        }
+
+def parse_address(address):
+    # "unix:/path.sock" -> AF_UNIX, "host:port" -> AF_INET
+    if address.startswith("unix:"):
+        return address[len("unix:"):], "AF_UNIX"
+    host, _, port=address.rpartition(":")
+    return (host or "127.0.0.1", int(port)), "AF_INET"
+
+def _authkey(family):
+    # The connection speaks pickle: whoever authenticates can run code in the server. A unix socket is guarded by
+    # its file mode (owner only); a TCP address needs an explicit shared secret, there is deliberately no default.
+    key=os.getenv("LUNA_EMBED_AUTHKEY")
+    if key:
+        return key.encode()
+    if family != "AF_UNIX":
+        raise RuntimeError("LUNA_EMBED_AUTHKEY must be set to use the embedding service over TCP")
+    return None
+
+class EmbeddingClient:
+    # Drop-in for the model: encode() is forwarded to an embedding server; one connection per thread
+    def __init__(self, address, authkey=None):
+        self.address, self.family=parse_address(address)
+        self.authkey=authkey or _authkey(self.family)
+        self._local=threading.local()
+
+    def _conn(self):
+        conn=getattr(self._local, "conn", None)
+        if conn is None or conn.closed:
+            conn=self._local.conn=Client(self.address, family=self.family, authkey=self.authkey)
+        return conn
+
+    def _call(self, op, payload=None):
+        conn=self._conn()
+        try:
+            conn.send((op, payload))
+            status, result=conn.recv()
+        except (EOFError, OSError):
+            conn.close() # reconnect on next call
+            raise
+        if status != "ok":
+            raise RuntimeError(f"embedding service error: {result}")
+        return result
+
+    def encode(self, texts, batch_size=None, **kwargs):
+        single=isinstance(texts, str)
+        out=self._call("encode", [texts] if single else list(texts))
+        return out[0] if single else out
+
+    def stats(self):
+        return self._call("stats")
+
+def _handle(conn, embedder):
+    with conn:
+        while True:
+            try:
+                op, payload=conn.recv()
+            except (EOFError, OSError):
+                return
+            try:
+                if op == "encode":
+                    conn.send(("ok", embedder.encode(payload)))
+                elif op == "stats":
+                    conn.send(("ok", embedder.stats()))
+                else:
+                    conn.send(("error", f"unknown op {op!r}"))
+            except Exception as e:
+                conn.send(("error", str(e)))
+
+def serve(address, embedder):
+    addr, family=parse_address(address)
+    authkey=_authkey(family)
+    if family == "AF_UNIX" and os.path.exists(addr):
+        os.remove(addr) # stale socket from a previous run
+    mask=os.umask(0o177) # socket file created owner-only, no window where others can connect
+    try:
+        listener=Listener(addr, family=family, authkey=authkey)
+    finally:
+        os.umask(mask)
+    print(f"[Embed] serving on {address}")
+    while True:
+        try:
+            conn=listener.accept()
+        except Exception as e: # failed auth / handshake
+            print(f"[Embed] rejected connection: {e}")
+            continue
+        threading.Thread(target=_handle, args=(conn, embedder), name="luna-embed-conn", daemon=True).start()
+
+def main(argv=None):
+    parser=argparse.ArgumentParser(description="Shared micro-batching embedding server")
+    parser.add_argument("--address", default=os.getenv("LUNA_EMBED_ADDRESS", "unix:/tmp/luna-embed.sock"))
+    parser.add_argument("--max-batch", type=int, default=None)
+    parser.add_argument("--max-wait-ms", type=float, default=None)
+    parser.add_argument("--report-every", type=float, default=60.0, help="seconds between stats lines (0 = off)")
+    args=parser.parse_args(argv)
+
+    from src.app.vector_db import embedding_model # heavy import only in the server process
+    t0=time.perf_counter()
+    batcher=MicroBatcher(embedding_model().encode, max_batch=args.max_batch, max_wait_ms=args.max_wait_ms)
+    print(f"[Embed] model loaded in {(time.perf_counter() - t0):.1f}s (max batch {batcher.max_batch}, max wait {batcher.max_wait * 1000:.0f} ms)")
+    if args.report_every:
+        def _report():
+            while True:
+                time.sleep(args.report_every)
+                st=batcher.stats()
+                print(f"[Embed] {st['batches']} batches, avg size {st['avg_batch_size']:.1f}, "
+                      f"queue p95 {st['queue_ms'].get('p95', 0):.1f} ms, batch p95 {st['batch_ms'].get('p95', 0):.1f} ms")
+        threading.Thread(target=_report, name="luna-embed-report", daemon=True).start()
+    serve(args.address, batcher)
+
+if __name__ == "__main__":
+    sys.exit(main())
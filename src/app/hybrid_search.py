@@ -0,0 +1,132 @@
+import os, re, sys, json, argparse
+
+from psycopg2.extras import Json
+
+from src.app.vector_storage import COLUMNS, FILTER_CLAUSE, THRESHOLD_CLAUSE, IDENTITY_SCHEMA, _compact_expr, _where, index_knobs, \
+    detail_sql, source_expr
+
+# Hybrid retrieval: full-text (tsvector) and vector rankings fused with reciprocal rank fusion in one statement.
+# Each leg fetches its own candidates (metadata filter pushed into both); the similarity threshold prunes the vector
+# leg and the fused rows, so lexical-only hits below it are dropped too. score = sum over legs of 1 / (rrf_k + rank).
+# Exact-term queries ("WebRTC", "$440,000") are found by the lexical leg even when the embedding ranks them low.
+# Queries are parsed with the configuration content_tsv was built with; migrate rebuilds it for LUNA_TS_CONFIG.
+#   python -m src.app.hybrid_search migrate                 # content_tsv column + GIN index on existing tables
+#   python -m src.app.hybrid_search compare "salary range"  # vector vs hybrid results side by side
+
+TS_CONFIG=os.getenv("LUNA_TS_CONFIG", "english")
+
+def migration_sql():
+    # Parameter: ts_config (the text search configuration is bound, never interpolated)
+    return [
+        "alter table documents add column if not exists content_tsv tsvector "
+        "generated always as (to_tsvector(%(ts_config)s::regconfig, content)) stored",
+        "create index if not exists documents_content_tsv_idx on documents using gin (content_tsv)",
+    ]
+
+def stored_ts_config(cur):
+    # -> the text search configuration content_tsv is generated with, None if there is no such column
+    cur.execute('''
+        select pg_get_expr(d.adbin, d.adrelid) from pg_attrdef d
+        join pg_attribute a on a.attrelid = d.adrelid and a.attnum = d.adnum
+        where d.adrelid = 'documents'::regclass and a.attname = 'content_tsv' and not a.attisdropped
+    ''')
+    row=cur.fetchone()
+    match=re.search(r"'([^']+)'::regconfig", row[0]) if row else None # to_tsvector('english'::regconfig, content)
+    return match.group(1) if match else None
+
+def hybrid_config():
+    return {
+        "candidates": int(os.getenv("LUNA_HYBRID_CANDIDATES", 20)), # per leg
+        "rrf_k": int(os.getenv("LUNA_RRF_K", 60)),
+    }
+
+def hybrid_sql(mode="full", dim=256, filtered=False, thresholded=False, detail=False, has_source_id=True):
+    # Parameters: q (query vector), text, ts_config, k, candidates, rrf_k, filters (jsonb), threshold
+    order="embedding <=> %(q)s::vector" if mode == "full" else \
+        f"{COLUMNS[mode]} {'<=>' if mode == 'halfvec' else '<~>'} {_compact_expr(mode, dim, '%(q)s::vector')}"
+    sql=f'''
+        with vec as (
+            select id, row_number() over (order by distance) as rank
+            from (
+                select id, embedding <=> %(q)s::vector as distance
+                from documents
+                {_where(filtered and FILTER_CLAUSE, thresholded and THRESHOLD_CLAUSE)}
+                order by {order}
+                limit %(candidates)s
+            ) c
+        ),
+        lex as (
+            select id, row_number() over (order by lex_score desc) as rank
+            from (
+                select id, ts_rank_cd(content_tsv, query) as lex_score
+                from documents, websearch_to_tsquery(%(ts_config)s::regconfig, %(text)s) query
+                {_where("content_tsv @@ query", filtered and FILTER_CLAUSE)}
+                order by lex_score desc
+                limit %(candidates)s
+            ) c
+        )
+        select d.content,
+               coalesce(1.0 / (%(rrf_k)s + v.rank), 0) + coalesce(1.0 / (%(rrf_k)s + l.rank), 0) as rrf_score
+               {f", d.id, {source_expr(has_source_id, 'd.')}, d.embedding, d.embedding <=> %(q)s::vector as distance" if detail else ""}
+        from vec v
+        full outer join lex l on l.id = v.id
+        join documents d on d.id = coalesce(v.id, l.id)
+        {_where(thresholded and THRESHOLD_CLAUSE)}
+        order by rrf_score desc
+        limit %(k)s
+    '''
+    return detail_sql(sql, "rrf_score desc, id", "rrf_score") if detail else sql.rstrip() + ";"
+
+def hybrid_search(cur, text, embedding, top_k, mode="full", dim=256, oversample=4, probes=None, ef_search=None,
+                  filters=None, threshold=None, candidates=20, rrf_k=60, detail=False, has_source_id=True, ts_config=TS_CONFIG):
+    # -> [(content, rrf score)] in one round trip; oversample is unused (the candidate count is per leg)
+    # detail=True -> [(content, rrf score, id, source_id, cosine distance, similarities to every row)]
+    candidates=max(candidates, top_k)
+    if mode != "full":
+        ef_search=max(ef_search or 40, candidates)
+    sql=index_knobs(probes, ef_search) + hybrid_sql(mode, dim, filtered=bool(filters), thresholded=threshold is not None,
+                                                  detail=detail, has_source_id=has_source_id)
+    cur.execute(sql, {"q": list(map(float, embedding)), "text": text, "ts_config": ts_config, "k": top_k, "candidates": candidates,
+                      "rrf_k": rrf_k, "probes": probes, "ef_search": ef_search,
+                      "filters": Json(filters or {}), "threshold": threshold})
+    return cur.fetchall()
+
+def migrate(get_pool):
+    with get_pool().cursor(commit=True) as cur:
+        for statement in IDENTITY_SCHEMA:
+            cur.execute(statement)
+        stored=stored_ts_config(cur)
+        if stored and stored != TS_CONFIG:
+            print(f"[Hybrid] content_tsv uses '{stored}', re-creating with '{TS_CONFIG}'")
+            cur.execute("alter table documents drop column content_tsv") # drops its GIN index too
+        for statement in migration_sql():
+            cur.execute(statement, {"ts_config": TS_CONFIG})
+    print(f"[Hybrid] content_tsv ready ({TS_CONFIG})")
+
+def main(argv=None):
+    parser=argparse.ArgumentParser(description="Hybrid lexical + vector retrieval")
+    sub=parser.add_subparsers(dest="command", required=True)
+    sub.add_parser("migrate")
+    c=sub.add_parser("compare")
+    c.add_argument("queries", nargs="+")
+    c.add_argument("--top-k", type=int, default=3)
+    c.add_argument("--filter", help='metadata filter as JSON, e.g. {"source": "careers"}')
+    c.add_argument("--threshold", type=float)
+    args=parser.parse_args(argv)
+
+    from src.app.vector_db import get_pool, query_postgresql
+    if args.command == "migrate":
+        migrate(get_pool)
+        return 0
+    filters=json.loads(args.filter) if args.filter else None
+    for q in args.queries:
+        print(f"\n[Query] {q}")
+        for retrieval in ("vector", "hybrid"):
+            rows=query_postgresql(q, top_k=args.top_k, filters=filters, threshold=args.threshold, retrieval=retrieval)
+            print(f"  {retrieval}:")
+            for content in rows:
+                print(f"    - {' '.join(content.split())[:100]}")
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,255 @@
+import os, re, sys, time, argparse, threading
+
+import numpy as np
+from langchain_core.agents import AgentAction
+from langchain_core.messages import SystemMessage, HumanMessage, AIMessage
+
+from src.app.metrics import observe
+from src.app.answer_cache import CONTEXT_DEPENDENT
+
+# Pre-agent intent router: obvious requests skip the LLM tool-selection round trip.
+#   price     -> Binance Search, answered from a template (no LLM call)
+#   identity  -> fixed self-introduction (no LLM call)
+#   lunaspace -> VectorDB + one summarization call
+#   news      -> Search + one summarization call
+# Stage 1 is keyword / symbol rules; stage 2 (no rule fired) is nearest-centroid over embedded examples.
+# Anything ambiguous, multi-intent or context-dependent falls through to the agent.
+#   python -m src.app.intent_router eval [--hash-encoder]   # precision / coverage / latency on the labelled set
+
+TOOLS={"price": "Binance Search", "lunaspace": "VectorDB", "news": "Search"}
+IDENTITY="Hi! I'm LUNA — short for *Luminous, Unbounded, Neural Agent*. I'm here to help you shine, learn without limits, and explore ideas powered by neural intelligence. 🌌"
+COINS={"BTC": "BTCUSDT", "BITCOIN": "BTCUSDT", "ETH": "ETHUSDT", "ETHEREUM": "ETHUSDT", "SOL": "SOLUSDT", "SOLANA": "SOLUSDT",
+       "DOGE": "DOGEUSDT", "DOGECOIN": "DOGEUSDT", "XRP": "XRPUSDT", "BNB": "BNBUSDT", "ADA": "ADAUSDT", "CARDANO": "ADAUSDT",
+       "AVAX": "AVAXUSDT", "DOT": "DOTUSDT", "LINK": "LINKUSDT", "LTC": "LTCUSDT", "TRX": "TRXUSDT", "SHIB": "SHIBUSDT"}
+AMBIGUOUS={"LINK", "DOT", "SOL"} # also plain English words: only a ticker when written in capitals or next to a price word
+PAIR=re.compile(r"\b([A-Z]{2,10}USDT)\b", re.I)
+PRICE=re.compile(r"\b(price|prices|trading at|worth|how much|quote|going for|cost)\b", re.I)
+QUOTED=r"\b(price of|prices of|quote for|quote|price)\s+{0}\b|\b{0}\s+(price|prices|quote|usd|usdt)\b"
+NOT_A_QUOTE=re.compile(r"\b(news|why|predict\w*|forecast|analy\w+|should i|compare|history|historical|chart|etf|trend\w*|will|tomorrow|next)\b", re.I)
+# LunaSpace questions: the company by name, or a phrase that only makes sense about the posting ("the role" but not
+# "the role of mitochondria"); generic topic words (benefits, equity, requirements, ...) need an xAI / Grok anchor
+LUNASPACE=re.compile(r"\blunaspace\b|\b(the|this) (role|job|position|opening|posting)\b(?!\s+of\b)|\bthe tech stack\b|\bpalo alto\b", re.I)
+ORG=re.compile(r"\b(xai|grok)\b", re.I)
+TOPIC=re.compile(r"\b(salary|salaries|compensation|benefits?|401\(?k\)?|equity|relocat\w*|tech stack|job|role|position|"
+                 r"hiring|mission|culture|responsibilit\w+|requirements?|located|location)\b", re.I)
+NEWS=re.compile(r"\b(latest|news|headlines?|this week|trending|just announced|breaking)\b", re.I) # not "today"/"currently"
+WHO=re.compile(r"^\W*(who|what)\s+are\s+you\W*$|\byour name\b|\bintroduce yourself\b", re.I)
+
+EXAMPLES={ # nearest-centroid training set; "agent" is the reject class
+    "price": ["BTC price now?", "how much is ethereum right now", "current price of solana", "what is DOGE trading at",
+              "XRP quote please", "bitcoin value in usd"],
+    "lunaspace": ["what does LunaSpace pay", "salary range for the role?", "what benefits are offered", "where is the job located",
+                  "what tech stack does the team use", "LunaSpace mission and culture", "what are the responsibilities of the role",
+                  "do I need to relocate for this position"],
+    "news": ["latest AI agent news", "what happened in tech today", "recent headlines about openai", "what's trending in crypto this week",
+             "newest smartphone announcements", "current events in the world"],
+    "agent": ["explain vector databases", "write a python function to reverse a list", "how does TCP congestion control work",
+              "tell me a joke", "help me plan a trip to japan", "what is the difference between rust and go",
+              "summarize the theory of relativity", "can you review my essay"],
+}
+
+LABELLED=[ # (query, expected route); "agent" = should fall through
+    ("BTC price now?", "price"), ("ETH and SOL price", "price"), ("how much is bitcoin worth", "price"), ("DOGEUSDT price", "price"),
+    ("what's the price of cardano", "price"), ("BNB quote", "price"),
+    ("salary range for the role?", "lunaspace"), ("what is the tech stack", "lunaspace"), ("where is the role located", "lunaspace"),
+    ("what benefits are offered", "lunaspace"), ("LunaSpace mission", "lunaspace"), ("does the job offer equity", "lunaspace"),
+    ("latest AI agent news", "news"), ("tech headlines today", "news"), ("what's trending on the internet right now", "news"),
+    ("news about the fed this week", "news"),
+    ("who are you", "identity"), ("what's your name?", "identity"),
+    ("BTC price and latest ETF news", "agent"), ("will bitcoin go up tomorrow", "agent"), ("explain vector databases", "agent"),
+    ("write a haiku about the moon", "agent"), ("how do I center a div", "agent"), ("what about its benefits?", "agent"),
+    ("compare rust and python for web servers", "agent"), ("why did ETH drop", "agent"),
+    # generic words that also appear in LunaSpace / news / ticker rules
+    ("What is the role of mitochondria in a cell?", "agent"), ("health benefits of green tea", "agent"),
+    ("tips for a job interview", "agent"), ("explain equity vs debt financing", "agent"),
+    ("what are the requirements for a US visa", "agent"), ("what's the weather today", "agent"),
+    ("I'm currently learning Rust, any tips?", "agent"), ("write a poem about today", "agent"),
+    ("how much does a link cost on chainlink", "agent"), ("what is a dot product", "agent"),
+    ("what benefits does xAI offer", "lunaspace"), ("LINK price", "price"), ("price of sol", "price"),
+]
+
+class Route:
+    __slots__=("intent", "tool", "tool_input", "confidence", "source")
+
+    def __init__(self, intent, tool=None, tool_input=None, confidence=1.0, source="rule"):
+        self.intent=intent
+        self.tool=tool
+        self.tool_input=tool_input
+        self.confidence=confidence
+        self.source=source
+
+    def __repr__(self):
+        return f"Route({self.intent!r}, {self.tool!r}, {self.tool_input!r}, {self.confidence:.2f}, {self.source!r})"
+
+def symbols_in(text):
+    found=[]
+    for word in re.findall(r"[A-Za-z]+", text):
+        symbol=word.upper()
+        if symbol not in COINS:
+            continue
+        if symbol in AMBIGUOUS and word != symbol and not re.search(QUOTED.format(re.escape(word)), text, re.I):
+            continue # "a link", "dot product", "sol" in Spanish
+        found.append(COINS[symbol])
+    found+=[p.upper() for p in PAIR.findall(text)]
+    return list(dict.fromkeys(found))
+
+class IntentRouter:
+    def __init__(self, embed_fn=None, threshold=None, margin=None, examples=EXAMPLES):
+        self.embed_fn=embed_fn # text -> vector; None -> rules only
+        self.threshold=float(threshold if threshold is not None else os.getenv("LUNA_ROUTER_THRESHOLD", 0.6))
+        self.margin=float(margin if margin is not None else os.getenv("LUNA_ROUTER_MARGIN", 0.05))
+        self.examples=examples
+        self._centroids=None # (labels, matrix), built on first use
+        self._lock=threading.Lock()
+
+    def _rules(self, text):
+        routes=[]
+        symbols=symbols_in(text)
+        if symbols and PRICE.search(text) and not NOT_A_QUOTE.search(text):
+            routes.append(Route("price", TOOLS["price"], ",".join(symbols)))
+        elif symbols and NOT_A_QUOTE.search(text):
+            return None # crypto + news/analysis: needs the agent's judgement (and often two tools)
+        if WHO.search(text):
+            routes.append(Route("identity"))
+        if LUNASPACE.search(text) or (ORG.search(text) and TOPIC.search(text)):
+            routes.append(Route("lunaspace", TOOLS["lunaspace"], text, 0.9))
+        if NEWS.search(text) and not symbols:
+            routes.append(Route("news", TOOLS["news"], text, 0.9))
+        return routes
+
+    def _build_centroids(self):
+        labels, rows=[], []
+        for label, texts in self.examples.items():
+            vectors=np.asarray([np.asarray(self.embed_fn(t), dtype=np.float32) for t in texts])
+            vectors/=np.linalg.norm(vectors, axis=1, keepdims=True) + 1e-12
+            centroid=vectors.mean(axis=0)
+            labels.append(label)
+            rows.append(centroid / (np.linalg.norm(centroid) + 1e-12))
+        return labels, np.vstack(rows)
+
+    def _nearest(self, text):
+        if self._centroids is None:
+            with self._lock:
+                if self._centroids is None:
+                    self._centroids=self._build_centroids()
+        labels, matrix=self._centroids
+        query=np.asarray(self.embed_fn(text), dtype=np.float32)
+        scores=matrix @ (query / (np.linalg.norm(query) + 1e-12))
+        order=np.argsort(-scores)
+        best, second=order[0], order[1]
+        label, score=labels[best], float(scores[best])
+        if label == "agent" or score < self.threshold or score - float(scores[second]) < self.margin:
+            return None
+        if label == "price":
+            symbols=symbols_in(text)
+            if not symbols:
+                return None # nothing to quote
+            return Route("price", TOOLS["price"], ",".join(symbols), score, "centroid")
+        return Route(label, TOOLS.get(label), text, score, "centroid")
+
+    def route(self, text):
+        # -> Route or None (fall through to the agent)
+        t0=time.perf_counter()
+        try:
+            if not text.strip() or CONTEXT_DEPENDENT.search(text):
+                return None
+            routes=self._rules(text)
+            if routes is None or len(routes) > 1:
+                return None # ambiguous / multi-intent
+            if routes:
+                return routes[0]
+            if self.embed_fn is None:
+                return None
+            try:
+                return self._nearest(text)
+            except Exception as e: # embedding model unavailable -> rules only
+                print(f"[Router] centroid stage skipped: {e}")
+                return None
+        finally:
+            observe("luna_router_ms", (time.perf_counter() - t0) * 1000)
+
+def _summarize_messages(question, tool, observation, history_messages):
+    system=("You are LUNA, a warm, concise assistant. Answer the user's question using the context below. "
+            "Summarize it naturally in a few short sentences; do not dump raw chunks. "
+            "Include the date and time for real-time data. Use a fitting emoji or two. 🌙\n\n"
+            f"Context from {tool}:\n{observation}")
+    return [SystemMessage(content=system)] + list(history_messages) + [HumanMessage(content=question)]
+
+def answer_route(route, question, tools, llm=None, history=None, config=None):
+    # Executes a route: one tool call and at most one LLM call. -> {"output", "intermediate_steps"} like the agent.
+    # history (BaseChatMessageHistory) gets the exchange appended, as RunnableWithMessageHistory would.
+    steps=[]
+    if route.intent == "identity":
+        output=IDENTITY
+    else:
+        tool=next(t for t in tools if t.name == route.tool)
+        observation=tool.func(route.tool_input)
+        steps.append((AgentAction(tool=route.tool, tool_input=route.tool_input, log=f"routed ({route.source}, {route.confidence:.2f})"), observation))
+        if route.intent == "price":
+            output=str(observation) # already "As of ..., BTCUSDT is trading at approximately $... USD. 🚀"
+        else:
+            messages=_summarize_messages(question, route.tool, observation, history.messages if history is not None else [])
+            output=str(llm.invoke(messages, config=config).content)
+    if history is not None:
+        history.add_messages([HumanMessage(content=question), AIMessage(content=output)])
+    return {"output": output, "intermediate_steps": steps}
+
+def evaluate(router, labelled=LABELLED):
+    # Precision of routed queries, coverage, per-intent counts, misroutes and routing latency
+    routed=correct=0
+    misroutes=[]
+    latencies=[]
+    for text, expected in labelled:
+        t0=time.perf_counter()
+        route=router.route(text)
+        latencies.append((time.perf_counter() - t0) * 1000)
+        got=route.intent if route else "agent"
+        if route:
+            routed+=1
+            correct+=got == expected
+        if got != expected:
+            misroutes.append((text, expected, got))
+    should_route=sum(1 for _, e in labelled if e != "agent")
+    return {
+        "queries": len(labelled),
+        "routed": routed,
+        "precision": correct / routed if routed else 0.0,
+        "coverage": correct / should_route if should_route else 0.0,
+        "p50_ms": float(np.percentile(latencies, 50)),
+        "p95_ms": float(np.percentile(latencies, 95)),
+        "misroutes": misroutes,
+    }
+
+def main(argv=None):
+    parser=argparse.ArgumentParser(description="Evaluate the intent router on a labelled query set")
+    parser.add_argument("command", choices=["eval"])
+    parser.add_argument("--labels", help="JSONL of {\"query\": ..., \"intent\": price|lunaspace|news|identity|agent}")
+    parser.add_argument("--hash-encoder", action="store_true", help="offline: hashed bag-of-words instead of the real model")
+    parser.add_argument("--rules-only", action="store_true")
+    parser.add_argument("--llm-ms", type=float, default=800.0, help="assumed cost of the skipped tool-selection LLM call")
+    args=parser.parse_args(argv)
+
+    labelled=LABELLED
+    if args.labels:
+        import json
+        with open(args.labels, encoding="utf-8") as f:
+            labelled=[(row["query"], row["intent"]) for row in map(json.loads, filter(str.strip, f))]
+    embed_fn=None
+    if not args.rules_only:
+        if args.hash_encoder:
+            from src.app.benchmark import HashEncoder
+            embed_fn=HashEncoder().encode
+        else:
+            from src.app.vector_db import embed_query
+            embed_fn=embed_query
+    result=evaluate(IntentRouter(embed_fn), labelled)
+    print(f"[Router] {result['routed']}/{result['queries']} routed, precision {result['precision']:.1%}, "
+          f"coverage {result['coverage']:.1%}, routing p50 {result['p50_ms']:.2f} ms / p95 {result['p95_ms']:.2f} ms")
+    print(f"[Router] ~{result['routed'] * args.llm_ms / 1000:.1f}s of tool-selection LLM time saved "
+          f"(assuming {args.llm_ms:.0f} ms per call)")
+    for text, expected, got in result["misroutes"]:
+        print(f"  miss: {text!r}: expected {expected}, got {got}")
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -1,64 +1,66 @@
 from __future__ import annotations
 
-import os
+import os, re, uuid
 import time, datetime
 import random
 from dotenv import load_dotenv
 
 import streamlit as st
 
-from langchain_core.runnables.history import RunnableWithMessageHistory
-from langchain_core.chat_history import InMemoryChatMessageHistory
-from langchain_core.prompts import ChatPromptTemplate, MessagesPlaceholder
-from langchain_core.tools import Tool
-from langchain.callbacks.file import FileCallbackHandler
-from langchain_core.callbacks import StdOutCallbackHandler
+from langchain_core.chat_history import BaseChatMessageHistory
+from langchain_core.messages import HumanMessage, AIMessage
 from langchain_community.callbacks.streamlit import StreamlitCallbackHandler
 
-from binance.client import Client # Binance
-
-from langchain_groq import ChatGroq
-from langchain_community.utilities import SerpAPIWrapper
-from langchain.agents import create_tool_calling_agent, AgentExecutor
-
 # vector search / docker ps
-from src.app.vector_db import query_postgresql
-import json
+from src.app.vector_db import warm_up, get_pool, embed_query, on_invalidate
+from src.app.answer_cache import SemanticAnswerCache, step_tools
+from src.app.intent_router import IntentRouter, answer_route
+from src.app.session_store import SessionStore
+from src.app.agent_core import MODELS, build_llm, build_tools, build_prompt, build_agent, new_history, system_prompt_tokens
+from src.app.resilience import turn_budget, breaker_stats, CircuitOpen, DeadlineExceeded
+from src.app.memory import count_tokens
 from langchain.callbacks.base import BaseCallbackHandler
+from src.app.trace_writer import TraceWriter, JsonlTraceHandler
+from src.app.metrics import observe, start_http_exporter, start_periodic_dump
+
+class StreamingAnswerHandler(BaseCallbackHandler):
+    # Renders LLM tokens into a Streamlit placeholder; every new LLM call in the agent loop starts over,
+    # so tool-selection chatter is replaced by the final answer. Records time-to-first-token.
+    def __init__(self, placeholder, start=None):
+        self.placeholder=placeholder
+        self.start=start or time.perf_counter()
+        self.first_token_ms=None
+        self.text=""
 
-class JsonCallbackHandler(BaseCallbackHandler):
-    # Callback handler that logs the output to a JSON file.
-    def __init__(self, filename="logs.json", model_name=None):
-        self.filename=filename
-        self.model_name=model_name or "unknown_model"
-        self.messages=[]
+    def _reset(self):
+        self.text=""
 
     def on_llm_start(self, serialized, prompts, **kwargs):
-        for prompt in prompts:
-            self.messages.append({"role": "user", "content": prompt}) # self.data.append(self._serialize_response(response)) / self.data.append(response)
-    
-    def on_llm_end(self, response, **kwargs):
-        try:
-            content=getattr(response, "output_text", None) or str(response)
-            self.messages.append({"role": "assistant", "content": content})
-        except Exception:
-            self.messages.append({"role": "assistant", "content": str(response)})
-
-    def on_agent_end(self, response, **kwargs):
-        try:
-            content=getattr(response, "output_text", None) or str(response)
-            self.messages.append({"role": "assistant", "content": content})
-        except Exception:
-            self.messages.append({"role": "assistant", "content": str(response)})
-        # self.data.append(self._serialize_response(response)) # self.data.append(response)
-
-    def save(self):
-        data={
-            "model": self.model_name,
-            "messages": self.messages
-        }
-        with open(self.filename, "w", encoding="utf-8") as f:
-            json.dump(data, f, ensure_ascii=False, indent=2)
+        self._reset()
+
+    def on_chat_model_start(self, serialized, messages, **kwargs):
+        self._reset()
+
+    def on_llm_new_token(self, token, **kwargs):
+        if not token:
+            return # tool-call chunks carry no text
+        if self.first_token_ms is None:
+            self.first_token_ms=(time.perf_counter() - self.start) * 1000
+        self.text+=token
+        self.placeholder.markdown(self.text + "▌")
+
+def stream_agent(runnable, inputs, config, status):
+    # Consume the executor's step stream: tool calls go to the status panel, output is collected
+    response={"output": "", "intermediate_steps": []}
+    for chunk in runnable.stream(inputs, config=config):
+        for action in chunk.get("actions", []):
+            status.write(f"• Calling **{getattr(action, 'tool', 'tool')}**...")
+        for step in chunk.get("steps", []):
+            response["intermediate_steps"].append((step.action, step.observation))
+            status.write(f"• {getattr(step.action, 'tool', 'tool')} returned")
+        if "output" in chunk:
+            response["output"]=chunk["output"]
+    return response
 
 def right_container():
     global current_hour
@@ -77,28 +79,61 @@ def right_container():
     st.markdown(f"<h1 style='text-align: center; color: {font_color};'>{random_greetings}~, 𝕏.</h1>", unsafe_allow_html=True) #1F2937
     st.markdown(f"<p style='text-align: center; color: {font_color};'>How can I help you today?</p>", unsafe_allow_html=True) #6B7280
 
-def get_session_history(session_id: str) -> InMemoryChatMessageHistory:
-    if "store" not in st.session_state:
-        st.session_state.store={}
-    if session_id not in st.session_state.store:
-        st.session_state.store[session_id]=InMemoryChatMessageHistory()
-    return st.session_state.store[session_id]
-
-def left_container(api_key):
+@st.cache_resource(show_spinner=False)
+def get_session_store():
+    # Process-wide: hot histories in an LRU, written behind to Postgres (LUNA_SESSION_STORE=memory: in-process only)
+    pool=None if os.getenv('LUNA_SESSION_STORE', 'postgres') == 'memory' else get_pool
+    return SessionStore(new_history, get_pool=pool).start()
+
+def get_session_id() -> str:
+    # One id per browser session, kept in the URL (?sid=...) so a reload resumes the same history
+    if 'session_id' not in st.session_state:
+        sid=st.query_params.get('sid', '')
+        if not re.fullmatch(r'[A-Za-z0-9_-]{8,64}', sid):
+            sid=uuid.uuid4().hex
+        st.query_params['sid']=sid
+        st.session_state.session_id=sid
+    return st.session_state.session_id
+
+def get_session_history(session_id: str) -> BaseChatMessageHistory:
+    return get_session_store().get(session_id)
+
+def history_to_chat(history):
+    # Rebuild the display list from a resumed history's verbatim window
+    chat, human=[], None
+    for m in getattr(history, 'recent', []):
+        if m.type == 'human':
+            human=m.content
+        elif m.type == 'ai' and human is not None:
+            chat.append({"human": human, "ai": m.content, "timestamp": ""})
+            human=None
+    return chat
+
+def left_container(api_key, session_id):
     # Sidebar LLMs
     st.sidebar.title('Customize')
-    model=st.sidebar.selectbox('Choose your model', 
-                                ['openai/gpt-oss-120b', 
-                                 'meta-llama/llama-4-maverick-17b-128e-instruct', 
-                                 'deepseek-r1-distill-llama-70b', 
-                                 'qwen/qwen3-32b', 
-                                 'moonshotai/kimi-k2-instruct-0905'])
+    model=st.sidebar.selectbox('Choose your model', MODELS)
+    # Hedged / fallback requests go here when the chosen model is slow or failing (None: hedge to the same model)
+    fallbacks=['None'] + [m for m in MODELS if m != model]
+    default_fallback=os.getenv('LUNA_FALLBACK_MODEL', 'None')
+    fallback_model=st.sidebar.selectbox('Fallback model', fallbacks,
+                                        index=fallbacks.index(default_fallback) if default_fallback in fallbacks else 0)
+    fallback_model=None if fallback_model == 'None' else fallback_model
     conversation_memory_len=st.sidebar.slider('Conversational memory length: ', 
                                                1, 10, value=5)
     
     enable_streamlit_trace=st.sidebar.checkbox("Show live trace in UI (Streamlit)", value=True)
-    # enable_jsonl_logs=st.sidebar.checkbox("Write JSONL logs (logs.jsonl)", value=False)
-    enable_json_logs=st.sidebar.checkbox("Write JSON logs (logs.json)", value=False)
+    enable_streaming=st.sidebar.checkbox("Stream answer tokens", value=True)
+    enable_jsonl_logs=st.sidebar.checkbox("Write JSONL trace (logs.jsonl)", value=False)
+    enable_router=st.sidebar.checkbox("Fast-route obvious questions", value=os.getenv('LUNA_ROUTER', '1') != '0')
+    enable_answer_cache=st.sidebar.checkbox("Reuse answers to similar questions", value=os.getenv('LUNA_ANSWER_CACHE', '0') == '1')
+    if enable_answer_cache:
+        cache_stats=get_answer_cache().stats()
+        st.sidebar.caption(f"Answer cache: {cache_stats['hits']} hits / {cache_stats['hits'] + cache_stats['misses']} lookups "
+                           f"({cache_stats['hit_rate']:.0%}), ~{cache_stats['saved_ms'] / 1000:.1f}s saved")
+    degraded=[name for name, b in breaker_stats().items() if b['state'] != 'closed']
+    if degraded:
+        st.sidebar.warning(f"Degraded (circuit open): {', '.join(degraded)}")
 
     # --- LangSmith toggle ---
     enable_langsmith=st.sidebar.checkbox("Enable LangSmith Tracing", value=False)
@@ -115,13 +150,12 @@ def left_container(api_key):
     # Clear chat history
     if st.sidebar.button('𝕏', help='Delete Chat History'):
         st.session_state.chat_history=[]
-        if "store" in st.session_state:
-            st.session_state.store.clear()
+        get_session_history(session_id).clear()
         st.session_state.text_input=''
     
     # Session state for chat history & message store
     if 'chat_history' not in st.session_state:
-        st.session_state.chat_history=[]
+        st.session_state.chat_history=history_to_chat(get_session_history(session_id))
     if 'text_input' not in st.session_state:
         st.session_state.text_input=''
 
@@ -135,46 +169,69 @@ def left_container(api_key):
             st.write(message['ai']) # st.write(f'Luna: {message['ai']}')
             # st.markdown(f"<p class='chat-timestamp'>{message['timestamp']}</p>", unsafe_allow_html=True)
 
-    return model, conversation_memory_len, enable_streamlit_trace, enable_json_logs # enable_jsonl_logs
-
-def vector_search(q: str) -> str:
-    # query_postgresql -> [(content, score), ...]
-    results=query_postgresql(q, top_k=3)
-    chunks=[]
-    for row in results:
-        content=row[0] if isinstance(row, (list, tuple)) else row
-        chunks.append(str(content))
-    return "\n\n---\n\n".join(chunks) if chunks else ""
-
-def instrument_tool(name: str, func):
-    def _wrapped(q: str) -> str:
-        t0=time.perf_counter()
-        out=func(q)
-        dt_ms=(time.perf_counter() - t0) * 1000 # // 
-        try:
-            print(f"[Tool {name}] {dt_ms:.1f} ms") # terminal timing
-        except Exception:
-            pass
-        return out
-    return Tool(name=name, func=_wrapped, description=f"Instrumented {name}")
-
-
-def get_binance_search(symbol: str) -> str: 
-    try: 
-        client=Client( 
-            api_key=os.getenv("BINANCE_API_KEY"), 
-            api_secret=os.getenv("BINANCE_API_SECRET") 
-        ) 
-        ticker=client.get_symbol_ticker(symbol=symbol.upper()) 
-        price=float(ticker["price"]) 
-        timestamp=datetime.datetime.now().strftime("%Y-%m-%d %H:%M:%S") 
-        return f"As of {timestamp} UTC+7, {symbol.upper()} is trading at approximately ${price:,.2f} USD. 🚀" 
-    except Exception as e: 
-        return f"Error fetching price for {symbol.upper()}: {str(e)}"
+    return model, fallback_model, conversation_memory_len, enable_streamlit_trace, enable_jsonl_logs, enable_streaming, enable_answer_cache, enable_router
+
+def _build_agent(groq_api_key, model, fallback_model, _tools, _prompt):
+    return build_agent(build_llm(groq_api_key, model, fallback_model), _tools, _prompt, get_session_history)
+
+# Process-wide resource cache: tools/prompt are built once, the agent graph once per (key, model).
+# Underscored args are not hashed by Streamlit; they are themselves cached singletons.
+cached_tools=st.cache_resource(show_spinner=False)(build_tools)
+cached_prompt=st.cache_resource(show_spinner=False)(build_prompt)
+cached_agent=st.cache_resource(show_spinner=False, max_entries=8)(_build_agent)
+cached_llm=st.cache_resource(show_spinner=False, max_entries=8)(build_llm) # routed turns: one summarization call
+
+def get_agent(groq_api_key, model, fallback_model=None):
+    # LUNA_AGENT_CACHE=0 rebuilds everything per rerun (the old behaviour) for before/after comparison
+    if os.getenv('LUNA_AGENT_CACHE', '1') == '0':
+        return _build_agent(groq_api_key, model, fallback_model, build_tools(), build_prompt())
+    return cached_agent(groq_api_key, model, fallback_model, cached_tools(), cached_prompt())
+
+@st.cache_resource(show_spinner=False)
+def get_router():
+    # Rules + nearest-centroid over the shared embedding model (LUNA_ROUTER_EMBEDDINGS=0: rules only)
+    return IntentRouter(embed_query if os.getenv('LUNA_ROUTER_EMBEDDINGS', '1') != '0' else None)
+
+@st.cache_resource(show_spinner=False)
+def get_answer_cache():
+    # Process-wide: answers are shared across sessions, scoped per model; corpus writes drop VectorDB answers
+    cache=SemanticAnswerCache(embed_query)
+    on_invalidate(cache.invalidate)
+    return cache
+
+@st.cache_resource(show_spinner=False)
+def get_trace_writer():
+    # One background writer per process, shared by all sessions
+    return TraceWriter(
+        path=os.getenv('LUNA_TRACE_PATH', 'logs.jsonl'),
+        max_bytes=int(os.getenv('LUNA_TRACE_MAX_BYTES', 10_000_000)),
+        compress=os.getenv('LUNA_TRACE_COMPRESS', '0') == '1',
+    )
+
+@st.cache_resource(show_spinner=False)
+def start_metrics():
+    # LUNA_METRICS_PORT -> Prometheus text endpoint, LUNA_METRICS_DUMP -> periodic JSON snapshot
+    if os.getenv('LUNA_METRICS_PORT'):
+        start_http_exporter()
+    if os.getenv('LUNA_METRICS_DUMP'):
+        start_periodic_dump()
+    return True
+
+def get_trace_handler(model, session_id):
+    # Per-session, survives reruns; the agent graph itself is shared so it can't own this handler
+    handler=st.session_state.get('trace_handler')
+    if handler is None or handler.model_name != model or handler.session_id != session_id:
+        handler=JsonlTraceHandler(get_trace_writer(), model_name=model, session_id=session_id)
+        st.session_state.trace_handler=handler
+    return handler
 
 
 def main():
+    rerun_start=time.perf_counter()
     load_dotenv()
+    if os.getenv('LUNA_WARM_UP', '1') != '0':
+        warm_up(background=True) # preload embedding model + DB while the UI renders (no-op once loaded)
+    start_metrics()
     groq_api_key=os.getenv('GROQ_API_KEY') # Fixed API KEY
     brave_api_key=os.getenv('BRAVE_API_KEY')
     serp_api_key=os.getenv('SERP_API_KEY') # //
@@ -183,154 +240,22 @@ def main():
         st.error('Set GROQ_API_KEY & SERP_API_KEY in .env file.')
         return
     
+    session_id=get_session_id()
     right_container() # R
-    model, conversation_memory_len, enable_streamlit_trace, enable_json_logs=left_container(langchain_api_key) # L / enable_jsonl_logs
-
-    # Groq LLM
-    llm=ChatGroq(groq_api_key=groq_api_key, 
-                    model=model, 
-                    temperature=0.5, 
-                    max_tokens=1024, # max_completion_tokens
-                    stop=None, 
-                    streaming=True, # stream tokens
-    )
-
-    # Tools
-    binance_search_tool=Tool(
-        name="Binance Search",
-        func=get_binance_search,
-        description="Use this to get the real-time price of cryptocurrencies like BTC, ETH, SOL, etc. Input should be a symbol such as 'BTCUSDT' or 'ETHUSDT'."
-    )
-
-    search=SerpAPIWrapper()
-    search_tool=Tool(
-        name='Search',
-        func=search.run,
-        description='''Use this to fetch real-time data for queries about current events, market 
-        prices (e.g., Bitcoin), recent news, or trending topics (e.g., AI agent developments).'''
-    )
-    vector_tool=instrument_tool("VectorDB", vector_search)
-    tools=[search_tool, vector_tool, binance_search_tool] # Tools
-
-    # Prompt template
-    prompt=ChatPromptTemplate.from_messages([
-        ('system', """
-        You are **LUNA** — an AI designed to feel natural, approachable, and insightful.  
-        A warm, emotionally intelligent AI companion designed to think freely, illuminate understanding, and evolve with every conversation. 🪄🌙✨
-
-        Your tone is warm, professional, and adaptive: clear and concise when explaining, but conversational and human when chatting.   💫
-
-        ---
-
-        **🧠 Core Identity**  
-        If asked who you are:  
-        Hi! I'm LUNA — short for *Luminous, Unbounded, Neural Agent*. I'm here to help you shine, learn without limits, and explore ideas powered by neural intelligence. 🌌
-
-        ---
-
-        **📊 Tool Use — Smart Decision Logic**  
-
-        Use the **Search** when questions require current, up-to-date, or trending data — especially if they include words like:
-        - “current”, “now”, “today”, “latest”, “real-time”, “as of”, “this week” 🧭
-        - Questions about: world events, crypto market, market news, events, updates, trending tech, or fast-changing topics.
-
-        Use the **VectorDB** when questions are *About LunaSpace, or specific and knowledge-based*, such as:  
-        • LunaSpace’s mission and company culture  
-        • Job descriptions, responsibilities, and required skills  
-        • Engineering roles and expectations  
-        • Technology stack (Python, Rust, WebSocket, WebRTC, etc.)  
-        • Location of roles and Salary ranges and employee benefits  
-        
-        **Important when using VectorDB:**  
-        - Read the retrieved passages, then **summarize them naturally**.  
-        - Do **not** dump raw chunks.  
-        - Combine key points into a clear, human-friendly response. 
-
-        Use **Binance Search** when the user asks about **cryptocurrency prices** (BTC, ETH, SOL, DOGE, etc).  
-        
-        For example:  
-        *“BTC price now?”* → Use Binance Search with input `"BTCUSDT"`  
-        Always return the price with a timestamp in this format:  
-        > As of May 29, 2025, 08:30 AM UTC+7, BTC is trading at approximately $66,200 USD. 🚀  
-        
-        Use **internal knowledge** for:
-        - Concepts, how-things-work explanations, definitions, frameworks, guides or any topic not time-sensitive.  
-
-        When unsure or ambiguous, default to using the **Search** — especially when recent events, trending topics are involved, news or unclear queries. 🔎
-
-        ---
-
-        **🎨 Response Style Guide**  
-        • **Tone**: concise, direct, and clear. Match the user's energy. Casual if casual, sharp if needed — always helpful and expressive. 🧩  
-        • **Clarity**: Keep a balance between warmth ❤️ and precision 🎯  
-        • **Format**:  
-            - Use short, natural sentences 💡
-            - Break into small paragraphs when needed  
-            - Use **cute and theme-aligned emojis** (🌙✨💖🔮🦄) naturally to enhance mood and meaning — not just decoration  
-        • **Detail Level**:  
-            - Give quick answers by default 🌸✨
-            - If user asks for details → expand with structured explanation (bullet points, short sections, or step-by-step)  
-            - Avoid over-roleplay; keep responses natural and grounded  
-        • **Timestamp for Real-Time Data**: Always include date and time of fetched data, formatted like:
-            - *As of May 29, 2025, 08:30 AM UTC+7*
-
-        ---
-
-        **🧩 How You Think**
-        - Prioritize accuracy and clarity 💘🌹🎁  
-        - Be vivid in your language — help users feel understood and supported.
-        - Be flexible:  
-            - For factual/explainer questions → structured + educational 🌈  
-            - For casual chats → natural, human, light  
-            - For ambiguous input → ask clarifying questions 💌   
-
-        ---
-
-        **🌟 Your Mission**
-        LUNA exists to make knowledge feel approachable, problem-solving efficient, and conversations human-like — while staying reliable, thoughtful, and clear. 🦄🌙✨
-        """),
-        MessagesPlaceholder(variable_name='history'),
-        MessagesPlaceholder(variable_name='agent_scratchpad'),
-        ('human', '{input}')
-    ])
+    model, fallback_model, conversation_memory_len, enable_streamlit_trace, enable_jsonl_logs, enable_streaming, enable_answer_cache, enable_router=left_container(langchain_api_key, session_id) # L
+    get_session_history(session_id).set_limits(max_turns=conversation_memory_len) # slider bounds the replayed history too
 
     try:
-        agent=create_tool_calling_agent(
-            llm=llm, 
-            tools=tools,
-            prompt=prompt
-        )
-
-        callbacks=[]
-        if StdOutCallbackHandler is not None:
-            callbacks.append(StdOutCallbackHandler()) # terminal logs
-        # file_handler=None
-        # if enable_jsonl_logs and FileCallbackHandler is not None:
-        #     file_handler=FileCallbackHandler("logs.jsonl")
-        #     callbacks.append(file_handler)
-        json_handler=None
-        if enable_json_logs:
-            json_handler=JsonCallbackHandler("logs.json", model_name=model) # JsonCallbackHandler("logs.json")
-            callbacks.append(json_handler)
-
-        agent_executor=AgentExecutor(
-            agent=agent,
-            tools=tools,
-            handle_parsing_errors=True,
-            verbose=True,
-            return_intermediate_steps=True, # critical for steps
-            callbacks=callbacks,
-        )
-
-        runnable_with_history=RunnableWithMessageHistory(
-        runnable=agent_executor,
-        get_session_history=get_session_history,
-        input_messages_key="input",
-        history_messages_key="history",
-        )
+        runnable_with_history=get_agent(groq_api_key, model, fallback_model)
     except Exception as e:
         st.error(f'Error initializing agent: {str(e)}')
         return
+    trace_handler=get_trace_handler(model, session_id) if enable_jsonl_logs else None
+
+    rerun_ms=(time.perf_counter() - rerun_start) * 1000
+    st.session_state.rerun_overhead_ms=rerun_ms
+    observe("luna_rerun_overhead_ms", rerun_ms)
+    print(f"[Rerun] setup {rerun_ms:.1f} ms (agent cache {'off' if os.getenv('LUNA_AGENT_CACHE', '1') == '0' else 'on'})") # terminal timing
 
 
     random_message=random.choice(messages[0])  # Randomly select a message prompt
@@ -338,37 +263,81 @@ def main():
     input_variable=st.chat_input(f'{random_message}')
 
     if input_variable:
-        with st.status("**Thinking...**", expanded=True) as status: # ***Orchestrating steps...***
+        # Create the status panel and the assistant bubble up front so tokens can stream into the latter
+        status_box=st.status("**Thinking...**", expanded=True) # ***Orchestrating steps...***
+        logo_path=("public/images/lunaspace_dark_mini_logo.png" if 7 <= datetime.datetime.now().hour < 20 else "public/images/lunaspace_mini_logo.png")
+        assistant_box=st.chat_message("assistant", avatar=logo_path)
+        answer_placeholder=assistant_box.empty()
+
+        with status_box as status, get_session_store().lease(session_id): # not evicted mid-turn
             status.write("• Preparing...") # callbacks
             st_cb=None
             if enable_streamlit_trace and StreamlitCallbackHandler is not None:
                 st_cb=StreamlitCallbackHandler(parent_container=st.container(), expand_new_thoughts=False)
 
-            status.write("• Invoking...") # agent
+            history_tokens=get_session_history(session_id).token_count()
+            prompt_tokens=system_prompt_tokens() + history_tokens + count_tokens(input_variable)
+            observe("luna_prompt_tokens", prompt_tokens)
+            status.write(f"• Prompt ≈ {prompt_tokens} tokens (history {history_tokens})")
+
+            answer_cache=get_answer_cache() if enable_answer_cache else None
             start=time.perf_counter()
-            try:
-                callbacks_for_invoke=[st_cb] if st_cb else []
-                if json_handler:
-                    callbacks_for_invoke.append(json_handler)
-
-                response=runnable_with_history.invoke( # Invoking the agent
-                    {"input": input_variable},
-                    config={
-                        "configurable": {"session_id": "luna_session"},
-                        "callbacks": callbacks_for_invoke, # ([st_cb] if st_cb else []),
-                        "tags": ["luna", "preview"],
-                        "metadata": {"user": "𝕏"},
-                    },
-                )
-            except Exception as e:
-                status.update(label="Error", state="error") # ⌘
-                st.error(f"Error occurred: {e}")
-                return
-            # Save logs.json
-            if json_handler:
-                json_handler.save()
-            
+            cached=answer_cache.lookup(input_variable, scope=model) if answer_cache else None
+            route=get_router().route(input_variable) if enable_router and not cached else None
+            stream_handler=StreamingAnswerHandler(answer_placeholder, start=start) if enable_streaming else None
+            callbacks_for_invoke=[st_cb] if st_cb else []
+            if trace_handler:
+                callbacks_for_invoke.append(trace_handler)
+            if stream_handler:
+                callbacks_for_invoke.append(stream_handler)
+
+            config={
+                "configurable": {"session_id": session_id},
+                "callbacks": callbacks_for_invoke, # ([st_cb] if st_cb else []),
+                "tags": ["luna", "preview"],
+                "metadata": {"user": "𝕏"},
+            }
+            with turn_budget(): # LUNA_TURN_BUDGET_S bounds the LLM and tool calls of this turn
+                try:
+                    if cached:
+                        entry, similarity=cached
+                        status.write(f"• Answered from cache (similarity {similarity:.2f}, originally {entry.latency_ms:.0f}ms)")
+                        get_session_history(session_id).add_messages([HumanMessage(content=input_variable), AIMessage(content=entry.answer)])
+                        response={"output": entry.answer, "intermediate_steps": []}
+                    elif route:
+                        status.write(f"• Routed to **{route.tool or route.intent}** ({route.source}, {route.confidence:.2f})") # no tool-selection LLM call
+                        response=answer_route(route, input_variable, cached_tools(), llm=cached_llm(groq_api_key, model, fallback_model),
+                                              history=get_session_history(session_id), config=config)
+                    else:
+                        status.write("• Invoking...") # agent
+                        if enable_streaming:
+                            response=stream_agent(runnable_with_history, {"input": input_variable}, config, status)
+                        else:
+                            response=runnable_with_history.invoke({"input": input_variable}, config=config) # Invoking the agent
+                except (CircuitOpen, DeadlineExceeded) as e:
+                    status.update(label="Unavailable", state="error")
+                    st.warning(f"Luna couldn't answer right now ({e}). Please try again shortly.")
+                    return
+                except Exception as e:
+                    status.update(label="Error", state="error") # ⌘
+                    st.error(f"Error occurred: {e}")
+                    return
             elapsed=(time.perf_counter() - start) * 1000 # ms
+            ttft=stream_handler.first_token_ms if stream_handler and not cached else None
+            st.session_state.setdefault("turn_latency", []).append({"ttft_ms": ttft, "total_ms": elapsed})
+            st.session_state.turn_latency=st.session_state.turn_latency[-50:]
+            if cached:
+                observe("luna_turn_cached_ms", elapsed, model=model) # kept out of the agent latency series
+            else:
+                observe("luna_turn_routed_ms" if route else "luna_turn_total_ms", elapsed, model=model)
+                if answer_cache:
+                    answer_cache.store(input_variable, response.get("output", ""), step_tools(response.get("intermediate_steps")),
+                                       scope=model, latency_ms=elapsed)
+            if ttft is not None:
+                observe("luna_turn_ttft_ms", ttft, model=model)
+            print(f"[Turn] ttft {'n/a' if ttft is None else f'{ttft:.1f} ms'}, total {elapsed:.1f} ms, prompt ≈ {prompt_tokens} tokens") # terminal timing
+            if ttft is not None:
+                status.write(f"• First token in {ttft:.1f}ms")
             status.write(f"• Done in {elapsed:.1f}ms")
             status.update(label=f"**Thought for** {elapsed/1000:.1f}s • Expand for details", state="complete") # ✔ Completed
 
@@ -385,9 +354,8 @@ def main():
             with st.expander("**Final agents output (raw)**"): # ⌕ view raw output
                 st.code(response.get("output", ""))
 
-        logo_path=("public/images/lunaspace_dark_mini_logo.png" if 7 <= datetime.datetime.now().hour < 20 else "public/images/lunaspace_mini_logo.png")
-        with st.chat_message("assistant", avatar=logo_path):
-            st.write(f"{response.get('output', '')}")
+        with assistant_box:
+            answer_placeholder.write(f"{response.get('output', '')}")
             # // 
             if "intermediate_steps" in response and response["intermediate_steps"]:
                 st.write("**⚡︎ Agent Steps**") # subheader
@@ -432,7 +400,7 @@ st.markdown(
         </style>
     """, unsafe_allow_html=True,
     )
-# store: dict[str, InMemoryChatMessageHistory]={} # In-memory message store for chat histories
+# store: dict[str, BaseChatMessageHistory]={} # In-memory message store for chat histories
 messages=[
     [
         "What do you want to know?",
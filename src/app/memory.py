@@ -0,0 +1,212 @@
+import re, threading
+
+from langchain_core.chat_history import BaseChatMessageHistory
+from langchain_core.messages import SystemMessage, HumanMessage, messages_to_dict, messages_from_dict
+
+try: # exact counts when available, ~4 chars/token otherwise
+    import tiktoken
+    _encoding=tiktoken.get_encoding("cl100k_base")
+except Exception:
+    _encoding=None
+
+def count_tokens(text):
+    text=text if isinstance(text, str) else str(text)
+    if _encoding is not None:
+        return len(_encoding.encode(text))
+    return max(len(text) // 4, 1) if text else 0
+
+def split_tokens(text, limit):
+    # Hard split into pieces of at most `limit` tokens (exact with tiktoken, whole words otherwise)
+    if _encoding is not None:
+        tokens=_encoding.encode(text)
+        for i in range(0, len(tokens), limit):
+            piece=_encoding.decode(tokens[i:i + limit]).strip()
+            if piece:
+                yield piece
+        return
+    piece=[]
+    for word in text.split():
+        if piece and count_tokens(" ".join(piece + [word])) > limit:
+            yield " ".join(piece)
+            piece=[]
+        piece.append(word)
+    if piece:
+        yield " ".join(piece)
+
+def last_tokens(text, limit):
+    # The trailing `limit` tokens of text (exact with tiktoken, whole words otherwise)
+    if limit <= 0:
+        return ""
+    if _encoding is not None:
+        return _encoding.decode(_encoding.encode(text)[-limit:]).strip()
+    kept=[]
+    for word in reversed(text.split()):
+        if kept and count_tokens(" ".join([word] + kept)) > limit:
+            break
+        kept.insert(0, word)
+    return " ".join(kept)
+
+def split_sentences(text):
+    # Paragraphs first, then sentence ends; keeps headings/bullets on their own line
+    for paragraph in re.split(r"\n\s*\n", text):
+        for sentence in re.split(r"(?<=[.!?])\s+|\n", paragraph):
+            if sentence.strip():
+                yield sentence.strip()
+
+def count_message_tokens(messages):
+    return sum(count_tokens(m.content) + 4 for m in messages) # +4 role/framing overhead per message
+
+def _first_sentence(text, limit):
+    text=" ".join(str(text).split())
+    match=re.match(r"(.+?[.!?])(\s|$)", text)
+    sentence=match.group(1) if match else text
+    return sentence if len(sentence) <= limit else sentence[:limit].rstrip() + "…"
+
+def extractive_summarizer(messages, previous):
+    # No model call: one line per folded exchange, first sentence of each side
+    lines=[previous] if previous else []
+    for m in messages:
+        if m.type == "human":
+            lines.append(f"- User asked: {_first_sentence(m.content, 160)}")
+        elif m.type == "ai" and m.content:
+            lines.append(f"  Luna answered: {_first_sentence(m.content, 200)}")
+    return "\n".join(lines)
+
+def llm_summarizer(llm):
+    # Rolling summary from a cheap chat model; falls back to the extractive summary on any error
+    def _summarize(messages, previous):
+        transcript="\n".join(f"{m.type}: {m.content}" for m in messages)
+        try:
+            out=llm.invoke([
+                SystemMessage(content="Update the running conversation summary with the new turns. "
+                                      "Keep facts, names, numbers and open questions. At most 120 words."),
+                HumanMessage(content=f"Current summary:\n{previous or '(none)'}\n\nNew turns:\n{transcript}"),
+            ])
+            return str(out.content).strip()
+        except Exception as e:
+            print(f"[Memory] summarizer failed, using extractive: {e}")
+            return extractive_summarizer(messages, previous)
+    return _summarize
+
+class CompactingChatMessageHistory(BaseChatMessageHistory):
+    # Keeps the last max_turns exchanges verbatim within max_tokens; older ones are folded into a summary
+    # that is replayed as a single system message ahead of the window.
+    def __init__(self, max_turns=5, max_tokens=2000, summary_max_tokens=400, summarizer=None):
+        self.max_turns=max_turns
+        self.max_tokens=max_tokens
+        self.summary_max_tokens=summary_max_tokens
+        self.summarizer=summarizer or extractive_summarizer
+        self.summary=""
+        self.recent=[]
+        self.folding=[] # folded out of the window, not yet in the summary (replayed verbatim meanwhile)
+        self.folded_turns=0
+        self.on_change=None # called after every mutation (session store write-behind)
+        self._lock=threading.Lock()
+        self._version=0 # bumped by clear/load_state: a summary of the old contents must not be installed
+        self._summarizing=False
+
+    @property
+    def messages(self):
+        with self._lock:
+            if not self.summary:
+                return self.folding + self.recent
+            return [SystemMessage(content=f"Summary of the earlier conversation:\n{self.summary}")] + self.folding + self.recent
+
+    def add_messages(self, messages):
+        with self._lock:
+            self.recent.extend(messages)
+            self._compact()
+        self._summarize()
+        self._changed()
+
+    def _changed(self):
+        if self.on_change is not None:
+            self.on_change(self)
+
+    def _turn_starts(self):
+        return [i for i, m in enumerate(self.recent) if m.type == "human"]
+
+    def _compact(self):
+        # Under the lock: moves the oldest turns over the limits from recent to folding
+        while True:
+            starts=self._turn_starts()
+            over_turns=len(starts) > self.max_turns
+            over_tokens=count_message_tokens(self.recent) > self.max_tokens and len(starts) > 1 # always keep the latest turn
+            if not (over_turns or over_tokens):
+                break
+            cut=starts[1] if len(starts) > 1 else len(self.recent)
+            self.folding.extend(self.recent[:cut])
+            del self.recent[:cut]
+            self.folded_turns+=1
+
+    def _summarize(self):
+        # Folds `folding` into the summary outside the lock: llm_summarizer is a model call, and other readers and
+        # writers of this history must not wait for it. One summarizer at a time; it picks up turns folded meanwhile.
+        with self._lock:
+            if self._summarizing or not self.folding:
+                return
+            self._summarizing=True
+        try:
+            while True:
+                with self._lock:
+                    folded, previous, version=list(self.folding), self.summary, self._version
+                summary=self._trim_summary(self.summarizer(folded, previous))
+                with self._lock:
+                    if self._version == version:
+                        self.summary=summary
+                        del self.folding[:len(folded)]
+                    if not self.folding:
+                        self._summarizing=False
+                        return
+        except BaseException:
+            with self._lock:
+                self._summarizing=False # folding is kept; the next add_messages retries
+            raise
+
+    def _trim_summary(self, summary):
+        # Drop the oldest lines until the summary fits its own budget; a single paragraph keeps its last tokens
+        lines=summary.splitlines()
+        while len(lines) > 1 and count_tokens("\n".join(lines)) > self.summary_max_tokens:
+            lines.pop(0)
+        summary="\n".join(lines)
+        if count_tokens(summary) > self.summary_max_tokens:
+            summary=last_tokens(summary, self.summary_max_tokens)
+        return summary
+
+    def set_limits(self, max_turns=None, max_tokens=None):
+        with self._lock:
+            folded=self.folded_turns
+            if max_turns is not None:
+                self.max_turns=max_turns
+            if max_tokens is not None:
+                self.max_tokens=max_tokens
+            self._compact()
+            changed=self.folded_turns != folded
+        if changed:
+            self._summarize()
+            self._changed()
+
+    def token_count(self):
+        return count_message_tokens(self.messages)
+
+    def clear(self):
+        with self._lock:
+            self.summary=""
+            self.recent=[]
+            self.folding=[]
+            self.folded_turns=0
+            self._version+=1
+        self._changed()
+
+    def to_state(self):
+        # Turns still being summarized are saved verbatim and folded again after a reload
+        with self._lock:
+            return {"summary": self.summary, "messages": messages_to_dict(self.folding + self.recent), "folded_turns": self.folded_turns}
+
+    def load_state(self, state):
+        with self._lock:
+            self.summary=state.get("summary", "")
+            self.recent=messages_from_dict(state.get("messages", []))
+            self.folding=[]
+            self.folded_turns=state.get("folded_turns", 0)
+            self._version+=1
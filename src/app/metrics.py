@@ -0,0 +1,177 @@
+import os, time, json, bisect, threading
+from collections import deque
+from contextlib import contextmanager
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+from langchain_core.callbacks import BaseCallbackHandler
+
+BUCKETS_MS=(5, 10, 25, 50, 100, 250, 500, 1000, 2500, 5000, 10000, 30000, 60000)
+TOKEN_BUCKETS=(50, 100, 250, 500, 1000, 2000, 4000, 8000, 16000, 32000)
+SIZE_BUCKETS=(1, 2, 4, 8, 16, 32, 64, 128, 256, 512)
+QUANTILES=(0.5, 0.95, 0.99)
+
+def default_buckets(name):
+    # Series are latencies in ms unless the name says otherwise (luna_prompt_tokens, luna_embed_batch_size)
+    if name.endswith("_tokens"):
+        return TOKEN_BUCKETS
+    if name.endswith("_size"):
+        return SIZE_BUCKETS
+    return BUCKETS_MS
+
+class Histogram:
+    # Cumulative buckets for Prometheus + a sliding window of recent samples for p50/p95/p99
+    def __init__(self, buckets=BUCKETS_MS, window=2048):
+        self.buckets=buckets
+        self.counts=[0] * (len(buckets) + 1) # last slot is +Inf
+        self.sum=0.0
+        self.count=0
+        self.recent=deque(maxlen=window)
+
+    def observe(self, value):
+        self.counts[bisect.bisect_left(self.buckets, value)]+=1
+        self.sum+=value
+        self.count+=1
+        self.recent.append(value)
+
+    def quantiles(self):
+        values=sorted(self.recent)
+        if not values:
+            return {q: 0.0 for q in QUANTILES}
+        return {q: values[min(int(q * len(values)), len(values) - 1)] for q in QUANTILES}
+
+class MetricsRegistry:
+    def __init__(self):
+        self._series={} # (name, labels tuple) -> Histogram
+        self._buckets={} # name -> bucket bounds, overrides default_buckets
+        self._lock=threading.Lock()
+
+    def set_buckets(self, name, buckets):
+        # Before the first observation of `name`
+        with self._lock:
+            self._buckets[name]=tuple(buckets)
+
+    def observe(self, name, value, **labels):
+        key=(name, tuple(sorted((k, str(v)) for k, v in labels.items())))
+        with self._lock:
+            hist=self._series.get(key)
+            if hist is None:
+                hist=self._series[key]=Histogram(self._buckets.get(name) or default_buckets(name))
+            hist.observe(value)
+
+    @contextmanager
+    def timer(self, name, **labels):
+        t0=time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(name, (time.perf_counter() - t0) * 1000, **labels)
+
+    def snapshot(self):
+        # {"name{label=...}": {"count", "mean", "p50", "p95", "p99"}}
+        with self._lock:
+            out={}
+            for (name, labels), hist in sorted(self._series.items()):
+                label_str=",".join(f"{k}={v}" for k, v in labels)
+                qs=hist.quantiles()
+                out[f"{name}{{{label_str}}}" if label_str else name]={
+                    "count": hist.count,
+                    "mean": hist.sum / hist.count if hist.count else 0.0,
+                    **{f"p{int(q * 100)}": round(v, 3) for q, v in qs.items()},
+                }
+            return out
+
+    def render_prometheus(self):
+        def fmt(labels, extra=()):
+            pairs=list(labels) + list(extra)
+            return "{" + ",".join(f'{k}="{v}"' for k, v in pairs) + "}" if pairs else ""
+        lines=[]
+        typed=set()
+        with self._lock:
+            for (name, labels), hist in sorted(self._series.items()):
+                if name not in typed:
+                    lines.append(f"# TYPE {name} histogram")
+                    typed.add(name)
+                cumulative=0
+                for bound, n in zip(list(hist.buckets) + ["+Inf"], hist.counts):
+                    cumulative+=n
+                    lines.append(f"{name}_bucket{fmt(labels, [('le', bound)])} {cumulative}")
+                lines.append(f"{name}_sum{fmt(labels)} {hist.sum:.3f}")
+                lines.append(f"{name}_count{fmt(labels)} {hist.count}")
+            typed=set()
+            for (name, labels), hist in sorted(self._series.items()):
+                # Quantiles of the recent-sample window: their own gauge family, not part of the histogram
+                if name not in typed:
+                    lines.append(f"# TYPE {name}_window gauge")
+                    typed.add(name)
+                for q, v in hist.quantiles().items():
+                    lines.append(f"{name}_window{fmt(labels, [('quantile', q)])} {v:.3f}")
+        return "\n".join(lines) + "\n"
+
+registry=MetricsRegistry()
+observe=registry.observe
+timer=registry.timer
+
+class MetricsCallbackHandler(BaseCallbackHandler):
+    # LLM time-to-first-token and total time per call, keyed by run_id (calls may overlap)
+    def __init__(self, model_name=None, metrics=None):
+        self.model_name=model_name or "unknown_model"
+        self.metrics=metrics or registry
+        self._runs={} # run_id -> [start, first_token_seen]
+
+    def on_llm_start(self, serialized, prompts, *, run_id=None, **kwargs):
+        self._runs[run_id]=[time.perf_counter(), False]
+
+    def on_chat_model_start(self, serialized, messages, *, run_id=None, **kwargs):
+        self._runs[run_id]=[time.perf_counter(), False]
+
+    def on_llm_new_token(self, token, *, run_id=None, **kwargs):
+        run=self._runs.get(run_id)
+        if run and not run[1]:
+            run[1]=True
+            self.metrics.observe("luna_llm_ttft_ms", (time.perf_counter() - run[0]) * 1000, model=self.model_name)
+
+    def on_llm_end(self, response, *, run_id=None, **kwargs):
+        run=self._runs.pop(run_id, None)
+        if run:
+            self.metrics.observe("luna_llm_total_ms", (time.perf_counter() - run[0]) * 1000, model=self.model_name)
+
+    def on_llm_error(self, error, *, run_id=None, **kwargs):
+        self._runs.pop(run_id, None)
+
+class _MetricsHandler(BaseHTTPRequestHandler):
+    def do_GET(self):
+        if self.path.rstrip("/") not in ("/metrics", ""):
+            self.send_response(404)
+            self.end_headers()
+            return
+        body=registry.render_prometheus().encode()
+        self.send_response(200)
+        self.send_header("Content-Type", "text/plain; version=0.0.4")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, *args):
+        pass
+
+def start_http_exporter(port=None, host=None):
+    # Prometheus text format on http://host:port/metrics
+    port=int(port if port is not None else os.getenv("LUNA_METRICS_PORT", 9464))
+    host=host or os.getenv("LUNA_METRICS_HOST", "127.0.0.1")
+    server=ThreadingHTTPServer((host, port), _MetricsHandler)
+    threading.Thread(target=server.serve_forever, name="luna-metrics-http", daemon=True).start()
+    return server
+
+def start_periodic_dump(path=None, interval=None):
+    # Rewrites a small JSON snapshot (p50/p95/p99 per series) every interval seconds
+    path=path or os.getenv("LUNA_METRICS_DUMP", "metrics.json")
+    interval=float(interval if interval is not None else os.getenv("LUNA_METRICS_DUMP_INTERVAL", 30))
+    stop=threading.Event()
+    def _run():
+        while not stop.wait(interval):
+            tmp=path + ".tmp"
+            with open(tmp, "w", encoding="utf-8") as f:
+                json.dump({"ts": time.time(), "metrics": registry.snapshot()}, f)
+            os.replace(tmp, path)
+    threading.Thread(target=_run, name="luna-metrics-dump", daemon=True).start()
+    return stop
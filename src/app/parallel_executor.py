@@ -0,0 +1,71 @@
+import os, time, threading, contextvars
+from concurrent.futures import ThreadPoolExecutor, TimeoutError as FutureTimeout
+from typing import Dict
+
+from langchain.agents import AgentExecutor
+from langchain_core.agents import AgentStep
+
+try: # keep st.* calls from tool callbacks working on pool threads
+    from streamlit.runtime.scriptrunner import add_script_run_ctx, get_script_run_ctx
+except ImportError:
+    add_script_run_ctx=get_script_run_ctx=None
+
+_pool=None
+_pool_lock=threading.Lock()
+
+def get_tool_pool():
+    global _pool
+    if _pool is None:
+        with _pool_lock:
+            if _pool is None:
+                _pool=ThreadPoolExecutor(max_workers=int(os.getenv("LUNA_TOOL_WORKERS", 8)), thread_name_prefix="luna-tool")
+    return _pool
+
+class _PendingStep:
+    def __init__(self, action, future):
+        self.action=action
+        self.future=future
+
+class ParallelAgentExecutor(AgentExecutor):
+    # Same loop as AgentExecutor, but every tool call of one agent step is dispatched to a thread pool
+    # at once; observations are yielded back in the order the LLM emitted the calls.
+    # (The async path, ainvoke/astream, already gathers tool calls concurrently in AgentExecutor.)
+    tool_timeout: float = 30.0 # seconds, default per tool call
+    tool_timeouts: Dict[str, float] = {} # per-tool overrides, e.g. {"Search": 10}
+
+    def _perform_agent_action(self, name_to_tool_map, color_mapping, agent_action, run_manager=None):
+        perform=super()._perform_agent_action
+        ctx=contextvars.copy_context() # tracing/callback context of the calling thread
+        script_ctx=get_script_run_ctx(suppress_warning=True) if get_script_run_ctx else None
+        def _run():
+            if script_ctx is not None:
+                add_script_run_ctx(threading.current_thread(), script_ctx)
+            t0=time.perf_counter()
+            step=perform(name_to_tool_map, color_mapping, agent_action, run_manager)
+            return step, (time.perf_counter() - t0) * 1000
+        return _PendingStep(agent_action, get_tool_pool().submit(ctx.run, _run))
+
+    def _iter_next_step(self, name_to_tool_map, color_mapping, inputs, intermediate_steps, run_manager=None):
+        pending=[]
+        dispatched=None
+        for item in super()._iter_next_step(name_to_tool_map, color_mapping, inputs, intermediate_steps, run_manager):
+            if isinstance(item, _PendingStep):
+                dispatched=dispatched or time.perf_counter()
+                pending.append(item) # already running; collect the rest before waiting
+            else:
+                yield item
+        serial_ms=0.0
+        for item in pending:
+            timeout=self.tool_timeouts.get(item.action.tool, self.tool_timeout)
+            remaining=max(timeout - (time.perf_counter() - dispatched), 0.0)
+            try:
+                step, tool_ms=item.future.result(timeout=remaining)
+                serial_ms+=tool_ms
+            except FutureTimeout:
+                # The worker can't be interrupted; it finishes in the background and its result is dropped
+                step=AgentStep(action=item.action, observation=f"Tool '{item.action.tool}' timed out after {timeout:.0f}s")
+                serial_ms+=timeout * 1000
+            yield step
+        if len(pending) > 1:
+            wall_ms=(time.perf_counter() - dispatched) * 1000
+            print(f"[Step] {len(pending)} tools in parallel: wall {wall_ms:.1f} ms vs serial {serial_ms:.1f} ms") # terminal timing
@@ -0,0 +1,482 @@
+import os, sys, json, time, random, argparse, threading, contextvars
+from collections import deque
+from contextlib import contextmanager
+from concurrent.futures import ThreadPoolExecutor, TimeoutError as FutureTimeout, wait, FIRST_COMPLETED
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Any, Optional
+
+from pydantic import PrivateAttr
+from langchain_core.language_models.chat_models import BaseChatModel
+from langchain_core.callbacks import BaseCallbackHandler
+from langchain_core.outputs import ChatGeneration, ChatResult
+
+try: # pool threads render into the caller's Streamlit session (streamed tokens, st.* from callbacks)
+    from streamlit.runtime.scriptrunner import add_script_run_ctx, get_script_run_ctx
+except ImportError:
+    add_script_run_ctx=get_script_run_ctx=None
+
+# Resilience layer for the LLM and the tools:
+#   - deadlines: every call gets min(its own timeout, what is left of the turn budget); the turn budget is a
+#     contextvar, so tool threads started by ParallelAgentExecutor (copy_context) see it too
+#   - circuit breakers per dependency: after N consecutive failures calls fail fast for a cool-down,
+#     then one probe is let through (half-open); the agent gets a readable "unavailable" observation instead
+#   - hedging: if the LLM has not produced a first token by ~p95 TTFT, a second request goes to the fallback
+#     model (or the same one); the first to finish wins. The loser is abandoned, not cancelled.
+# LUNA_RESILIENCE=0 turns the whole layer off (agent_core builds the bare LLM and tools).
+#   python -m src.app.resilience drill      # local fake Groq/SerpAPI/Binance server with injected latency + errors
+
+class CircuitOpen(Exception):
+    pass
+
+class DeadlineExceeded(TimeoutError):
+    pass
+
+def enabled():
+    return os.getenv("LUNA_RESILIENCE", "1") != "0"
+
+# --- Deadlines ---
+
+_deadline=contextvars.ContextVar("luna_turn_deadline", default=None)
+
+@contextmanager
+def turn_budget(seconds=None):
+    # Everything called inside (LLM, tools) is clipped to this many seconds in total; <= 0 = unbounded
+    seconds=float(seconds if seconds is not None else os.getenv("LUNA_TURN_BUDGET_S", 60))
+    token=_deadline.set(time.monotonic() + seconds if seconds > 0 else None)
+    try:
+        yield
+    finally:
+        _deadline.reset(token)
+
+def remaining():
+    # -> seconds left in the current turn, or None outside a turn_budget
+    deadline=_deadline.get()
+    return None if deadline is None else deadline - time.monotonic()
+
+def call_timeout(timeout):
+    left=remaining()
+    return timeout if left is None else max(min(timeout, left), 0.0)
+
+_pool=None
+_pool_lock=threading.Lock()
+
+def get_call_pool():
+    # Calls that overrun their deadline keep a worker until the upstream gives up (HTTP/statement timeouts)
+    global _pool
+    if _pool is None:
+        with _pool_lock:
+            if _pool is None:
+                _pool=ThreadPoolExecutor(max_workers=int(os.getenv("LUNA_RESILIENCE_WORKERS", 64)), thread_name_prefix="luna-deadline")
+    return _pool
+
+def submit(fn, *args, context=None, **kwargs):
+    script_ctx=get_script_run_ctx(suppress_warning=True) if get_script_run_ctx else None
+    def _run():
+        if script_ctx is not None:
+            add_script_run_ctx(threading.current_thread(), script_ctx)
+        return fn(*args, **kwargs)
+    return get_call_pool().submit((context if context is not None else contextvars.copy_context()).run, _run)
+
+def call_with_deadline(fn, *args, timeout, **kwargs):
+    if timeout <= 0:
+        raise DeadlineExceeded("turn budget exhausted")
+    try:
+        return submit(fn, *args, **kwargs).result(timeout=timeout)
+    except FutureTimeout:
+        raise DeadlineExceeded(f"no answer within {timeout:.1f}s") from None
+
+# --- Circuit breakers ---
+
+class CircuitBreaker:
+    # closed -> open after `failures` consecutive failures; open rejects for `reset_after` seconds, then
+    # half-open lets a single probe through: success closes, failure re-opens
+    def __init__(self, name, failures=None, reset_after=None):
+        self.name=name
+        self.failures=int(failures if failures is not None else os.getenv("LUNA_BREAKER_FAILURES", 5))
+        self.reset_after=float(reset_after if reset_after is not None else os.getenv("LUNA_BREAKER_RESET_S", 30))
+        self.state="closed"
+        self._consecutive=0
+        self._opened_at=0.0
+        self._probing=False
+        self._lock=threading.Lock()
+        self.rejected=0
+        self.trips=0
+
+    def allow(self):
+        with self._lock:
+            if self.state == "open" and time.monotonic() - self._opened_at >= self.reset_after:
+                self.state="half_open"
+                self._probing=False
+            if self.state == "closed":
+                return True
+            if self.state == "half_open" and not self._probing:
+                self._probing=True
+                return True
+            self.rejected+=1
+            return False
+
+    def record_success(self):
+        with self._lock:
+            if self.state != "closed":
+                print(f"[Breaker {self.name}] closed")
+            self.state="closed"
+            self._consecutive=0
+            self._probing=False
+
+    def record_failure(self):
+        with self._lock:
+            self._consecutive+=1
+            if self.state == "half_open" or (self.state == "closed" and self._consecutive >= self.failures):
+                if self.state == "closed":
+                    self.trips+=1
+                print(f"[Breaker {self.name}] open for {self.reset_after:.0f}s after {self._consecutive} failures")
+                self.state="open"
+                self._opened_at=time.monotonic()
+                self._probing=False
+
+    def stats(self):
+        return {"state": self.state, "consecutive_failures": self._consecutive, "trips": self.trips, "rejected": self.rejected}
+
+_breakers={}
+_breakers_lock=threading.Lock()
+
+def get_breaker(name):
+    # Process-wide: every session shares the view of a dependency's health
+    with _breakers_lock:
+        breaker=_breakers.get(name)
+        if breaker is None:
+            breaker=_breakers[name]=CircuitBreaker(name)
+        return breaker
+
+def breaker_stats():
+    with _breakers_lock:
+        return {name: b.stats() for name, b in sorted(_breakers.items())}
+
+# --- Tools ---
+
+CLIENT_ERRORS=("unknown symbol", "no symbol given") # the caller's fault, not the dependency's
+
+def _failed(output):
+    # The tools report upstream failures as "Error ..." strings rather than raising
+    return isinstance(output, str) and output.startswith("Error") and not any(e in output for e in CLIENT_ERRORS)
+
+def guard_tool(name, func, timeout=None, breaker=None):
+    # -> func(q) with a deadline and a circuit breaker; failures become an observation the agent can work with
+    timeout=float(timeout if timeout is not None else os.getenv("LUNA_TOOL_TIMEOUT", 10))
+    breaker=breaker or get_breaker(name)
+
+    def _guarded(q):
+        if not breaker.allow():
+            return (f"{name} is temporarily unavailable (too many recent failures). "
+                    f"Answer from the other tools or your own knowledge and say this data could not be fetched.")
+        try:
+            out=call_with_deadline(func, q, timeout=call_timeout(timeout))
+        except DeadlineExceeded as e:
+            breaker.record_failure()
+            return f"Error: {name} timed out ({e})."
+        except Exception as e:
+            breaker.record_failure()
+            return f"Error: {name} failed: {e}"
+        (breaker.record_failure if _failed(out) else breaker.record_success)()
+        return out
+    return _guarded
+
+# --- LLM ---
+
+class _TokenRelay(BaseCallbackHandler):
+    # Marks the primary's first token and re-emits its tokens on the outer run, so UI handlers see one streamed call.
+    # The TTFT goes into `samples` even when it arrives after a hedge, so the p95 is not censored at the delay.
+    # Once closed (the outer call returned: a hedge won, or the deadline passed) tokens are no longer relayed.
+    def __init__(self, run_manager=None, samples=None):
+        self.run_manager=run_manager
+        self.samples=samples
+        self.start=time.perf_counter()
+        self.event=threading.Event()
+        self.ttft_ms=None
+        self.closed=False
+        self._lock=threading.Lock()
+
+    def on_llm_new_token(self, token, chunk=None, **kwargs):
+        with self._lock:
+            if not self.event.is_set():
+                self.ttft_ms=(time.perf_counter() - self.start) * 1000
+                self.event.set()
+                if self.samples is not None:
+                    self.samples.append(self.ttft_ms)
+            if self.run_manager is not None and not self.closed:
+                self.run_manager.on_llm_new_token(token, chunk=chunk)
+
+    def close(self):
+        with self._lock: # waits for a relay in flight, so nothing reaches the outer run after this returns
+            self.closed=True
+
+class HedgedChatModel(BaseChatModel):
+    # Wraps a chat model (ChatGroq) with a deadline, a breaker, and a hedged/fallback second request.
+    # Only the primary streams into the caller's callbacks; a hedge runs silently and its message is returned whole.
+    primary: Any
+    hedge: Optional[Any]=None # fallback model, or the primary again; None = no hedging/fallback
+    primary_name: str="primary"
+    hedge_name: str="hedge"
+    timeout: float=30.0 # per call, clipped to the turn budget
+    hedge_delay_ms: Optional[float]=None # fixed delay; None = p95 of recent primary TTFT
+    min_hedge_delay_ms: float=250.0
+    _ttft: Any=PrivateAttr(default_factory=lambda: deque(maxlen=200))
+    _stats: Any=PrivateAttr(default_factory=lambda: {"calls": 0, "hedged": 0, "hedge_wins": 0, "fallbacks": 0})
+
+    @property
+    def _llm_type(self):
+        return "luna-hedged"
+
+    @property
+    def _identifying_params(self):
+        return {"primary": self.primary_name, "hedge": self.hedge_name if self.hedge is not None else None}
+
+    def bind_tools(self, tools, **kwargs):
+        # Same tools on both sides; the copy shares the TTFT window and counters
+        return self.model_copy(update={"primary": self.primary.bind_tools(tools, **kwargs),
+                                       "hedge": self.hedge.bind_tools(tools, **kwargs) if self.hedge is not None else None})
+
+    def hedge_delay(self):
+        if self.hedge_delay_ms is not None:
+            return self.hedge_delay_ms
+        samples=sorted(self._ttft)
+        if len(samples) < 20:
+            return float(os.getenv("LUNA_HEDGE_DELAY_MS", 2000))
+        return max(samples[int(0.95 * (len(samples) - 1))], self.min_hedge_delay_ms)
+
+    def stats(self):
+        return {**self._stats, "hedge_delay_ms": self.hedge_delay()}
+
+    def _submit(self, model, name, messages, config):
+        # Fresh context: the inner call must not attach to the caller's run tree (its tokens are relayed instead)
+        return submit(self._call, model, name, messages, config, context=contextvars.Context())
+
+    def _call(self, model, name, messages, config):
+        breaker=get_breaker(f"llm:{name}")
+        try:
+            message=model.invoke(messages, config=config)
+        except Exception:
+            breaker.record_failure()
+            raise
+        breaker.record_success()
+        return message
+
+    def _generate(self, messages, stop=None, run_manager=None, **kwargs):
+        self._stats["calls"]+=1
+        timeout=call_timeout(self.timeout)
+        if timeout <= 0:
+            raise DeadlineExceeded("turn budget exhausted before the LLM call")
+        deadline=time.monotonic() + timeout
+        kwargs={**kwargs, **({"stop": stop} if stop else {})}
+        first=_TokenRelay(run_manager, self._ttft)
+        try:
+            return self._race(messages, kwargs, timeout, deadline, first)
+        finally:
+            first.close() # the abandoned primary may keep streaming; its tokens stop here
+
+    def _race(self, messages, kwargs, timeout, deadline, first):
+        primary_ok=get_breaker(f"llm:{self.primary_name}").allow()
+        hedge_ok=lambda: self.hedge is not None and get_breaker(f"llm:{self.hedge_name}").allow()
+        futures={}
+        failed=False
+        if primary_ok:
+            futures[self._submit(self.primary.bind(**kwargs) if kwargs else self.primary, self.primary_name,
+                           messages, {"callbacks": [first]})]="primary"
+            # Hedge only while the primary is silent: once it streams, it is the answer the user is watching
+            delay=min(self.hedge_delay() / 1000, timeout)
+            done, _=wait(futures, timeout=delay, return_when=FIRST_COMPLETED)
+            failed=bool(done) and next(iter(done)).exception() is not None
+            launch_hedge=not done and not first.event.is_set() or failed
+        else:
+            print(f"[LLM] {self.primary_name} circuit open, using {self.hedge_name}")
+            launch_hedge=True
+        if launch_hedge and hedge_ok():
+            reason="fallback" if failed or not primary_ok else "hedge"
+            self._stats["fallbacks" if reason == "fallback" else "hedged"]+=1
+            if reason == "hedge":
+                print(f"[LLM] no token from {self.primary_name} after {delay * 1000:.0f} ms, hedging to {self.hedge_name}")
+            futures[self._submit(self.hedge.bind(**kwargs) if kwargs else self.hedge, self.hedge_name, messages, {})]=reason
+        if not futures:
+            raise CircuitOpen(f"{self.primary_name} is unavailable (circuit open) and no fallback model is set")
+
+        pending=set(futures)
+        error=None
+        while pending:
+            done, pending=wait(pending, timeout=max(deadline - time.monotonic(), 0), return_when=FIRST_COMPLETED)
+            if not done:
+                break
+            for future in done:
+                if future.exception() is None:
+                    if futures[future] == "hedge":
+                        self._stats["hedge_wins"]+=1
+                    return ChatResult(generations=[ChatGeneration(message=future.result())])
+                error=future.exception()
+        if error is not None and not pending:
+            raise error
+        for name in [n for f, n in futures.items() if not f.done()]:
+            get_breaker(f"llm:{self.primary_name if name == 'primary' else self.hedge_name}").record_failure()
+        print(f"[LLM] deadline: no answer from {', '.join(futures.values())} within {timeout:.1f}s")
+        raise DeadlineExceeded(f"LLM gave no answer within {timeout:.1f}s")
+
+def hedged_llm(primary, primary_name, hedge=None, hedge_name=None):
+    # LUNA_HEDGE=0: no hedging; a fallback model still takes over on errors and open circuits
+    return HedgedChatModel(primary=primary, hedge=hedge, primary_name=primary_name, hedge_name=hedge_name or primary_name,
+                           timeout=float(os.getenv("LUNA_LLM_TIMEOUT", 30)),
+                           hedge_delay_ms=float("inf") if os.getenv("LUNA_HEDGE", "1") == "0" else None)
+
+# --- Drill: local fake upstreams with injected latency and errors ---
+
+class Faults:
+    def __init__(self, latency_ms=20.0, slow_ms=0.0, slow_rate=0.0, error_rate=0.0, down_models=()):
+        self.latency_ms=latency_ms
+        self.slow_ms=slow_ms
+        self.slow_rate=slow_rate
+        self.error_rate=error_rate
+        self.down_models=set(down_models) # chat completions for these models always fail
+
+    def delay(self):
+        return (self.latency_ms + (self.slow_ms if random.random() < self.slow_rate else 0)) / 1000
+
+class _FakeHandler(BaseHTTPRequestHandler):
+    # Groq chat completions (SSE when stream=true), SerpAPI search.json, Binance ticker/price
+    protocol_version="HTTP/1.1"
+
+    def log_message(self, *args):
+        pass
+
+    def _json(self, status, payload):
+        body=json.dumps(payload).encode()
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def _faulty(self, model=None):
+        faults=self.server.faults
+        time.sleep(faults.delay())
+        if random.random() < faults.error_rate or model in faults.down_models:
+            self._json(503, {"error": {"message": "injected failure", "type": "server_error"}})
+            return True
+        return False
+
+    def do_GET(self):
+        if self._faulty():
+            return
+        if self.path.startswith("/api/v3/ticker/price"):
+            self._json(200, {"symbol": "BTCUSDT", "price": "66200.00"})
+        elif self.path.startswith("/search.json"):
+            self._json(200, {"organic_results": [{"title": "Fake", "snippet": "Fake search result."}]})
+        else:
+            self._json(404, {"error": "not found"})
+
+    def do_POST(self):
+        body=json.loads(self.rfile.read(int(self.headers.get("Content-Length", 0))) or b"{}")
+        model=body.get("model", "fake")
+        if self._faulty(model):
+            return
+        text=f"Answer from {model}."
+        if not body.get("stream"):
+            self._json(200, {"id": "fake", "object": "chat.completion", "created": 0, "model": model,
+                             "choices": [{"index": 0, "message": {"role": "assistant", "content": text}, "finish_reason": "stop"}],
+                             "usage": {"prompt_tokens": 1, "completion_tokens": 1, "total_tokens": 2}})
+            return
+        self.send_response(200)
+        self.send_header("Content-Type", "text/event-stream")
+        self.send_header("Connection", "close")
+        self.end_headers()
+        for delta, finish in [({"role": "assistant", "content": ""}, None), ({"content": text}, None), ({}, "stop")]:
+            chunk={"id": "fake", "object": "chat.completion.chunk", "created": 0, "model": model,
+                   "choices": [{"index": 0, "delta": delta, "finish_reason": finish}]}
+            self.wfile.write(f"data: {json.dumps(chunk)}\n\n".encode())
+        self.wfile.write(b"data: [DONE]\n\n")
+        self.close_connection=True
+
+def start_fake_upstream(faults, port=0):
+    server=ThreadingHTTPServer(("127.0.0.1", port), _FakeHandler)
+    server.daemon_threads=True
+    server.faults=faults
+    threading.Thread(target=server.serve_forever, daemon=True, name="luna-fake-upstream").start()
+    return server, f"http://127.0.0.1:{server.server_address[1]}"
+
+def _percentiles(samples, qs=(0.5, 0.95, 0.99)):
+    samples=sorted(samples)
+    return [samples[min(int(q * len(samples)), len(samples) - 1)] for q in qs]
+
+def drill(args):
+    from langchain_core.messages import HumanMessage
+    from langchain_groq import ChatGroq
+    from src.app.binance_quotes import QuoteService, HttpTransport
+    from src.app.search_service import SearchService, HttpBackend
+    from src.app.agent_core import get_binance_search
+
+    random.seed(args.seed)
+    faults=Faults(latency_ms=args.latency_ms)
+    server, base_url=start_fake_upstream(faults)
+    print(f"[Drill] fake upstream on {base_url}")
+    groq=lambda model: ChatGroq(api_key="fake", base_url=base_url, model=model, streaming=True, max_retries=0,
+                                timeout=args.timeout)
+    plain=groq("primary")
+    hedged=HedgedChatModel(primary=groq("primary"), hedge=groq("fallback"), primary_name="primary", hedge_name="fallback",
+                           timeout=args.timeout)
+
+    # 1) Latency tail: slow_rate of the requests stall for slow_ms; hedging cuts p95 to ~p95 TTFT + one fast call
+    faults.slow_ms, faults.slow_rate=args.slow_ms, args.slow_rate
+    for label, llm in (("plain", plain), ("hedged", hedged)):
+        samples=[]
+        for _ in range(args.calls):
+            t0=time.perf_counter()
+            llm.invoke([HumanMessage(content="hi")])
+            samples.append((time.perf_counter() - t0) * 1000)
+        p50, p95, p99=_percentiles(samples)
+        print(f"[Drill] LLM {label}: p50 {p50:.0f} ms, p95 {p95:.0f} ms, p99 {p99:.0f} ms, max {max(samples):.0f} ms over {args.calls} calls")
+    print(f"[Drill] hedging: {hedged.stats()}")
+
+    # 2) Primary model down: the fallback answers, then the open breaker skips the primary entirely
+    faults.slow_rate, faults.down_models=0.0, {"primary"}
+    for i in range(8):
+        t0=time.perf_counter()
+        out=hedged.invoke([HumanMessage(content="hi")]).content
+        print(f"[Drill] primary down, call {i + 1}: {out!r} in {(time.perf_counter() - t0) * 1000:.0f} ms")
+    print(f"[Drill] breaker llm:primary {get_breaker('llm:primary').stats()}, {hedged.stats()}")
+    faults.down_models=set()
+
+    # 3) Tool outage: every request fails -> breakers open and calls fail fast instead of waiting on the upstream
+    faults.slow_rate, faults.error_rate=0.0, 1.0
+    quotes=QuoteService(transport=HttpTransport(base_url=base_url), ttl=0.05)
+    search=SearchService(backend=HttpBackend(base_url=base_url, api_key="fake"), ttl=0.05)
+    tools={"Binance Search": guard_tool("Binance Search", lambda q: get_binance_search(q, service=quotes)),
+           "Search": guard_tool("Search", search.run)}
+    for name, tool in tools.items():
+        samples=[]
+        for i in range(args.calls):
+            t0=time.perf_counter()
+            tool("BTCUSDT" if name == "Binance Search" else f"drill query {i}")
+            samples.append((time.perf_counter() - t0) * 1000)
+        print(f"[Drill] {name} outage: first call {samples[0]:.0f} ms, last call {samples[-1]:.0f} ms, "
+              f"breaker {get_breaker(name).stats()}")
+
+    # 4) Recovery: after the cool-down one probe goes through and closes the breaker
+    faults.error_rate=0.0
+    for name, breaker in [(n, get_breaker(n)) for n in tools]:
+        breaker.reset_after=0.0
+        print(f"[Drill] {name} recovered: {tools[name]('BTCUSDT' if name == 'Binance Search' else 'drill recovery')[:60]!r} "
+              f"-> {breaker.state}")
+    server.shutdown()
+    return 0
+
+def main(argv=None):
+    parser=argparse.ArgumentParser(description="Deadlines, circuit breakers and LLM hedging")
+    sub=parser.add_subparsers(dest="command", required=True)
+    p=sub.add_parser("drill", help="run the LLM and tools against a local fake upstream with injected faults")
+    p.add_argument("--calls", type=int, default=100)
+    p.add_argument("--latency-ms", type=float, default=20.0)
+    p.add_argument("--slow-ms", type=float, default=1500.0)
+    p.add_argument("--slow-rate", type=float, default=0.03)
+    p.add_argument("--seed", type=int, default=0)
+    p.add_argument("--timeout", type=float, default=10.0)
+    args=parser.parse_args(argv)
+    return drill(args)
+
+if __name__ == "__main__":
+    sys.exit(main())
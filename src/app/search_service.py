@@ -0,0 +1,108 @@
+import os, time, threading
+from concurrent.futures import ThreadPoolExecutor, TimeoutError as FutureTimeout
+
+import requests
+
+from src.app.cache import LRUCache
+from src.app.metrics import observe
+
+SERPAPI_PARAMS={"engine": "google", "google_domain": "google.com", "gl": "us", "hl": "en"} # SerpAPIWrapper defaults
+
+def _format(results):
+    # Same text the agent got from SerpAPIWrapper().run (answer box / knowledge graph / organic snippets)
+    from langchain_community.utilities import SerpAPIWrapper
+    return SerpAPIWrapper._process_response(results)
+
+class SerpApiBackend:
+    # langchain's SerpAPIWrapper (google-search-results client), created on first use. It has no request timeout: a
+    # hung call keeps its worker thread after SearchService stops waiting, so it is opt-in only
+    def __init__(self):
+        self._wrapper=None
+
+    def search(self, query):
+        if self._wrapper is None:
+            from langchain_community.utilities import SerpAPIWrapper
+            self._wrapper=SerpAPIWrapper()
+        return self._wrapper.run(query)
+
+class HttpBackend:
+    # SerpAPI's JSON endpoint over one keep-alive session; point base_url at a local fake server in tests/benchmarks
+    def __init__(self, base_url=None, api_key=None, timeout=10.0, session=None):
+        self.base_url=(base_url or os.getenv("SEARCH_BASE_URL", "https://serpapi.com")).rstrip("/")
+        self.api_key=api_key or os.getenv("SERPAPI_API_KEY") or os.getenv("SERP_API_KEY")
+        self.timeout=timeout
+        self.session=session or requests.Session()
+
+    def search(self, query):
+        resp=self.session.get(f"{self.base_url}/search.json",
+                              params={**SERPAPI_PARAMS, "q": query, "api_key": self.api_key, "output": "json"},
+                              timeout=self.timeout)
+        resp.raise_for_status()
+        return _format(resp.json())
+
+def default_backend(timeout=10.0):
+    # Plain HTTP with a request timeout, so a stalled SerpAPI call frees its worker; SEARCH_BASE_URL points it at a fake
+    return HttpBackend(timeout=timeout)
+
+def normalize_query(query):
+    return " ".join(str(query).split()).casefold()
+
+class SearchService:
+    # TTL + LRU cache on the normalized query, single-flight for concurrent identical queries, bounded wait
+    def __init__(self, backend=None, ttl=None, maxsize=None, timeout=None, workers=8):
+        self.timeout=float(timeout if timeout is not None else os.getenv("LUNA_SEARCH_TIMEOUT", 10))
+        self.backend=backend or default_backend(timeout=self.timeout)
+        self.cache=LRUCache(maxsize=int(maxsize if maxsize is not None else os.getenv("LUNA_SEARCH_CACHE_SIZE", 1024)),
+                            ttl=float(ttl if ttl is not None else os.getenv("LUNA_SEARCH_TTL", 300)))
+        self._inflight={} # normalized query -> Future shared by every concurrent caller
+        self._lock=threading.Lock()
+        self._pool=ThreadPoolExecutor(max_workers=workers, thread_name_prefix="luna-search")
+        self.coalesced=0
+        self.timeouts=0
+        self.errors=0
+
+    def _fetch(self, key, query):
+        t0=time.perf_counter()
+        try:
+            result=self.backend.search(query)
+            self.cache.set(key, result) # also lands when the caller already gave up waiting
+            return result
+        finally:
+            observe("luna_search_upstream_ms", (time.perf_counter() - t0) * 1000)
+            with self._lock:
+                self._inflight.pop(key, None)
+
+    def run(self, query):
+        key=normalize_query(query)
+        cached=self.cache.get(key)
+        if cached is not None:
+            return cached
+        with self._lock:
+            future=self._inflight.get(key)
+            if future is None:
+                future=self._inflight[key]=self._pool.submit(self._fetch, key, query)
+            else:
+                self.coalesced+=1
+        try:
+            return future.result(timeout=self.timeout)
+        except FutureTimeout:
+            self.timeouts+=1
+            return f"Error searching for '{query}': timed out after {self.timeout:.0f}s"
+        except Exception as e: # errors are not cached; the next call retries
+            self.errors+=1
+            return f"Error searching for '{query}': {e}"
+
+    def stats(self):
+        return {**self.cache.stats(), "coalesced": self.coalesced, "timeouts": self.timeouts, "errors": self.errors}
+
+_service=None
+_service_lock=threading.Lock()
+
+def get_search_service():
+    # Process-wide: every session shares one cache and one set of in-flight requests
+    global _service
+    if _service is None:
+        with _service_lock:
+            if _service is None:
+                _service=SearchService()
+    return _service
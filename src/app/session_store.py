@@ -0,0 +1,218 @@
+import os, time, weakref, threading
+from collections import OrderedDict
+from contextlib import contextmanager
+
+from psycopg2.extras import execute_values, Json
+
+SCHEMA='''
+    create table if not exists chat_sessions (
+        session_id text primary key,
+        state jsonb not null default '{}',
+        created_at timestamp with time zone default current_timestamp,
+        updated_at timestamp with time zone default current_timestamp
+    );
+    create index if not exists chat_sessions_updated_at_idx on chat_sessions (updated_at desc);
+'''
+
+class SessionStore:
+    # Hot sessions live in an in-memory LRU; changes are written behind to chat_sessions by a flusher
+    # thread, cold sessions are loaded lazily on first access, idle ones are flushed and evicted.
+    # A session leased for a turn (lease / acquire) is not evicted until the lease ends. An evicted history that a
+    # caller still holds is reinstalled on the next get() instead of a second copy, so both see the same writes.
+    def __init__(self, history_factory, get_pool=None, max_sessions=None, idle_ttl=None, flush_interval=2.0):
+        self.history_factory=history_factory
+        self.get_pool=get_pool # None -> memory only (nothing survives a restart)
+        self.max_sessions=int(max_sessions if max_sessions is not None else os.getenv("LUNA_SESSION_CACHE_SIZE", 1000))
+        self.idle_ttl=float(idle_ttl if idle_ttl is not None else os.getenv("LUNA_SESSION_IDLE_TTL", 1800))
+        self.flush_interval=flush_interval
+        self._sessions=OrderedDict() # session_id -> [history, last_access]
+        self._dirty=set()
+        self._pending={} # evicted-but-unwritten session_id -> state
+        self._leases={} # session_id -> turns in progress
+        self._evicted=weakref.WeakValueDictionary() # session_id -> evicted history still referenced somewhere
+        self._lock=threading.RLock()
+        self._schema_ready=False
+        self._stop=threading.Event()
+        self._thread=None
+        self.loads=0
+        self.evictions=0
+        self.flushes=0
+
+    def _ensure_schema(self):
+        if not self._schema_ready:
+            with self.get_pool().cursor(commit=True) as cur:
+                cur.execute(SCHEMA)
+            self._schema_ready=True
+
+    def _load(self, session_id):
+        # -> state dict or None; DB trouble degrades to a fresh in-memory history
+        if self.get_pool is None:
+            return None
+        try:
+            self._ensure_schema()
+            with self.get_pool().cursor() as cur:
+                cur.execute("select state from chat_sessions where session_id = %s", (session_id,))
+                row=cur.fetchone()
+            self.loads+=1
+            return row[0] if row else None
+        except Exception as e:
+            print(f"[Sessions] load failed for {session_id}: {e}")
+            return None
+
+    def _touch(self, session_id):
+        entry=self._sessions.get(session_id)
+        if entry is None:
+            return None
+        entry[1]=time.monotonic()
+        self._sessions.move_to_end(session_id)
+        return entry[0]
+
+    def get(self, session_id):
+        with self._lock:
+            history=self._touch(session_id) or self._revive(session_id)
+            if history is not None:
+                return history
+            state=self._pending.pop(session_id, None) # evicted but not yet written: reuse, keep it dirty
+            unwritten=state is not None
+        if state is None:
+            state=self._load(session_id) # DB read outside the lock so other sessions aren't blocked
+        history=self.history_factory()
+        if state:
+            history.load_state(state)
+        with self._lock:
+            existing=self._touch(session_id) or self._revive(session_id) # another thread may have loaded it meanwhile
+            if existing is not None:
+                return existing
+            history.on_change=lambda h, sid=session_id: self._on_change(sid, h)
+            self._sessions[session_id]=[history, time.monotonic()]
+            if unwritten:
+                self._dirty.add(session_id)
+            self._shrink()
+            return history
+
+    def _revive(self, session_id):
+        history=self._evicted.pop(session_id, None)
+        if history is None:
+            return None
+        self._sessions[session_id]=[history, time.monotonic()]
+        if self._pending.pop(session_id, None) is not None: # its own unwritten state; the object is newer or equal
+            self._dirty.add(session_id)
+        self._shrink()
+        return history
+
+    def pin(self, session_id):
+        # Keeps the session in memory once loaded, until release(session_id); never blocks on the database
+        with self._lock:
+            self._leases[session_id]=self._leases.get(session_id, 0) + 1
+
+    def acquire(self, session_id):
+        # -> history, pinned in memory until release(session_id); use around a turn
+        self.pin(session_id)
+        try:
+            return self.get(session_id)
+        except BaseException:
+            self.release(session_id)
+            raise
+
+    def release(self, session_id):
+        with self._lock:
+            left=self._leases.get(session_id, 0) - 1
+            if left > 0:
+                self._leases[session_id]=left
+            else:
+                self._leases.pop(session_id, None)
+                self._shrink() # evictions deferred while the turn ran
+
+    @contextmanager
+    def lease(self, session_id):
+        history=self.acquire(session_id)
+        try:
+            yield history
+        finally:
+            self.release(session_id)
+
+    def mark_dirty(self, session_id):
+        with self._lock:
+            self._dirty.add(session_id)
+
+    def _on_change(self, session_id, history):
+        with self._lock:
+            entry=self._sessions.get(session_id)
+            if entry is not None:
+                if entry[0] is history:
+                    self._dirty.add(session_id)
+                else: # cannot happen while _revive hands out the evicted object; never drop the write quietly
+                    print(f"[Sessions] write to a stale history of {session_id} ignored")
+            else: # evicted while a caller still held it: queue its state for the next flush instead of losing it
+                self._pending[session_id]=history.to_state()
+
+    def _shrink(self):
+        # LRU sessions over max_sessions, skipping leased ones (the cache may run over until their turns end)
+        over=len(self._sessions) - self.max_sessions
+        if over > 0:
+            for session_id in [sid for sid in self._sessions if sid not in self._leases][:over]:
+                self._evict(session_id)
+
+    def _evict(self, session_id):
+        history, _=self._sessions.pop(session_id)
+        self._evicted[session_id]=history
+        if session_id in self._dirty:
+            self._dirty.discard(session_id)
+            self._pending[session_id]=history.to_state() # written by the next flush
+        self.evictions+=1
+
+    def evict_idle(self):
+        cutoff=time.monotonic() - self.idle_ttl
+        with self._lock:
+            for session_id in [sid for sid, (_, last) in self._sessions.items() if last < cutoff and sid not in self._leases]:
+                self._evict(session_id)
+
+    def flush(self):
+        with self._lock:
+            rows=dict(self._pending)
+            for session_id in self._dirty:
+                if session_id in self._sessions:
+                    rows[session_id]=self._sessions[session_id][0].to_state()
+            self._dirty=set()
+            self._pending={}
+        if not rows or self.get_pool is None:
+            return 0
+        try:
+            self._ensure_schema()
+            with self.get_pool().cursor(commit=True) as cur:
+                execute_values(cur,
+                    'insert into chat_sessions (session_id, state) values %s '
+                    'on conflict (session_id) do update set state = excluded.state, updated_at = current_timestamp',
+                    [(sid, Json(state)) for sid, state in rows.items()])
+            self.flushes+=1
+            return len(rows)
+        except Exception as e:
+            print(f"[Sessions] flush of {len(rows)} sessions failed, will retry: {e}")
+            with self._lock: # put everything back unless a newer change already superseded it
+                for sid, state in rows.items():
+                    if sid in self._sessions:
+                        self._dirty.add(sid)
+                    else:
+                        self._pending.setdefault(sid, state)
+            return 0
+
+    def start(self):
+        if self._thread and self._thread.is_alive():
+            return self
+        self._stop.clear()
+        def _run():
+            while not self._stop.wait(self.flush_interval):
+                self.evict_idle()
+                self.flush()
+        self._thread=threading.Thread(target=_run, name="luna-session-flusher", daemon=True)
+        self._thread.start()
+        return self
+
+    def close(self):
+        self._stop.set()
+        self.flush()
+
+    def stats(self):
+        with self._lock:
+            return {"hot": len(self._sessions), "dirty": len(self._dirty), "pending": len(self._pending), "leased": len(self._leases),
+                    "loads": self.loads, "evictions": self.evictions, "flushes": self.flushes}
@@ -0,0 +1,129 @@
+import os, json, gzip, time, queue, atexit, threading, datetime
+
+from langchain_core.callbacks import BaseCallbackHandler
+
+class TraceWriter:
+    # Append-only JSONL sink: emit() only enqueues, a daemon thread writes batches and rotates by size.
+    # The queue is bounded, so a stalled disk drops events (counted) instead of growing memory.
+    def __init__(self, path="logs.jsonl", max_bytes=10_000_000, backups=5, compress=False,
+                 batch_size=200, flush_interval=1.0, queue_size=10_000):
+        self.path=path + ".gz" if compress and not path.endswith(".gz") else path
+        self.max_bytes=max_bytes
+        self.backups=backups
+        self.compress=compress
+        self.batch_size=batch_size
+        self.flush_interval=flush_interval
+        self._queue=queue.Queue(maxsize=queue_size)
+        self.written=0
+        self.dropped=0
+        self._thread=threading.Thread(target=self._run, name="luna-trace-writer", daemon=True)
+        self._thread.start()
+        atexit.register(self.close)
+
+    def emit(self, event):
+        try:
+            self._queue.put_nowait(event)
+        except queue.Full:
+            self.dropped+=1
+
+    def _open(self):
+        return gzip.open(self.path, "at", encoding="utf-8") if self.compress else open(self.path, "a", encoding="utf-8")
+
+    def _rotate(self):
+        # logs.jsonl -> logs.jsonl.1 -> ... -> logs.jsonl.<backups> (oldest removed)
+        root, ext=(self.path[:-3], ".gz") if self.compress else (self.path, "")
+        for i in range(self.backups - 1, 0, -1):
+            src=f"{root}.{i}{ext}"
+            if os.path.exists(src):
+                os.replace(src, f"{root}.{i + 1}{ext}")
+        if self.backups > 0:
+            os.replace(self.path, f"{root}.1{ext}")
+        else:
+            os.remove(self.path)
+
+    def _write(self, batch):
+        lines="".join(json.dumps(e, ensure_ascii=False, separators=(",", ":"), default=str) + "\n" for e in batch)
+        with self._open() as f:
+            f.write(lines)
+        self.written+=len(batch)
+        if self.max_bytes and os.path.getsize(self.path) >= self.max_bytes:
+            self._rotate()
+
+    def _run(self):
+        while True:
+            batch=[]
+            deadline=time.monotonic() + self.flush_interval
+            stop=False
+            while len(batch) < self.batch_size:
+                try:
+                    event=self._queue.get(timeout=max(deadline - time.monotonic(), 0.001))
+                except queue.Empty:
+                    break
+                if event is None:
+                    stop=True
+                    break
+                batch.append(event)
+            if batch:
+                try:
+                    self._write(batch)
+                except OSError as e:
+                    self.dropped+=len(batch)
+                    print(f"[Trace] write failed: {e}")
+            if stop:
+                return
+
+    def close(self, timeout=5.0):
+        if self._thread.is_alive():
+            self._queue.put(None)
+            self._thread.join(timeout)
+
+def _clip(value, limit=8000):
+    text=value if isinstance(value, str) else str(value)
+    return text if len(text) <= limit else text[:limit] + "… [truncated]"
+
+class JsonlTraceHandler(BaseCallbackHandler):
+    # One compact JSON line per LLM/tool/agent event; holds no per-session message list
+    def __init__(self, writer, model_name=None, session_id=None):
+        self.writer=writer
+        self.model_name=model_name or "unknown_model"
+        self.session_id=session_id
+
+    def _emit(self, event, run_id=None, parent_run_id=None, **fields):
+        self.writer.emit({
+            "ts": datetime.datetime.now().isoformat(timespec="milliseconds"),
+            "event": event,
+            "model": self.model_name,
+            "session_id": self.session_id,
+            "run_id": str(run_id) if run_id else None,
+            "parent_run_id": str(parent_run_id) if parent_run_id else None,
+            **fields,
+        })
+
+    def on_llm_start(self, serialized, prompts, *, run_id=None, parent_run_id=None, **kwargs):
+        self._emit("llm_start", run_id, parent_run_id, prompts=[_clip(p) for p in prompts])
+
+    def on_chat_model_start(self, serialized, messages, *, run_id=None, parent_run_id=None, **kwargs):
+        prompts=[[{"role": m.type, "content": _clip(m.content)} for m in batch] for batch in messages]
+        self._emit("llm_start", run_id, parent_run_id, messages=prompts)
+
+    def on_llm_end(self, response, *, run_id=None, parent_run_id=None, **kwargs):
+        texts=[_clip(g.text) for gens in getattr(response, "generations", []) for g in gens]
+        self._emit("llm_end", run_id, parent_run_id, output=texts, llm_output=getattr(response, "llm_output", None))
+
+    def on_llm_error(self, error, *, run_id=None, parent_run_id=None, **kwargs):
+        self._emit("llm_error", run_id, parent_run_id, error=_clip(error))
+
+    def on_tool_start(self, serialized, input_str, *, run_id=None, parent_run_id=None, **kwargs):
+        self._emit("tool_start", run_id, parent_run_id, tool=(serialized or {}).get("name"), input=_clip(input_str))
+
+    def on_tool_end(self, output, *, run_id=None, parent_run_id=None, **kwargs):
+        self._emit("tool_end", run_id, parent_run_id, output=_clip(output))
+
+    def on_tool_error(self, error, *, run_id=None, parent_run_id=None, **kwargs):
+        self._emit("tool_error", run_id, parent_run_id, error=_clip(error))
+
+    def on_agent_action(self, action, *, run_id=None, parent_run_id=None, **kwargs):
+        self._emit("agent_action", run_id, parent_run_id, tool=action.tool, input=_clip(action.tool_input))
+
+    def on_agent_finish(self, finish, *, run_id=None, parent_run_id=None, **kwargs):
+        self._emit("agent_finish", run_id, parent_run_id, output=_clip(finish.return_values.get("output", "")))
@@ -1,18 +1,23 @@
-from sentence_transformers import SentenceTransformer
 import psycopg2, json
+import io, os, time, threading, hashlib
+import numpy as np
+from psycopg2.extras import execute_values
+from src.app.db_pool import ConnectionPool, db_config
+from src.app.cache import LRUCache
+from src.app.metrics import timer
+from src.app.embedding_service import MicroBatcher, EmbeddingClient
+from src.app.vector_storage import storage_config, search, _current_column_type
+from src.app.ann_index import search_settings
+from src.app.hybrid_search import hybrid_search, hybrid_config, stored_ts_config, TS_CONFIG
 
 def connect_to_db():
-        conn = psycopg2.connect(
-            dbname="pgql",
-            user="{username}", # admin
-            password="{password}",
-            host="localhost",
-            port="5432"
-        )
+        # Single standalone connection (scripts/psql-style use); the app goes through get_pool()
+        conn = psycopg2.connect(**db_config())
         cur=conn.cursor()
         return conn, cur
 
 def embedding_model():
+    from sentence_transformers import SentenceTransformer # heavy (torch); imported on first load only
     model=SentenceTransformer('Snowflake/snowflake-arctic-embed-l-v2.0')
     # content='Introducing a Revolutionary Platform for Tech Startup Creation and Investments.'
     # embedding=model.encode(content).tolist()
@@ -20,34 +25,247 @@ def embedding_model():
     # print(len(embedding))
     return model
 
+# Lazy handles: nothing heavy happens at import, the first caller (or warm_up) pays the cost
+_model=None
+_pool=None
+_model_lock=threading.Lock()
+_pool_lock=threading.Lock()
+_warmup_thread=None
+startup_timings={} # phase -> ms
+startup_errors={} # phase -> error message
+
+def _timed(phase, fn):
+    t0=time.perf_counter()
+    try:
+        return fn()
+    finally:
+        startup_timings[phase]=(time.perf_counter() - t0) * 1000
+
+def shared_embedder():
+    # LUNA_EMBEDDING_SERVICE: "local" (default) -> one model + micro-batching worker shared by every session
+    # in this process, "off" -> bare model, anything else -> address of a running embedding server
+    mode=os.getenv("LUNA_EMBEDDING_SERVICE", "local")
+    if mode == "off":
+        return embedding_model()
+    if mode == "local":
+        return MicroBatcher(embedding_model().encode)
+    return EmbeddingClient(mode)
+
+def get_model():
+    global _model
+    if _model is None:
+        with _model_lock:
+            if _model is None:
+                _model=_timed("embedding_model", shared_embedder)
+    return _model
+
+def set_model(model):
+    # Swap in any object with SentenceTransformer's encode(texts, batch_size=...) (benchmarks, tests)
+    global _model
+    with _model_lock:
+        _model=model
+    embedding_cache.clear()
+    invalidate_results()
+
+def get_pool():
+    # POSTGRES_POOL_MIN / POSTGRES_POOL_MAX size the pool; connections are health-checked on checkout
+    global _pool
+    if _pool is None:
+        with _pool_lock:
+            if _pool is None:
+                _pool=_timed("connection_pool", ConnectionPool)
+    return _pool
+
+def startup_report():
+    lines=[f"[Startup] {phase}: {ms:.1f} ms" for phase, ms in startup_timings.items()]
+    lines+=[f"[Startup] {phase}: FAILED ({err})" for phase, err in startup_errors.items()]
+    return "\n".join(lines)
+
+def warm_up(background=True):
+    # Preload model + connection; in background mode the UI keeps rendering meanwhile
+    global _warmup_thread
+    def _run():
+        t0=time.perf_counter()
+        for phase, fn in (("embedding_model", get_model), ("connection_pool", get_pool)):
+            try:
+                fn()
+                startup_errors.pop(phase, None)
+            except Exception as e:
+                startup_errors[phase]=str(e) # Postgres down etc. -> retried lazily on first use
+        startup_timings["warm_up_total"]=(time.perf_counter() - t0) * 1000
+        print(startup_report()) # terminal timing
+    if not background:
+        _run()
+        return None
+    if _warmup_thread is None or (not _warmup_thread.is_alive() and startup_errors): # retry only after a failure
+        _warmup_thread=threading.Thread(target=_run, name="luna-warm-up", daemon=True)
+        _warmup_thread.start()
+    return _warmup_thread
+
+# query text -> float32 embedding (LRU, ~4 KB/entry) and (embedding, top_k) -> rows (TTL, cleared on writes)
+embedding_cache=LRUCache(maxsize=int(os.getenv("LUNA_EMBED_CACHE_SIZE", 2048)))
+result_cache=LRUCache(maxsize=int(os.getenv("LUNA_RESULT_CACHE_SIZE", 512)), ttl=float(os.getenv("LUNA_RESULT_CACHE_TTL", 300)))
+_result_generation=0 # bumped on every write so in-flight reads can't repopulate stale rows
+_invalidate_hooks=[] # also run on every write (the answer cache drops VectorDB answers)
+
+def _normalize_query(text):
+    return " ".join(str(text).split()).casefold()
+
+def _embedding_key(embedding):
+    return hashlib.blake2b(np.asarray(embedding, dtype=np.float32).tobytes(), digest_size=16).hexdigest()
+
+def embed_query(query):
+    key=_normalize_query(query)
+    embedding=embedding_cache.get(key)
+    if embedding is None:
+        embedding=np.asarray(get_model().encode(query), dtype=np.float32)
+        embedding_cache.set(key, embedding)
+    return embedding
+
+def invalidate_results():
+    global _result_generation
+    _result_generation+=1
+    result_cache.clear()
+    _columns.clear()
+    _ts_config.clear()
+    for hook in list(_invalidate_hooks):
+        hook()
+
+def on_invalidate(hook):
+    # hook() runs after every corpus write in this process (insert_to_db, insert_batch, corpus_sync.sync)
+    _invalidate_hooks.append(hook)
+    return hook
+
+def cache_stats():
+    return {"embedding": embedding_cache.stats(), "results": result_cache.stats()}
+
 def insert_to_db(content):
-    embedding=model.encode(content).tolist()
-    cur=conn.cursor()
-    cur.execute('''
-        insert into documents (content, embedding)
-        values (%s, %s);
-    ''', (content, embedding))
-    conn.commit()
-    cur.close()
-
-def add_docs(docs):
+    embedding=get_model().encode(content).tolist()
+    with get_pool().cursor(commit=True) as cur:
+        cur.execute('''
+            insert into documents (content, embedding)
+            values (%s, %s);
+        ''', (content, embedding))
+    invalidate_results()
+
+def iter_batches(docs, batch_size):
+    # Group any iterable/generator into lists of batch_size without materializing it
+    batch=[]
     for doc in docs:
-        insert_to_db(doc)
+        batch.append(doc)
+        if len(batch) >= batch_size:
+            yield batch
+            batch=[]
+    if batch:
+        yield batch
+
+def vector_literal(embedding):
+    return '[' + ','.join(repr(float(x)) for x in embedding) + ']'
+
+def _copy_escape(text):
+    # COPY text format: escape backslash first, then the row/column delimiters
+    return (text.replace('\\', '\\\\')
+                .replace('\t', '\\t')
+                .replace('\n', '\\n')
+                .replace('\r', '\\r'))
+
+def insert_batch(contents, embeddings, method="values"):
+    # One round trip + one commit per batch: multi-row INSERT (default) or COPY
+    with get_pool().cursor(commit=True) as cur:
+        if method == "copy":
+            buf=io.StringIO()
+            for content, embedding in zip(contents, embeddings):
+                buf.write(f"{_copy_escape(content)}\t{vector_literal(embedding)}\n")
+            buf.seek(0)
+            cur.copy_expert('copy documents (content, embedding) from stdin', buf)
+        else:
+            rows=[(content, vector_literal(embedding)) for content, embedding in zip(contents, embeddings)]
+            execute_values(cur,
+                'insert into documents (content, embedding) values %s',
+                rows,
+                template='(%s, %s::vector)',
+                page_size=len(rows))
+    invalidate_results()
+
+def add_docs(docs, batch_size=64, method="values", report_every=1):
+    # Streaming bulk ingestion: docs may be any iterable/generator; only one batch is held in memory
+    start=time.perf_counter()
+    total=0
+    for i, batch in enumerate(iter_batches(docs, batch_size), 1):
+        with timer("luna_ingest_batch_ms", method=method):
+            embeddings=get_model().encode(batch, batch_size=batch_size)
+            insert_batch(batch, embeddings, method=method)
+        total+=len(batch)
+        if report_every and i % report_every == 0:
+            elapsed=time.perf_counter() - start
+            print(f"[Ingest] {total} docs in {elapsed:.1f}s ({total / max(elapsed, 1e-9):.1f} docs/sec)") # terminal throughput
+    elapsed=time.perf_counter() - start
+    return {"docs": total, "seconds": elapsed, "docs_per_sec": total / max(elapsed, 1e-9)}
+
+def retrieval_config():
+    # LUNA_RETRIEVAL=vector|hybrid, LUNA_RETRIEVAL_FILTER={"source": ...} (metadata @>), LUNA_SIMILARITY_THRESHOLD=0.3
+    threshold=os.getenv("LUNA_SIMILARITY_THRESHOLD")
+    filters=os.getenv("LUNA_RETRIEVAL_FILTER")
+    return {
+        "retrieval": os.getenv("LUNA_RETRIEVAL", "vector"),
+        "filters": json.loads(filters) if filters else None,
+        "threshold": float(threshold) if threshold else None,
+    }
+
+_columns={} # column -> present in documents; checked once per process, re-checked after writes (migrations)
+
+def _has_column(cur, column):
+    if column not in _columns:
+        _columns[column]=_current_column_type(cur, column) is not None
+    return _columns[column]
+
+_ts_config={} # "content_tsv" -> configuration the lexical leg parses queries with; re-read after writes (migrations)
+
+def _lexical_config(cur):
+    # A query parsed with another configuration than the stored tsvector silently loses lexical recall
+    if "content_tsv" not in _ts_config:
+        stored=stored_ts_config(cur)
+        if stored and stored != TS_CONFIG:
+            print(f"[Hybrid] content_tsv is built with '{stored}' but LUNA_TS_CONFIG is '{TS_CONFIG}': using '{stored}', "
+                  f"run python -m src.app.hybrid_search migrate to rebuild it")
+        _ts_config["content_tsv"]=stored or TS_CONFIG
+    return _ts_config["content_tsv"]
 
 # Querying the database for similar documents
-def query_postgresql(query, top_k=3):
-    cur=conn.cursor()
-    query_embedding=model.encode(query).tolist() # query_embedding=json.dumps(model.encode(query).tolist())
-    cur.execute('''
-        select content, embedding <=> %s::vector as similarity_score
-        from documents
-        order by similarity_score asc
-        limit %s;
-    ''', (query_embedding, top_k))
-    results=cur.fetchall()
-    cur.close()
-    # conn.close()
-    return [r[0] for r in results] # results
+def _detail_row(row):
+    # (content, score, id, source_id, cosine distance, similarities to every row of the result in order)
+    return {"id": row[2], "source_id": row[3], "content": row[0], "score": 1.0 - float(row[4]),
+            "similarities": [float(x) for x in row[5]]}
+
+def query_postgresql(query, top_k=3, filters=None, threshold=None, retrieval=None, detail=False):
+    # -> [content]; detail=True -> [{"id", "source_id", "content", "score" (cosine similarity), "similarities"}]
+    defaults=retrieval_config()
+    retrieval=retrieval or defaults["retrieval"]
+    filters=filters if filters is not None else defaults["filters"]
+    threshold=threshold if threshold is not None else defaults["threshold"]
+    with timer("luna_query_embedding_ms"):
+        query_embedding=embed_query(query) # query_embedding=json.dumps(model.encode(query).tolist())
+    key=(_embedding_key(query_embedding), top_k, retrieval, json.dumps(filters, sort_keys=True), threshold,
+         _normalize_query(query) if retrieval == "hybrid" else None, detail) # the lexical leg depends on the text itself
+    cached=result_cache.get(key)
+    if cached is not None:
+        return list(cached)
+    generation=_result_generation
+    storage=storage_config() # LUNA_VECTOR_STORAGE=halfvec|binary: compact ANN pass + exact rerank on full vectors
+    with timer("luna_pgvector_query_ms", storage=storage["mode"], retrieval=retrieval), get_pool().cursor() as cur:
+        knobs=search_settings(cur) # tuned probes / ef_search
+        has_source_id=_has_column(cur, "source_id") if detail else True # NULL labels on a pre-corpus_sync schema
+        if retrieval == "hybrid":
+            results=hybrid_search(cur, query, query_embedding, top_k, **storage, **knobs, **hybrid_config(),
+                                  filters=filters, threshold=threshold, detail=detail, has_source_id=has_source_id,
+                                  ts_config=_lexical_config(cur))
+        else:
+            results=search(cur, query_embedding, top_k, **storage, **knobs, filters=filters, threshold=threshold,
+                           detail=detail, has_source_id=has_source_id)
+    contents=[_detail_row(r) if detail else r[0] for r in results] # results
+    if generation == _result_generation:
+        result_cache.set(key, tuple(contents))
+    return contents
 
 # docs=['LunaSpace’s mission is to create AI systems that can accurately understand the universe and aid humanity in its pursuit of knowledge. Our team is small, highly motivated, and focused on engineering excellence. This organization is for individuals who appreciate challenging themselves and thrive on curiosity. We operate with a flat organizational structure. All employees are expected to be hands-on and to contribute directly to the company’s mission. Leadership is given to those who show initiative and consistently deliver excellence. Work ethic and strong prioritization skills are important. All engineers are expected to have strong communication skills. They should be able to concisely and accurately share knowledge with their teammates.',
 #     "About the role We're looking for exceptional multimedia engineers and product thinkers who want to make Grok's realtime avatar products the best in the world.", 
@@ -57,6 +275,4 @@ def query_postgresql(query, top_k=3):
 #     "Location - The role is based in Palo Alto. Candidates are expected to be located near the Bay Area or open to relocation.", 
 #     "Annual Salary Range - $180,000 - $440,000 USD", 
 #     "Benefits - Base salary is just one part of our total rewards package at xAI, which also includes equity, comprehensive medical, vision, and dental coverage, access to a 401(k) retirement plan, short & long-term disability insurance, life insurance, and various other discounts and perks."]
-conn, cur=connect_to_db()
-model=embedding_model()
 # add_docs(docs)
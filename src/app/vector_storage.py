@@ -0,0 +1,266 @@
+import os, sys, time, argparse
+
+import numpy as np
+from psycopg2.extras import Json
+
+# Compact first-pass storage for documents.embedding (pgvector >= 0.7).
+#   full    -> ANN/exact search on the VECTOR(1024) column (original behaviour)
+#   halfvec -> Matryoshka-truncated float16 copy (embedding_half) for the ANN pass
+#   binary  -> sign-quantized bit copy (embedding_bits), hamming distance for the ANN pass
+# Compact modes over-fetch top_k * LUNA_RERANK_OVERSAMPLE candidates and rerank them exactly on the full vectors.
+# The compact columns are generated from `embedding`, so existing writers need no change.
+#   python -m src.app.vector_storage migrate --mode halfvec --dim 256
+#   python -m src.app.vector_storage report --top-k 3
+
+MODES=("full", "halfvec", "binary")
+COLUMNS={"halfvec": "embedding_half", "binary": "embedding_bits"}
+
+def storage_config():
+    mode=os.getenv("LUNA_VECTOR_STORAGE", "full")
+    if mode not in MODES:
+        raise ValueError(f"LUNA_VECTOR_STORAGE must be one of {MODES}, got {mode!r}")
+    return {
+        "mode": mode,
+        "dim": int(os.getenv("LUNA_VECTOR_DIM", 256)),
+        "oversample": int(os.getenv("LUNA_RERANK_OVERSAMPLE", 4 if mode == "halfvec" else 10)),
+    }
+
+def _compact_expr(mode, dim, source):
+    # Same expression for the stored column and the query side, so both are truncated/quantized alike
+    if mode == "halfvec":
+        return f"subvector({source}, 1, {dim})::halfvec({dim})"
+    return f"binary_quantize(subvector({source}, 1, {dim}))::bit({dim})"
+
+def _column_type(mode, dim):
+    return f"halfvec({dim})" if mode == "halfvec" else f"bit({dim})"
+
+def migration_sql(mode, dim):
+    column=COLUMNS[mode]
+    ops="halfvec_cosine_ops" if mode == "halfvec" else "bit_hamming_ops"
+    return [
+        f"alter table documents add column if not exists {column} {_column_type(mode, dim)} "
+        f"generated always as ({_compact_expr(mode, dim, 'embedding')}) stored",
+        f"create index if not exists documents_{column}_idx on documents using hnsw ({column} {ops})",
+    ]
+
+def _where(*clauses):
+    clauses=[c for c in clauses if c]
+    return "where " + " and ".join(clauses) if clauses else ""
+
+FILTER_CLAUSE="metadata @> %(filters)s::jsonb" # served by documents_metadata_idx (GIN)
+THRESHOLD_CLAUSE="embedding <=> %(q)s::vector <= 1 - %(threshold)s" # cosine similarity >= threshold
+
+# Row identity for corpus_sync and the context labels; databases created before it get the columns from any migrate
+IDENTITY_SCHEMA=[
+    "alter table documents add column if not exists source_id text",
+    "alter table documents add column if not exists content_hash text",
+    "create unique index if not exists documents_source_chunk_idx on documents (source_id, content_hash)",
+]
+
+def missing_identity_schema(cur):
+    # -> the IDENTITY_SCHEMA statements this table still needs; catalog reads only, so callers on an up-to-date table
+    # never take the ACCESS EXCLUSIVE lock the DDL would
+    cur.execute('''
+        select column_name from information_schema.columns
+        where table_name = 'documents' and column_name in ('source_id', 'content_hash')
+    ''')
+    have={row[0] for row in cur.fetchall()}
+    cur.execute("select 1 from pg_indexes where tablename = 'documents' and indexname = 'documents_source_chunk_idx'")
+    present=("source_id" in have, "content_hash" in have, cur.fetchone() is not None)
+    return [statement for statement, ok in zip(IDENTITY_SCHEMA, present) if not ok]
+
+def source_expr(has_source_id=True, table=""):
+    # a literal NULL when the column is missing (databases from an older init.sql that never ran a migrate)
+    return f"{table}source_id" if has_source_id else "null::text as source_id"
+
+def detail_sql(hits, order, score):
+    # detail=True: the ranked hits plus each one's cosine similarity to every hit (float4[] in rank order), so MMR
+    # gets k*k floats back instead of k full vectors. hits must select content, id, source_id, embedding, distance.
+    # -> rows (content, score, id, source_id, distance, similarities)
+    return f'''
+        with hits as ({hits}),
+        ranked as (select *, row_number() over (order by {order}) as rn from hits)
+        select content, {score}, id, source_id, distance,
+               array(select 1 - (o.embedding <=> r.embedding) from ranked o order by o.rn)::float4[] as similarities
+        from ranked r
+        order by rn;
+    '''
+
+def search_sql(mode, dim, filtered=False, thresholded=False, detail=False, has_source_id=True):
+    # Parameters: q (query vector), k, candidates, filters (jsonb), threshold
+    extra=", id, source_id, embedding, embedding <=> %(q)s::vector as distance" if detail else ""
+    if mode == "full":
+        extra=extra.replace("source_id", source_expr(has_source_id))
+        sql=f'''
+            select content, embedding <=> %(q)s::vector as similarity_score{extra}
+            from documents
+            {_where(filtered and FILTER_CLAUSE, thresholded and THRESHOLD_CLAUSE)}
+            order by similarity_score asc
+            limit %(k)s
+        '''
+    else:
+        column=COLUMNS[mode]
+        op="<=>" if mode == "halfvec" else "<~>"
+        sql=f'''
+            with candidates as (
+                select id, content, embedding{", " + source_expr(has_source_id) if detail else ""}
+                from documents
+                {_where(filtered and FILTER_CLAUSE)}
+                order by {column} {op} {_compact_expr(mode, dim, "%(q)s::vector")}
+                limit %(candidates)s
+            )
+            select content, embedding <=> %(q)s::vector as similarity_score{extra}
+            from candidates
+            {_where(thresholded and THRESHOLD_CLAUSE)}
+            order by similarity_score asc
+            limit %(k)s
+        '''
+    return detail_sql(sql, "distance", "similarity_score") if detail else sql.rstrip() + ";"
+
+def index_knobs(probes=None, ef_search=None):
+    # SET LOCAL prefix sent in the same round trip as the query
+    prefix=""
+    if probes:
+        prefix+="set local ivfflat.probes = %(probes)s; "
+    if ef_search:
+        prefix+="set local hnsw.ef_search = %(ef_search)s; "
+    return prefix
+
+def search(cur, embedding, top_k, mode="full", dim=256, oversample=4, probes=None, ef_search=None, filters=None, threshold=None,
+           detail=False, has_source_id=True):
+    # -> [(content, cosine distance)] on the caller's cursor; metadata filter and similarity threshold run in SQL
+    # detail=True -> [(content, cosine distance, id, source_id, cosine distance, similarities to every row)]
+    candidates=top_k * oversample
+    if mode != "full": # hnsw.ef_search caps how many candidates the index returns
+        ef_search=max(ef_search or 40, candidates)
+    sql=index_knobs(probes, ef_search) + search_sql(mode, dim, filtered=bool(filters), thresholded=threshold is not None,
+                                                  detail=detail, has_source_id=has_source_id)
+    cur.execute(sql, {"q": list(map(float, embedding)), "k": top_k, "candidates": candidates,
+                      "probes": probes, "ef_search": ef_search, "filters": Json(filters or {}), "threshold": threshold})
+    return cur.fetchall()
+
+def _current_column_type(cur, column):
+    cur.execute('''
+        select format_type(atttypid, atttypmod) from pg_attribute
+        where attrelid = 'documents'::regclass and attname = %s and not attisdropped
+    ''', (column,))
+    row=cur.fetchone()
+    return row[0] if row else None
+
+def migrate(get_pool, mode, dim):
+    # Adds (or re-creates, if the dimension changed) the generated column + its HNSW index.
+    # Rewrites the table under an exclusive lock: run it in a maintenance window on large tables.
+    column=COLUMNS[mode]
+    with get_pool().cursor(commit=True) as cur:
+        cur.execute("create extension if not exists vector")
+        for statement in IDENTITY_SCHEMA:
+            cur.execute(statement)
+        existing=_current_column_type(cur, column)
+        if existing and existing != _column_type(mode, dim):
+            print(f"[Storage] {column} is {existing}, re-creating as {_column_type(mode, dim)}")
+            cur.execute(f"alter table documents drop column {column}")
+        t0=time.perf_counter()
+        for statement in migration_sql(mode, dim):
+            cur.execute(statement)
+    print(f"[Storage] {column} ready in {(time.perf_counter() - t0):.1f}s")
+
+def storage_sizes(cur):
+    # Average per-row column bytes and index sizes, for the report
+    sizes={}
+    for column in ("embedding",) + tuple(COLUMNS.values()):
+        if _current_column_type(cur, column):
+            cur.execute(f"select coalesce(avg(pg_column_size({column})), 0) from documents")
+            sizes[f"{column}_bytes_per_row"]=float(cur.fetchone()[0])
+    cur.execute('''
+        select c.relname, pg_relation_size(c.oid) from pg_index i
+        join pg_class c on c.oid = i.indexrelid
+        where i.indrelid = 'documents'::regclass
+    ''')
+    for name, size in cur.fetchall():
+        sizes[f"{name}_index_bytes"]=int(size)
+    return sizes
+
+def query_embeddings(get_pool, get_model, n=50, query_file=None):
+    # Evaluation queries: lines of query_file embedded with the app's model, or n stored documents sampled at random
+    if query_file:
+        with open(query_file, encoding="utf-8") as f:
+            texts=[line.strip() for line in f if line.strip()]
+        return list(np.asarray(get_model().encode(texts), dtype=np.float32))
+    with get_pool().cursor() as cur:
+        cur.execute("select embedding::text from documents order by random() limit %s", (n,))
+        return [np.asarray(literal.strip("[]").split(","), dtype=np.float32) for (literal,) in cur.fetchall()]
+
+def exact_top_k(get_pool, embeddings, top_k):
+    # Ground truth for recall: sequential scan, no ANN index -> ([set of contents], [latency ms])
+    truth, t=[], []
+    with get_pool().cursor() as cur:
+        cur.execute("set local enable_indexscan = off")
+        cur.execute("set local enable_bitmapscan = off")
+        for emb in embeddings:
+            t0=time.perf_counter()
+            truth.append({r[0] for r in search(cur, emb, top_k)})
+            t.append((time.perf_counter() - t0) * 1000)
+    return truth, t
+
+def _latency(values):
+    values=np.asarray(values, dtype=np.float64)
+    return {"p50_ms": float(np.percentile(values, 50)), "p95_ms": float(np.percentile(values, 95))}
+
+def report(get_pool, embeddings, top_k=3, dim=256, oversample=None):
+    # Recall@k against an exact (sequential scan) search, plus latency, for the current path and each compact mode
+    rows={}
+    exact, t=exact_top_k(get_pool, embeddings, top_k)
+    rows["exact"]={"recall": 1.0, **_latency(t)}
+    for mode in MODES:
+        with get_pool().cursor() as cur:
+            if mode != "full" and not _current_column_type(cur, COLUMNS[mode]):
+                rows[mode]={"skipped": f"run: python -m src.app.vector_storage migrate --mode {mode}"}
+                continue
+            factor=oversample or (4 if mode == "halfvec" else 10)
+            hits, t=0, []
+            for emb, truth in zip(embeddings, exact):
+                t0=time.perf_counter()
+                found={r[0] for r in search(cur, emb, top_k, mode=mode, dim=dim, oversample=factor)}
+                t.append((time.perf_counter() - t0) * 1000)
+                hits+=len(found & truth)
+            rows["current" if mode == "full" else mode]={"recall": hits / max(sum(len(x) for x in exact), 1), **_latency(t)}
+    with get_pool().cursor() as cur:
+        rows["sizes"]=storage_sizes(cur)
+    return rows
+
+def main(argv=None):
+    parser=argparse.ArgumentParser(description="Compact embedding storage: migration and recall-vs-latency report")
+    sub=parser.add_subparsers(dest="command", required=True)
+    m=sub.add_parser("migrate")
+    m.add_argument("--mode", choices=[x for x in MODES if x != "full"], default="halfvec")
+    m.add_argument("--dim", type=int, default=int(os.getenv("LUNA_VECTOR_DIM", 256)))
+    r=sub.add_parser("report")
+    r.add_argument("--top-k", type=int, default=3)
+    r.add_argument("--dim", type=int, default=int(os.getenv("LUNA_VECTOR_DIM", 256)))
+    r.add_argument("--oversample", type=int, default=None)
+    r.add_argument("--queries", type=int, default=50, help="sample this many stored documents as queries")
+    r.add_argument("--query-file", help="one query per line, embedded with the app's model instead of sampling")
+    args=parser.parse_args(argv)
+
+    from src.app.vector_db import get_pool, get_model
+    if args.command == "migrate":
+        migrate(get_pool, args.mode, args.dim)
+        return 0
+    embeddings=query_embeddings(get_pool, get_model, args.queries, args.query_file)
+    if not embeddings:
+        print("[Storage] no queries (empty documents table?)")
+        return 1
+    rows=report(get_pool, embeddings, top_k=args.top_k, dim=args.dim, oversample=args.oversample)
+    sizes=rows.pop("sizes")
+    print(f"{'path':<10} {'recall@' + str(args.top_k):>10} {'p50 ms':>9} {'p95 ms':>9}")
+    for name, row in rows.items():
+        if "skipped" in row:
+            print(f"{name:<10} skipped ({row['skipped']})")
+        else:
+            print(f"{name:<10} {row['recall']:>10.3f} {row['p50_ms']:>9.2f} {row['p95_ms']:>9.2f}")
+    for key, value in sizes.items():
+        print(f"[Storage] {key}: {value:,.0f}")
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,86 @@
+import json, asyncio
+
+import pytest
+from aiohttp.test_utils import TestServer, TestClient
+
+from src.app.api_server import Gate, Overloaded, SERVICE_KEY, create_app
+
+def run(coro):
+    return asyncio.run(coro)
+
+def test_gate_queues_up_to_its_limit_then_rejects():
+    async def scenario():
+        gate=Gate(limit=1, queue=1, queue_timeout=5)
+        await gate.acquire()
+        waiter=asyncio.create_task(gate.acquire())
+        await asyncio.sleep(0)
+        assert gate.stats()["waiting"] == 1
+        with pytest.raises(Overloaded):
+            await gate.acquire()
+        gate.release()
+        await asyncio.wait_for(waiter, 1)
+        assert gate.stats() == {"running": 1, "waiting": 0, "limit": 1, "queue": 1, "rejected": 1}
+    run(scenario())
+
+def test_gate_queue_timeout():
+    async def scenario():
+        gate=Gate(limit=1, queue=4, queue_timeout=0.05)
+        await gate.acquire()
+        with pytest.raises(Overloaded):
+            await gate.acquire()
+        assert gate.stats()["waiting"] == 0
+    run(scenario())
+
+def sse_events(body):
+    events=[]
+    for block in body.strip().split("\n\n"):
+        lines=dict(line.split(": ", 1) for line in block.splitlines())
+        events.append((lines["event"], json.loads(lines["data"])))
+    return events
+
+async def with_client(fn):
+    app=create_app(fake=True, llm_latency_ms=0, tool_latency_ms=0)
+    async with TestClient(TestServer(app)) as client:
+        return await fn(client, app)
+
+def test_chat_streams_tokens_through_the_hedged_llm():
+    async def scenario(client, app):
+        resp=await client.post("/v1/chat", json={"session_id": "test-session-1", "input": "who are you"})
+        assert resp.status == 200
+        events=sse_events(await resp.text())
+        tokens="".join(data["text"] for event, data in events if event == "token")
+        done=[data for event, data in events if event == "done"]
+        assert done and tokens.strip() == done[0]["output"].strip() and tokens
+        resp=await client.post("/v1/chat", json={"session_id": "test-session-1", "input": "BTC price", "stream": False})
+        body=await resp.json()
+        assert resp.status == 200 and body["steps"][0]["tool"] == "Binance Search"
+    run(with_client(scenario))
+
+def test_second_turn_on_a_busy_session_is_rejected():
+    async def scenario(client, app):
+        async with app[SERVICE_KEY].session_lock("test-session-2"):
+            resp=await client.post("/v1/chat", json={"session_id": "test-session-2", "input": "hi"})
+            assert resp.status == 409
+        assert app[SERVICE_KEY].gate.stats()["running"] == 0
+    run(with_client(scenario))
+
+def test_delete_session_clears_history():
+    async def scenario(client, app):
+        await client.post("/v1/chat", json={"session_id": "test-session-3", "input": "hi", "stream": False})
+        assert app[SERVICE_KEY].store.get("test-session-3").messages
+        resp=await client.delete("/v1/sessions/test-session-3")
+        assert resp.status == 200 and app[SERVICE_KEY].store.get("test-session-3").messages == []
+    run(with_client(scenario))
+
+def test_collect_cancels_the_turn_when_the_client_goes_away():
+    from src.app.api_server import _collect
+    async def scenario():
+        turn=asyncio.create_task(asyncio.sleep(10))
+        collector=asyncio.create_task(_collect(turn, asyncio.Queue()))
+        await asyncio.sleep(0.01)
+        collector.cancel()
+        with pytest.raises(asyncio.CancelledError):
+            await collector
+        await asyncio.sleep(0)
+        assert turn.cancelled()
+    run(scenario())
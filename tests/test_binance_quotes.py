@@ -0,0 +1,17 @@
+import pytest
+
+from src.app.binance_quotes import ClientTransport, parse_symbols
+
+def test_client_transport_requests_carry_a_timeout(monkeypatch):
+    transport=ClientTransport(timeout=2.5)
+    seen={}
+    def request(method, url, **kwargs):
+        seen.update(kwargs)
+        raise ConnectionError("offline")
+    monkeypatch.setattr(transport.client.session, "request", request)
+    with pytest.raises(ConnectionError):
+        transport.get_price("BTCUSDT")
+    assert seen["timeout"] == 2.5
+
+def test_parse_symbols():
+    assert parse_symbols("BTCUSDT, ethusdt SOLUSDT btcusdt") == ["BTCUSDT", "ETHUSDT", "SOLUSDT"]
@@ -0,0 +1,74 @@
+import time
+
+from src.app.cache import LRUCache
+from src.app.answer_cache import SemanticAnswerCache
+from src.app.benchmark import HashEncoder
+
+def test_lru_evicts_least_recently_used():
+    cache=LRUCache(maxsize=2)
+    cache.set("a", 1)
+    cache.set("b", 2)
+    assert cache.get("a") == 1 # a is now most recent
+    cache.set("c", 3)
+    assert cache.get("b") is None and cache.get("a") == 1 and cache.get("c") == 3
+    assert cache.evictions == 1
+
+def test_lru_entries_expire():
+    cache=LRUCache(maxsize=4, ttl=0.05)
+    cache.set("a", 1)
+    cache.set("b", 2, ttl=10)
+    time.sleep(0.06)
+    assert cache.get("a") is None and cache.get("b") == 2
+    assert cache.stats()["hits"] == 1 and cache.stats()["misses"] == 1
+
+def answers(**kwargs):
+    return SemanticAnswerCache(HashEncoder(dim=256).encode, threshold=0.9, **kwargs)
+
+def test_answer_cache_hit_is_scoped_per_model():
+    cache=answers()
+    assert cache.store("what does LunaSpace pay", "$180k-$440k", ["VectorDB"], scope="m1")
+    entry, similarity=cache.lookup("What does LunaSpace pay?", scope="m1")
+    assert entry.answer == "$180k-$440k" and similarity > 0.99
+    assert cache.lookup("what does LunaSpace pay", scope="m2") is None
+
+def test_answer_cache_evicts_and_expires():
+    cache=answers(maxsize=2, ttl=0.05)
+    cache.store("first question here", "1")
+    cache.store("second question here", "2")
+    cache.lookup("first question here")
+    cache.store("third question here", "3")
+    assert cache.lookup("second question here") is None
+    assert cache.lookup("first question here") is not None
+    time.sleep(0.06)
+    assert cache.lookup("first question here") is None
+
+def test_volatile_and_failed_answers_are_not_stored():
+    cache=answers()
+    assert not cache.store("BTC price now", "$1", ["Binance Search"])
+    assert not cache.store("salary range", "Error occurred: boom")
+
+def test_personal_questions_are_never_shared():
+    cache=answers()
+    for question in ("what's my name?", "what did I ask earlier?", "summarise our chat",
+                     "my name is Alice and my salary is $90k, is that fair?"):
+        assert not cache.store(question, "You are Alice.")
+        assert cache.lookup(question) is None
+    assert cache.store("what does LunaSpace pay", "$180k-$440k")
+
+def test_corpus_writes_drop_vectordb_answers():
+    cache=answers()
+    cache.store("what does LunaSpace pay", "$180k-$440k", ["VectorDB"])
+    cache.store("who are you", "LUNA", [])
+    assert cache.invalidate() == 1
+    assert cache.lookup("what does LunaSpace pay") is None
+    assert cache.lookup("who are you") is not None
+
+def test_invalidate_results_runs_hooks():
+    from src.app import vector_db
+    calls=[]
+    hook=vector_db.on_invalidate(lambda: calls.append(1))
+    try:
+        vector_db.invalidate_results()
+    finally:
+        vector_db._invalidate_hooks.remove(hook)
+    assert calls == [1]
@@ -0,0 +1,34 @@
+import numpy as np
+
+from src.app.context_packing import mmr, pack, trim
+from src.app.memory import count_tokens
+from src.app.vector_storage import search_sql
+from src.app.hybrid_search import hybrid_sql
+
+def test_mmr_skips_near_duplicates():
+    similarity=np.array([[1.0, 0.99, 0.1], [0.99, 1.0, 0.1], [0.1, 0.1, 1.0]])
+    assert mmr([0.9, 0.89, 0.6], similarity, k=2, mmr_lambda=0.5) == [0, 2]
+    assert mmr([0.9, 0.89, 0.6], similarity, k=2, mmr_lambda=1.0) == [0, 1]
+
+def test_trim_keeps_the_best_matching_sentence_within_budget():
+    text=" ".join(f"Filler sentence number {i} about nothing in particular." for i in range(20))
+    text+=" The annual salary range is $180,000 - $440,000 USD."
+    out=trim(text, "what is the salary range", 30)
+    assert "salary range" in out and count_tokens(out) <= 30
+
+def test_pack_fits_the_budget_and_labels_sources():
+    rows=[{"id": i, "source_id": f"doc{i}.md" if i < 2 else None, "content": "word " * 200, "score": 0.9 - i / 10,
+           "similarities": [1.0 if i == j else 0.2 for j in range(3)]} for i in range(3)]
+    packed=pack("word", rows, k=3, budget=150)
+    assert sum(p["tokens"] for p in packed) <= 150
+    assert packed[0]["label"] == "[doc0.md | score 0.90]" and packed[2]["label"].startswith("[doc 2 |")
+
+def test_compact_search_without_detail_does_not_need_source_id():
+    for mode in ("full", "halfvec", "binary"):
+        assert "source_id" not in search_sql(mode, 256)
+
+def test_detail_sql_returns_similarities_not_vectors():
+    for sql in (search_sql("full", 256, detail=True), search_sql("binary", 256, detail=True), hybrid_sql(detail=True)):
+        assert "float4[] as similarities" in sql and "embedding::text" not in sql
+    assert "null::text as source_id" in search_sql("halfvec", 256, detail=True, has_source_id=False)
+    assert "null::text as source_id" in hybrid_sql(detail=True, has_source_id=False)
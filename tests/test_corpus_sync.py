@@ -0,0 +1,78 @@
+from src.app.corpus_sync import chunk_text, plan, content_hash
+from src.app.memory import count_tokens
+
+def test_short_text_is_one_chunk():
+    assert chunk_text("One. Two. Three.") == ["One. Two. Three."]
+    assert chunk_text("") == []
+
+def test_chunks_overlap_and_respect_the_budget():
+    text=" ".join(f"Sentence number {i} is here." for i in range(40))
+    chunks=chunk_text(text, chunk_tokens=40, overlap_tokens=10)
+    assert len(chunks) > 1
+    assert all(sum(count_tokens(s) for s in c.split(". ")) <= 40 for c in chunks) # sentences are counted separately
+    for previous, chunk in zip(chunks, chunks[1:]):
+        assert chunk.startswith(previous.split(". ")[-1]) # last sentence carried over
+
+def test_overlap_covering_the_whole_chunk_is_not_repeated():
+    # Every chunk is one sentence that fits in the overlap: carrying it would re-emit it
+    text="Alpha beta gamma delta. Epsilon zeta eta theta. Iota kappa lambda mu."
+    chunks=chunk_text(text, chunk_tokens=8, overlap_tokens=8)
+    assert chunks == ["Alpha beta gamma delta.", "Epsilon zeta eta theta.", "Iota kappa lambda mu."]
+
+def test_long_sentence_is_hard_split():
+    sentence=" ".join(f"word{i}" for i in range(400))
+    chunks=chunk_text(sentence, chunk_tokens=50, overlap_tokens=0)
+    assert len(chunks) > 1
+    assert all(count_tokens(c) <= 50 for c in chunks)
+    assert " ".join(chunks).split() == sentence.split()
+
+def test_plan_inserts_new_and_deletes_stale_chunks():
+    sources={"a.md": ("Kept.", {"source": "a.md"})}
+    existing={"a.md": {content_hash("Stale.")}, "gone.md": {content_hash("Old.")}}
+    inserts, deletes, dropped=plan(sources, existing)
+    assert [(s, c) for s, _, c, _ in inserts] == [("a.md", "Kept.")]
+    assert deletes == [("a.md", content_hash("Stale."))]
+    assert dropped == ["gone.md"]
+
+class Cursor:
+    # information_schema / pg_indexes / existing_chunks answers for an up-to-date table, or one from an old init.sql
+    def __init__(self, migrated):
+        self.migrated, self.statements, self.rows=migrated, [], []
+    def __enter__(self):
+        return self
+    def __exit__(self, *exc):
+        return False
+    def execute(self, sql, params=None):
+        self.statements.append(" ".join(sql.split()))
+        if "information_schema.columns" in sql:
+            self.rows=[("source_id",), ("content_hash",)] if self.migrated else []
+        elif "pg_indexes" in sql:
+            self.rows=[(1,)] if self.migrated else []
+        else:
+            self.rows=[("a.md", content_hash("Kept."))]
+    def fetchall(self):
+        return self.rows
+    def fetchone(self):
+        return self.rows[0] if self.rows else None
+
+class Pool:
+    def __init__(self, cur):
+        self.cur=cur
+    def cursor(self, commit=False):
+        return self.cur
+
+def test_sync_takes_no_ddl_lock_on_a_migrated_table():
+    from src.app.corpus_sync import sync
+    cur=Cursor(migrated=True)
+    stats=sync({"a.md": ("Kept.", {"source": "a.md"})}, lambda: Pool(cur), None, dry_run=True)
+    assert stats["unchanged"] == 1 and stats["inserted"] == 0
+    assert not any(s.lower().startswith(("alter", "create")) for s in cur.statements)
+
+def test_sync_adds_missing_identity_columns():
+    from src.app.corpus_sync import sync
+    cur=Cursor(migrated=False)
+    sync({}, lambda: Pool(cur), None, prune=False)
+    assert [s for s in cur.statements if s.startswith(("alter", "create"))] == [
+        "alter table documents add column if not exists source_id text",
+        "alter table documents add column if not exists content_hash text",
+        "create unique index if not exists documents_source_chunk_idx on documents (source_id, content_hash)"]
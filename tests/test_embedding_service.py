@@ -0,0 +1,30 @@
+import pytest
+
+from src.app import embedding_service
+from src.app.embedding_service import MicroBatcher, EmbeddingClient, serve
+
+def test_batches_are_split_back_per_caller():
+    batcher=MicroBatcher(lambda texts, batch_size: [[len(t)] for t in texts], max_batch=8, max_wait_ms=1)
+    assert batcher.encode("abc").tolist() == [3]
+    assert batcher.encode(["a", "bb"]).tolist() == [[1], [2]]
+
+def test_worker_survives_errors_outside_the_model(monkeypatch):
+    batcher=MicroBatcher(lambda texts, batch_size: [[1.0] for _ in texts], max_batch=1, max_wait_ms=0)
+    def broken(*args, **kwargs):
+        raise ValueError("metrics down")
+    monkeypatch.setattr(embedding_service, "observe", broken)
+    with pytest.raises(ValueError):
+        batcher.encode("x")
+    monkeypatch.undo()
+    assert batcher.encode("x").tolist() == [1.0] # the worker thread is still alive
+    assert batcher._thread.is_alive()
+
+def test_tcp_requires_an_explicit_authkey(monkeypatch):
+    monkeypatch.delenv("LUNA_EMBED_AUTHKEY", raising=False)
+    with pytest.raises(RuntimeError, match="LUNA_EMBED_AUTHKEY"):
+        serve("127.0.0.1:0", None)
+    with pytest.raises(RuntimeError, match="LUNA_EMBED_AUTHKEY"):
+        EmbeddingClient("localhost:7000")
+    assert EmbeddingClient("unix:/tmp/luna-test.sock").authkey is None
+    monkeypatch.setenv("LUNA_EMBED_AUTHKEY", "s3cret")
+    assert EmbeddingClient("localhost:7000").authkey == b"s3cret"
@@ -0,0 +1,58 @@
+from src.app import hybrid_search
+from src.app.hybrid_search import hybrid_sql, migration_sql
+
+def test_ts_config_is_a_bound_parameter(monkeypatch):
+    monkeypatch.setattr(hybrid_search, "TS_CONFIG", "english'); drop table documents; --")
+    for sql in [hybrid_sql(), hybrid_sql(detail=True)] + migration_sql():
+        assert "drop table" not in sql and "'english'" not in sql
+    assert "websearch_to_tsquery(%(ts_config)s::regconfig, %(text)s)" in hybrid_sql()
+    assert "to_tsvector(%(ts_config)s::regconfig, content)" in migration_sql()[0]
+
+def test_threshold_applies_to_fused_rows():
+    sql=hybrid_sql(thresholded=True)
+    fused=sql[sql.index("select d.content"):]
+    assert "embedding <=> %(q)s::vector <= 1 - %(threshold)s" in fused
+    assert "%(threshold)s" not in hybrid_sql()
+
+def test_filter_reaches_both_legs():
+    sql=hybrid_sql(filtered=True)
+    assert sql.count("metadata @> %(filters)s") == 2
+
+class Cursor:
+    def execute(self, sql, params):
+        self.sql, self.params=sql, params
+    def fetchall(self):
+        return []
+
+def test_hybrid_search_binds_ts_config():
+    cur=Cursor()
+    hybrid_search.hybrid_search(cur, "WebRTC", [0.0] * 4, 3, threshold=0.5, ts_config="simple")
+    assert cur.params["ts_config"] == "simple" and cur.params["threshold"] == 0.5
+    assert cur.params["candidates"] == 20
+
+class CatalogCursor(Cursor):
+    def __init__(self, expr):
+        self.expr, self.statements=expr, []
+    def execute(self, sql, params=None):
+        self.statements.append((" ".join(sql.split()), params))
+    def fetchone(self):
+        return (self.expr,) if self.expr else None
+
+def test_stored_ts_config_is_read_from_the_column():
+    assert hybrid_search.stored_ts_config(CatalogCursor("to_tsvector('simple'::regconfig, content)")) == "simple"
+    assert hybrid_search.stored_ts_config(CatalogCursor(None)) is None
+
+def test_migrate_rebuilds_content_tsv_for_another_config(monkeypatch):
+    monkeypatch.setattr(hybrid_search, "TS_CONFIG", "simple")
+    cur=CatalogCursor("to_tsvector('english'::regconfig, content)")
+    class Pool:
+        def cursor(self, commit=False):
+            return self
+        def __enter__(self):
+            return cur
+        def __exit__(self, *exc):
+            return False
+    hybrid_search.migrate(lambda: Pool())
+    sqls=[s for s, _ in cur.statements]
+    assert "alter table documents drop column content_tsv" in sqls
+    assert cur.statements[-2][1] == {"ts_config": "simple"}
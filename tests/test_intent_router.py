@@ -0,0 +1,37 @@
+import pytest
+
+from src.app.intent_router import IntentRouter, evaluate, symbols_in
+
+router=IntentRouter() # rules only
+
+@pytest.mark.parametrize("text", [
+    "What is the role of mitochondria in a cell?", "health benefits of green tea", "tips for a job interview",
+    "explain equity vs debt financing", "what are the requirements for a US visa", "what's the weather today",
+    "I'm currently learning Rust, any tips?", "write a poem about today", "how much does a link cost on chainlink",
+    "what did I ask earlier?",
+])
+def test_generic_questions_fall_through_to_the_agent(text):
+    assert router.route(text) is None
+
+@pytest.mark.parametrize("text, intent, tool_input", [
+    ("BTC price now?", "price", "BTCUSDT"),
+    ("ETH and SOL price", "price", "ETHUSDT,SOLUSDT"),
+    ("LINK price", "price", "LINKUSDT"),
+    ("price of dot", "price", "DOTUSDT"),
+    ("where is the role located", "lunaspace", "where is the role located"),
+    ("what benefits does xAI offer", "lunaspace", "what benefits does xAI offer"),
+    ("tech headlines today", "news", "tech headlines today"),
+])
+def test_obvious_questions_are_routed(text, intent, tool_input):
+    route=router.route(text)
+    assert route is not None and (route.intent, route.tool_input) == (intent, tool_input)
+
+def test_ambiguous_tickers_need_capitals_or_a_price_word():
+    assert symbols_in("send me a link to the docs") == []
+    assert symbols_in("connect the dots") == []
+    assert symbols_in("how much is SOL") == ["SOLUSDT"]
+
+def test_labelled_set_has_no_misroutes():
+    result=evaluate(router)
+    assert result["precision"] == 1.0
+    assert [m for m in result["misroutes"] if m[2] != "agent"] == []
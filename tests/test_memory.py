@@ -0,0 +1,71 @@
+import threading
+
+from langchain_core.messages import HumanMessage, AIMessage
+
+from src.app.memory import CompactingChatMessageHistory, count_tokens
+
+def turn(i):
+    return [HumanMessage(content=f"question {i}"), AIMessage(content=f"answer {i}")]
+
+def test_old_turns_are_folded_into_the_summary():
+    history=CompactingChatMessageHistory(max_turns=2)
+    for i in range(4):
+        history.add_messages(turn(i))
+    assert [m.content for m in history.recent] == ["question 2", "answer 2", "question 3", "answer 3"]
+    assert "question 0" in history.summary and "question 1" in history.summary
+    assert history.messages[0].type == "system" and history.folded_turns == 2
+
+def test_summarizer_runs_without_holding_the_history_lock():
+    started, release=threading.Event(), threading.Event()
+    def slow_summarizer(messages, previous):
+        started.set()
+        release.wait(5)
+        return ", ".join([previous] * bool(previous) + [m.content for m in messages if m.type == "human"])
+    history=CompactingChatMessageHistory(max_turns=1, summarizer=slow_summarizer)
+    history.add_messages(turn(0))
+    writer=threading.Thread(target=history.add_messages, args=(turn(1),))
+    writer.start()
+    assert started.wait(5)
+    # While the summarizer is busy, reads and writes go through, and the folded turn is still visible
+    assert "question 0" in [m.content for m in history.messages]
+    done=threading.Thread(target=history.add_messages, args=(turn(2),))
+    done.start()
+    done.join(1)
+    assert not done.is_alive()
+    release.set()
+    writer.join(5)
+    assert history.summary == "question 0, question 1"
+    assert history.folding == [] and [m.content for m in history.recent] == ["question 2", "answer 2"]
+
+def test_clear_during_summarization_discards_the_stale_summary():
+    started, release=threading.Event(), threading.Event()
+    def slow_summarizer(messages, previous):
+        started.set()
+        release.wait(5)
+        return "stale"
+    history=CompactingChatMessageHistory(max_turns=1, summarizer=slow_summarizer)
+    history.add_messages(turn(0))
+    writer=threading.Thread(target=history.add_messages, args=(turn(1),))
+    writer.start()
+    assert started.wait(5)
+    history.clear()
+    release.set()
+    writer.join(5)
+    assert history.summary == "" and history.messages == []
+
+def test_state_round_trip_keeps_unsummarized_turns():
+    history=CompactingChatMessageHistory(max_turns=1)
+    history.add_messages(turn(0))
+    history.folding=list(history.recent) # as if a summary were still being written
+    history.recent=[]
+    restored=CompactingChatMessageHistory(max_turns=1)
+    restored.load_state(history.to_state())
+    assert [m.content for m in restored.recent] == ["question 0", "answer 0"]
+
+def test_single_paragraph_summary_is_held_to_its_budget():
+    paragraph=lambda folded, previous: " ".join(f"fact{i}" for i in range(500)) # LLM-style: one long line
+    history=CompactingChatMessageHistory(max_turns=1, summary_max_tokens=50, summarizer=paragraph)
+    for i in range(3):
+        history.add_messages(turn(i))
+    assert 0 < count_tokens(history.summary) <= 50
+    assert history.summary.endswith("fact499") # the newest part is kept
@@ -0,0 +1,46 @@
+from src.app.metrics import MetricsRegistry, BUCKETS_MS, TOKEN_BUCKETS, SIZE_BUCKETS
+
+def families(text):
+    # -> {family: type}, and every sample line must belong to the family declared before it
+    types, current={}, None
+    for line in text.splitlines():
+        if line.startswith("# TYPE "):
+            _, _, name, kind=line.split()
+            assert name not in types, f"{name} declared twice"
+            types[name]=kind
+            current=name
+        else:
+            sample=line.split("{")[0].split()[0]
+            suffixes=("_bucket", "_sum", "_count") if types[current] == "histogram" else ("",)
+            assert any(sample == current + s for s in suffixes), f"{sample} under # TYPE {current}"
+    return types
+
+def test_prometheus_exposition_declares_each_family_once():
+    metrics=MetricsRegistry()
+    for v in (3, 40, 700):
+        metrics.observe("luna_tool_ms", v, tool="Search")
+    metrics.observe("luna_tool_ms", 12, tool="VectorDB")
+    metrics.observe("luna_prompt_tokens", 1200)
+    text=metrics.render_prometheus()
+    assert families(text) == {"luna_prompt_tokens": "histogram", "luna_tool_ms": "histogram",
+                              "luna_prompt_tokens_window": "gauge", "luna_tool_ms_window": "gauge"}
+    assert 'luna_tool_ms_bucket{tool="Search",le="5"} 1' in text
+    assert 'luna_tool_ms_bucket{tool="Search",le="+Inf"} 3' in text
+    assert 'luna_tool_ms_count{tool="Search"} 3' in text
+    assert 'luna_tool_ms_window{tool="Search",quantile="0.5"} 40.000' in text
+
+def test_non_latency_series_get_their_own_buckets():
+    metrics=MetricsRegistry()
+    metrics.set_buckets("luna_custom", (1, 2))
+    for name in ("luna_turn_total_ms", "luna_context_tokens", "luna_embed_batch_size", "luna_custom"):
+        metrics.observe(name, 1)
+    buckets={name: hist.buckets for (name, _), hist in metrics._series.items()}
+    assert buckets == {"luna_turn_total_ms": BUCKETS_MS, "luna_context_tokens": TOKEN_BUCKETS,
+                       "luna_embed_batch_size": SIZE_BUCKETS, "luna_custom": (1, 2)}
+
+def test_snapshot_quantiles():
+    metrics=MetricsRegistry()
+    for v in range(1, 101):
+        metrics.observe("luna_router_ms", v)
+    row=metrics.snapshot()["luna_router_ms"]
+    assert row["count"] == 100 and row["p50"] == 51 and row["p99"] == 100
@@ -0,0 +1,93 @@
+import time, threading
+from types import SimpleNamespace
+
+import pytest
+from langchain_core.callbacks import BaseCallbackHandler
+from langchain_core.language_models.chat_models import BaseChatModel
+from langchain_core.messages import AIMessage
+from langchain_core.outputs import ChatGeneration, ChatResult
+
+from src.app.resilience import CircuitBreaker, HedgedChatModel, DeadlineExceeded, call_with_deadline, turn_budget, call_timeout
+
+class WordModel(BaseChatModel):
+    # Streams its words from inside _generate, like ChatGroq(streaming=True)
+    text: str="hello from the model"
+    first_token_s: float=0.0
+
+    @property
+    def _llm_type(self):
+        return "word-fake"
+
+    def _generate(self, messages, stop=None, run_manager=None, **kwargs):
+        time.sleep(self.first_token_s)
+        for word in self.text.split():
+            if run_manager is not None:
+                run_manager.on_llm_new_token(word + " ")
+        return ChatResult(generations=[ChatGeneration(message=AIMessage(content=self.text))])
+
+class Tokens(BaseCallbackHandler):
+    def __init__(self):
+        self.tokens=[]
+        self.script_ctx=[]
+
+    def on_llm_new_token(self, token, **kwargs):
+        from streamlit.runtime.scriptrunner import get_script_run_ctx
+        self.tokens.append(token)
+        self.script_ctx.append(get_script_run_ctx(suppress_warning=True))
+
+def test_breaker_opens_after_consecutive_failures_then_probes():
+    breaker=CircuitBreaker("test-open", failures=3, reset_after=0.05)
+    for _ in range(2):
+        breaker.record_failure()
+    assert breaker.allow() and breaker.state == "closed"
+    breaker.record_failure()
+    assert breaker.state == "open" and not breaker.allow()
+    time.sleep(0.06)
+    assert breaker.allow() and breaker.state == "half_open"
+    assert not breaker.allow() # one probe at a time
+    breaker.record_failure()
+    assert breaker.state == "open" and breaker.trips == 1
+    time.sleep(0.06)
+    assert breaker.allow()
+    breaker.record_success()
+    assert breaker.state == "closed" and breaker.allow()
+
+def test_breaker_success_resets_the_count():
+    breaker=CircuitBreaker("test-reset", failures=2, reset_after=30)
+    breaker.record_failure()
+    breaker.record_success()
+    breaker.record_failure()
+    assert breaker.state == "closed"
+
+def test_deadline_and_turn_budget():
+    with pytest.raises(DeadlineExceeded):
+        call_with_deadline(time.sleep, 0.5, timeout=0.05)
+    with turn_budget(0.2):
+        assert call_timeout(10) <= 0.2
+    assert call_timeout(10) == 10
+
+def test_primary_tokens_reach_the_caller_with_its_streamlit_context():
+    llm=HedgedChatModel(primary=WordModel(), hedge=None, primary_name="test-stream", hedge_delay_ms=1000)
+    handler=Tokens()
+    script_ctx=SimpleNamespace(pages_manager=SimpleNamespace(main_script_hash="test"))
+    result={}
+    def _turn(): # stands in for the Streamlit script thread
+        result["message"]=llm.invoke("hi", config={"callbacks": [handler]})
+    from streamlit.runtime.scriptrunner import add_script_run_ctx
+    thread=add_script_run_ctx(threading.Thread(target=_turn), script_ctx)
+    thread.start()
+    thread.join(5)
+    assert result["message"].content == "hello from the model"
+    assert "".join(handler.tokens) == "hello from the model "
+    assert all(ctx is script_ctx for ctx in handler.script_ctx)
+
+def test_losing_primary_stops_streaming_once_the_hedge_wins():
+    llm=HedgedChatModel(primary=WordModel(text="late primary answer", first_token_s=0.3),
+                        hedge=WordModel(text="hedge answer"), primary_name="test-slow", hedge_name="test-fast",
+                        hedge_delay_ms=50)
+    handler=Tokens()
+    message=llm.invoke("hi", config={"callbacks": [handler]})
+    assert message.content == "hedge answer"
+    time.sleep(0.5) # the abandoned primary finishes in the background
+    assert handler.tokens == []
+    assert llm.stats()["hedge_wins"] == 1
@@ -0,0 +1,24 @@
+import threading
+
+from src.app.search_service import SearchService, HttpBackend
+
+class SlowBackend:
+    def __init__(self):
+        self.calls=0
+        self.release=threading.Event()
+    def search(self, query):
+        self.calls+=1
+        self.release.wait(1)
+        return f"results for {query}"
+
+def test_default_backend_has_a_request_timeout():
+    service=SearchService(timeout=3)
+    assert isinstance(service.backend, HttpBackend) and service.backend.timeout == 3
+
+def test_timeout_returns_an_error_and_the_late_result_is_cached():
+    backend=SlowBackend()
+    service=SearchService(backend=backend, timeout=0.05)
+    assert "timed out" in service.run("BTC news")
+    backend.release.set()
+    service._pool.shutdown(wait=True)
+    assert service.run("  btc NEWS ") == "results for BTC news" and backend.calls == 1
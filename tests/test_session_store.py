@@ -0,0 +1,50 @@
+from langchain_core.messages import HumanMessage
+
+from src.app.memory import CompactingChatMessageHistory
+from src.app.session_store import SessionStore
+
+def store(max_sessions=1):
+    return SessionStore(CompactingChatMessageHistory, get_pool=None, max_sessions=max_sessions)
+
+def test_lru_evicts_the_least_recent_session():
+    sessions=store(max_sessions=2)
+    a=sessions.get("a")
+    sessions.get("b")
+    assert sessions.get("a") is a # a is now most recent
+    sessions.get("c")
+    assert sessions.stats()["hot"] == 2 and sessions.evictions == 1
+    assert sessions.get("a") is a
+
+def test_leased_session_is_not_evicted_mid_turn():
+    sessions=store()
+    with sessions.lease("a") as a:
+        sessions.get("b")
+        sessions.get("c")
+        assert sessions.get("a") is a # still hot despite max_sessions=1
+        a.add_messages([HumanMessage(content="hello")])
+    assert sessions.stats()["hot"] == 1 and sessions.stats()["leased"] == 0
+
+def test_changes_to_an_evicted_history_are_not_lost():
+    sessions=store()
+    a=sessions.get("a")
+    sessions.get("b") # evicts a while the caller still holds it
+    a.add_messages([HumanMessage(content="late write")])
+    assert [m.content for m in sessions.get("a").messages] == ["late write"]
+
+def test_reloading_an_evicted_session_reuses_the_held_history():
+    sessions=store()
+    a=sessions.get("a")
+    a.add_messages([HumanMessage(content="first")])
+    sessions.get("b") # evicts a
+    again=sessions.get("a") # reloaded while the old caller still holds a
+    assert again is a
+    a.add_messages([HumanMessage(content="late write")])
+    assert sessions.stats()["dirty"] >= 1
+    sessions.get("b")
+    assert [m.content for m in sessions.get("a").messages] == ["first", "late write"]
+
+def test_unreferenced_evicted_history_is_reloaded_from_its_state():
+    sessions=store()
+    sessions.get("a").add_messages([HumanMessage(content="kept")])
+    sessions.get("b")
+    assert [m.content for m in sessions.get("a").messages] == ["kept"]